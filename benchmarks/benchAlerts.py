@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+"""
+Microbenchmark for counting alerts in mapForecast
+
+Compares counting by scanning all alerts for each current, hourly and daily entry
+(getAlerts) with the interval index (AlertIndex) used by mapForecast,
+for forecasts with an increasing number of overlapping alerts.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "snweatherstation"))
+import weatherForecastOWM
+import owmFixture
+
+def entries(fc):
+    return [fc["current"]["dt"]] + [h["dt"] for h in fc["hourly"]] + [d["dt"] for d in fc["daily"]]
+
+def countScan(fc):
+    return [weatherForecastOWM.getAlerts(fc, dt) for dt in entries(fc)]
+
+def countIndex(fc):
+    alerts = weatherForecastOWM.AlertIndex(fc)
+    return [alerts.count(dt) for dt in entries(fc)]
+
+def timeit(fn, fc, repeat):
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        fn(fc)
+    return (time.perf_counter() - t0) / repeat * 1000000
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark for counting alerts")
+    parser.add_argument("-n", "--repeat", type=int, default=200, help="Number of repetitions")
+    parser.add_argument("-a", "--alerts", type=int, nargs="+", default=[0, 5, 20, 50, 200], help="Numbers of alerts")
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>10} {:>16}".format("alerts", "scan us", "index us", "speedup", "mapForecast us"))
+    for n in args.alerts:
+        fc = owmFixture.oneCall(alerts=n)
+        if countScan(fc) != countIndex(fc):
+            raise ValueError("Alert counts differ for " + str(n) + " alerts")
+        tScan = timeit(countScan, fc, args.repeat)
+        tIndex = timeit(countIndex, fc, args.repeat)
+        tMap = timeit(lambda fc: weatherForecastOWM.mapForecast(fc, "2021-01-01 00:00:00"), fc, args.repeat)
+        print("{:>8} {:>12.1f} {:>12.1f} {:>10.1f} {:>16.1f}".format(n, tScan, tIndex, tScan / tIndex, tMap))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+Benchmark for storing a forecast in the database
+
+Compares the row-by-row path (forecastToDb, alertsToDb) with the bulk path
+(forecastToDbBulk) and reports database round trips, commits and elapsed time.
+The bulk path is measured once writing all rows and once for refreshes
+with an unchanged forecast, where essentially only the current forecast row is written.
+
+Without a configuration file, a simulated connection is used which charges
+a configurable latency per round trip and per commit.
+With a weatherstation configuration file (-c), the configured MariaDB is used.
+With --sqlite, a local SQLite file is used (see storage.SqliteBackend).
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "snweatherstation"))
+import weatherForecastOWM
+import storage
+import owmFixture
+
+class CountingCursor:
+    """
+    Cursor wrapper counting round trips
+    """
+    def __init__(self, stats, cur=None, rtt=0.0):
+        self.stats = stats
+        self.cur = cur
+        self.rtt = rtt
+
+    def execute(self, stmt, params=None):
+        self.stats["roundTrips"] = self.stats["roundTrips"] + 1
+        self.stats["rows"] = self.stats["rows"] + 1
+        if self.cur:
+            if params is None:
+                self.cur.execute(stmt)
+            else:
+                self.cur.execute(stmt, params)
+        else:
+            time.sleep(self.rtt)
+
+    def executemany(self, stmt, params):
+        self.stats["roundTrips"] = self.stats["roundTrips"] + 1
+        self.stats["rows"] = self.stats["rows"] + len(params)
+        if self.cur:
+            self.cur.executemany(stmt, params)
+        else:
+            time.sleep(self.rtt)
+
+    def fetchall(self):
+        if self.cur:
+            return self.cur.fetchall()
+        return []
+
+    def __iter__(self):
+        if self.cur:
+            return iter(self.cur)
+        return iter([])
+
+class CountingConnection:
+    """
+    Connection wrapper counting commits
+    """
+    def __init__(self, stats, con=None, commitTime=0.0):
+        self.stats = stats
+        self.con = con
+        self.commitTime = commitTime
+
+    def commit(self):
+        self.stats["commits"] = self.stats["commits"] + 1
+        if self.con:
+            self.con.commit()
+        else:
+            time.sleep(self.commitTime)
+
+    def rollback(self):
+        if self.con:
+            self.con.rollback()
+
+def newStats():
+    return {"roundTrips": 0, "commits": 0, "rows": 0}
+
+def runRowByRow(fc, cfg, curTs, curDate, dbCon, dbCur):
+    fcData = weatherForecastOWM.mapForecast(fc, curTs)
+    weatherForecastOWM.forecastToDb(fcData, cfg, curTs, curDate, dbCon, dbCur, False)
+    weatherForecastOWM.alertsToDb(fc, cfg, dbCon, dbCur, False)
+
+def runBulk(fc, cfg, curTs, curDate, dbCon, dbCur):
+    # Without forecast image, all rows are written
+    weatherForecastOWM.fcImages.clear()
+    fcData = weatherForecastOWM.mapForecast(fc, curTs)
+    weatherForecastOWM.forecastToDbBulk(fc, fcData, cfg, curTs, curDate, dbCon, dbCur, False)
+
+def runDiff(fc, cfg, curTs, curDate, dbCon, dbCur):
+    # With forecast image, only changed rows are written
+    fcData = weatherForecastOWM.mapForecast(fc, curTs)
+    weatherForecastOWM.forecastToDbBulk(fc, fcData, cfg, curTs, curDate, dbCon, dbCur, False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark for storing forecasts in the database")
+    parser.add_argument("-c", "--config", help="weatherstation configuration file with dbConnection and forecastTables")
+    parser.add_argument("--sqlite", help="SQLite database file (created if necessary)")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="Number of refreshes per variant")
+    parser.add_argument("--rtt", type=float, default=1.0, help="Simulated round trip time in ms")
+    parser.add_argument("--commit", type=float, default=10.0, help="Simulated commit (fsync) time in ms")
+    parser.add_argument("--alerts", type=int, default=5, help="Number of alerts in the forecast")
+    args = parser.parse_args()
+
+    cfg = {"forecast": {"forecastRetain": 4, "forecastTables": {
+        "hourlyForecast": "weatherforecast", "dailyForecast": "dailyforecast", "alertsForecast": "alerts"}}}
+    backend = None
+    if args.config:
+        with open(args.config, "r") as f:
+            conf = json.load(f)
+        cfg["forecast"]["forecastTables"] = conf["forecast"]["forecastTables"]
+        backend = storage.MariaDbBackend(
+            host=conf["dbConnection"]["host"],
+            port=conf["dbConnection"]["port"],
+            database=conf["dbConnection"]["database"],
+            user=conf["dbConnection"]["user"],
+            password=conf["dbConnection"]["password"]
+        )
+    elif args.sqlite:
+        backend = storage.SqliteBackend(args.sqlite, {kind: [tbl] for kind, tbl in cfg["forecast"]["forecastTables"].items()})
+    con = None
+    if backend:
+        storage.setBackend(backend)
+        con = backend.connect()
+
+    fc = owmFixture.oneCall(alerts=args.alerts)
+    startDateTime = datetime.datetime.now()
+    refresh = 0
+
+    print("{:12} {:>12} {:>10} {:>10} {:>12}".format("variant", "round trips", "commits", "rows", "ms/refresh"))
+    for name, fn in [("row-by-row", runRowByRow), ("bulk", runBulk), ("bulk-diff", runDiff)]:
+        stats = newStats()
+        if con:
+            dbCon = CountingConnection(stats, con)
+            dbCur = CountingCursor(stats, con.cursor())
+        else:
+            dbCon = CountingConnection(stats, commitTime=args.commit / 1000)
+            dbCur = CountingCursor(stats, rtt=args.rtt / 1000)
+        t0 = time.perf_counter()
+        for i in range(args.repeat):
+            # Refreshes every 10 minutes
+            curDateTime = startDateTime + datetime.timedelta(minutes=10 * refresh)
+            refresh = refresh + 1
+            curTs = curDateTime.strftime("%Y-%m-%d %H:%M:%S")
+            curDate = curDateTime.strftime("%Y-%m-%d")
+            fn(fc, cfg, curTs, curDate, dbCon, dbCur)
+        elapsed = (time.perf_counter() - t0) / args.repeat
+        print("{:12} {:>12} {:>10} {:>10} {:>12.1f}".format(
+            name, stats["roundTrips"] // args.repeat, stats["commits"] // args.repeat,
+            stats["rows"] // args.repeat, elapsed * 1000))
+
+    if con:
+        con.close()
+
+if __name__ == "__main__":
+    main()
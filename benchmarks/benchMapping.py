@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""
+Benchmark for mapping a forecast
+
+Compares the row mapping (mapForecast, one dictionary per row) with the
+columnar mapping (mapForecastColumns, typed column arrays with null masks).
+Reported are the time for mapping only and the time and memory allocated
+for mapping including the conversion into the (key, values) pairs consumed by forecastToDbBulk.
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "snweatherstation"))
+import weatherForecastOWM
+import owmFixture
+
+def mapRows(fc, ts):
+    return weatherForecastOWM.mapForecast(fc, ts)
+
+def mapColumns(fc, ts):
+    return weatherForecastOWM.mapForecastColumns(fc, ts)
+
+def runRows(fc, ts):
+    return weatherForecastOWM.forecastEntries(weatherForecastOWM.mapForecast(fc, ts))
+
+def runColumns(fc, ts):
+    return weatherForecastOWM.forecastEntries(weatherForecastOWM.mapForecastColumns(fc, ts))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark for mapping forecasts")
+    parser.add_argument("-n", "--repeat", type=int, default=500, help="Number of repetitions")
+    parser.add_argument("--alerts", type=int, default=5, help="Number of alerts in the forecast")
+    args = parser.parse_args()
+
+    fc = owmFixture.oneCall(alerts=args.alerts)
+    ts = "2021-01-01 00:00:00"
+
+    print("{:10} {:>10} {:>12} {:>14} {:>14}".format("mapping", "us map", "us entries", "KiB allocated", "KiB retained"))
+    for name, mapFn, fn in [("rows", mapRows, runRows), ("columns", mapColumns, runColumns)]:
+        t0 = time.perf_counter()
+        for i in range(args.repeat):
+            mapFn(fc, ts)
+        mapElapsed = (time.perf_counter() - t0) / args.repeat
+
+        t0 = time.perf_counter()
+        for i in range(args.repeat):
+            fn(fc, ts)
+        elapsed = (time.perf_counter() - t0) / args.repeat
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        res = fn(fc, ts)
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+        print("{:10} {:>10.1f} {:>12.1f} {:>14.1f} {:>14.1f}".format(name, mapElapsed * 1000000, elapsed * 1000000, peak / 1024, retained / 1024))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+"""
+Synthetic OpenWeatherMap One Call responses for benchmarks
+"""
+import random
+import time
+
+def oneCall(t0=None, hours=48, days=8, alerts=2, seed=1):
+    """
+    Return a synthetic One Call response
+
+    Input:
+    - t0    : Epoch of the current hour (default: current hour)
+    - hours : Number of hourly forecast entries
+    - days  : Number of daily forecast entries
+    - alerts: Number of alerts, overlapping at random
+    - seed  : Seed for random values
+    """
+    rnd = random.Random(seed)
+    if t0 is None:
+        t0 = int(time.time() // 3600 * 3600)
+
+    def weather():
+        return [{"id": 800, "main": "Clear", "description": "Klarer Himmel", "icon": "01d"}]
+
+    def hour(dt):
+        res = {
+            "dt": dt,
+            "temp": round(rnd.uniform(-5, 30), 2),
+            "humidity": rnd.randint(20, 100),
+            "pressure": rnd.randint(980, 1040),
+            "clouds": rnd.randint(0, 100),
+            "uvi": round(rnd.uniform(0, 8), 2),
+            "visibility": 10000,
+            "wind_speed": round(rnd.uniform(0, 20), 2),
+            "wind_deg": rnd.randint(0, 359),
+            "weather": weather()
+        }
+        if rnd.random() < 0.3:
+            res["rain"] = {"1h": round(rnd.uniform(0, 5), 2)}
+        return res
+
+    current = hour(t0 + 1234)
+    hourly = [hour(t0 + 3600 * i) for i in range(hours)]
+    daily = list()
+    for i in range(days):
+        dt = t0 + 86400 * i
+        daily.append({
+            "dt": dt,
+            "sunrise": dt - 18000,
+            "sunset": dt + 25000,
+            "temp": {"morn": 5.0, "day": 15.0, "eve": 12.0, "night": 3.0, "min": 2.0, "max": 16.0},
+            "humidity": rnd.randint(20, 100),
+            "pressure": rnd.randint(980, 1040),
+            "wind_speed": round(rnd.uniform(0, 20), 2),
+            "wind_deg": rnd.randint(0, 359),
+            "clouds": rnd.randint(0, 100),
+            "uvi": round(rnd.uniform(0, 8), 2),
+            "pop": round(rnd.random(), 2),
+            "rain": round(rnd.uniform(0, 20), 2),
+            "weather": weather()
+        })
+
+    alertList = list()
+    for i in range(alerts):
+        start = t0 + rnd.randint(-24, 24 * days) * 3600
+        alertList.append({
+            "sender_name": "Deutscher Wetterdienst",
+            "event": "Sturmböen {}".format(i),
+            "start": start,
+            "end": start + rnd.randint(1, 72) * 3600,
+            "description": "Es treten Sturmböen mit Geschwindigkeiten um 70 km/h auf. Vereinzelt 'Orkanböen'."
+        })
+
+    return {"lat": 54.19, "lon": 7.87, "current": current, "hourly": hourly, "daily": daily, "alerts": alertList}
@@ -152,7 +152,7 @@ setup(
     #
     # Similar to `install_requires` above, these must be valid existing
     # projects.
-    extras_require={"dev": []},  # Optional
+    extras_require={"dev": [], "tools": ["numpy", "pyarrow"]},  # Optional
     # If there are data files included in your packages that need to be
     # installed, specify them here.
     #
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+"""
+Module for recomputing the reduced pressure of stored measurements
+
+The reduced pressure is calculated from the measured pressure, the temperature
+and the station height when a measurement is taken. If the configured height
+was wrong, the pressure of the complete history can be recomputed with
+
+    python backfill.py [-c CONFIG] [--height HEIGHT] [--start DATE] [--end DATE]
+
+Measurements are read in chunks through a streaming cursor, so that memory
+does not depend on the size of the table. For each chunk, the reduced pressure
+is calculated with NumPy and written back with one batched update per chunk,
+which is committed separately. An interrupted backfill can therefore simply
+be repeated.
+
+If rollup tables are configured, they are rebuilt afterwards.
+"""
+import sys
+import time
+import itertools
+import storage
+import rollup
+import toolConfig
+import stationSensors
+from records import SENSOR_COLUMN
+from barometric import pressureReducedArray
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Number of rows per chunk
+CHUNK_SIZE = 10000
+
+class PressureBackfill:
+    """
+    Class recomputing the reduced pressure of a measurement table
+    """
+    def __init__(self, backend, table, height, chunkSize=CHUNK_SIZE):
+        """
+        Constructor for PressureBackfill
+
+        Input:
+        - backend  : Storage backend
+        - table    : Measurement table
+        - height   : Height of the measurement station in m
+        - chunkSize: Number of rows read, computed and updated together
+        """
+        self.backend = backend
+        self.table = table
+        self.height = height
+        self.chunkSize = chunkSize
+
+        self.stats = {
+            "rowsRead"     : 0,
+            "rowsUpdated"  : 0,
+            "chunks"       : 0,
+            "runTime"      : 0.0,
+            "rowsPerSecond": 0.0
+        }
+
+    def selectStmt(self, start=None, end=None):
+        """
+        Return the statement reading the measurements and its parameters
+        """
+        stmt = "SELECT timestamp, pressure_m, temperature FROM " + self.table
+        cond = list()
+        params = list()
+        if start:
+            cond.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            cond.append("timestamp < ?")
+            params.append(end)
+        if len(cond) > 0:
+            stmt = stmt + " WHERE " + " AND ".join(cond)
+        return stmt, tuple(params)
+
+    def updateStmt(self):
+        """
+        Return the statement updating the reduced pressure
+        """
+        return "UPDATE " + self.table + " SET pressure = ? WHERE timestamp = ?"
+
+    def computeChunk(self, rows):
+        """
+        Return the update parameters (pressure, timestamp) for a chunk of rows
+
+        Rows without measured pressure are not updated.
+        """
+        ts, pm, t = zip(*rows)
+        p0 = pressureReducedArray([v if v is not None else float("nan") for v in pm],
+                                  self.height,
+                                  [v if v is not None else float("nan") for v in t])
+        valid = [v is not None for v in pm]
+        return list(zip(itertools.compress(p0.tolist(), valid), itertools.compress(ts, valid)))
+
+    def run(self, start=None, end=None):
+        """
+        Recompute the reduced pressure for all measurements in the given period
+
+        Input:
+        - start: First timestamp (None: from the beginning)
+        - end  : Timestamp up to which measurements are recomputed, exclusive (None: until the end)
+
+        Returns the statistics
+        """
+        t0 = time.perf_counter()
+        # Reading and writing use separate connections,
+        # because the reading connection is busy until the result is read completely
+        rcon = self.backend.connect()
+        wcon = self.backend.connect()
+        try:
+            rcur = self.backend.streamCursor(rcon)
+            wcur = self.backend.cursor(wcon)
+            stmt, params = self.selectStmt(start, end)
+            logger.debug(stmt)
+            rcur.execute(stmt, params)
+            upd = self.updateStmt()
+            while True:
+                rows = rcur.fetchmany(self.chunkSize)
+                if len(rows) == 0:
+                    break
+                values = self.computeChunk(rows)
+                wcur.executemany(upd, values)
+                wcon.commit()
+                self.stats["rowsRead"] = self.stats["rowsRead"] + len(rows)
+                self.stats["rowsUpdated"] = self.stats["rowsUpdated"] + len(values)
+                self.stats["chunks"] = self.stats["chunks"] + 1
+                elapsed = time.perf_counter() - t0
+                logger.info("%s rows recomputed (%.0f rows/s)", self.stats["rowsRead"], self.stats["rowsRead"] / elapsed)
+        finally:
+            rcon.close()
+            wcon.close()
+        self.stats["runTime"] = time.perf_counter() - t0
+        if self.stats["runTime"] > 0:
+            self.stats["rowsPerSecond"] = self.stats["rowsRead"] / self.stats["runTime"]
+        return self.getStats()
+
+    def getStats(self):
+        """
+        Return backfill statistics
+
+        - rowsRead     : Number of measurements read
+        - rowsUpdated  : Number of measurements updated
+        - chunks       : Number of chunks (transactions)
+        - runTime      : Time in s
+        - rowsPerSecond: Throughput in rows read per second
+        """
+        return self.stats.copy()
+
+def main():
+    parser = toolConfig.argumentParser("Recompute the reduced pressure of stored measurements")
+    parser.add_argument("--height", type=float, help="Height of the station in m (default: height from config file)")
+    parser.add_argument("--start", help="First timestamp to be recomputed (%%Y-%%m-%%d [%%H:%%M:%%S])")
+    parser.add_argument("--end", help="Timestamp up to which measurements are recomputed, exclusive")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="Number of rows per chunk (default: %(default)s)")
+    args = parser.parse_args()
+    toolConfig.setupLogging(args)
+
+    conf = toolConfig.loadConfig(args.config)
+    height = args.height if args.height is not None else conf["height"]
+    if height is None:
+        print("Height is neither configured nor specified with --height")
+        sys.exit(1)
+    table = conf["dbConnection"]["table"]
+    if SENSOR_COLUMN in stationSensors.measurementTables(conf).get(table, []):
+        print("Table {} is shared by several sensors. Backfill is not supported".format(table))
+        sys.exit(1)
+    backend = toolConfig.backendFromConfig(conf)
+    backfill = PressureBackfill(backend, table, height, args.chunk)
+    try:
+        stats = backfill.run(args.start, args.end)
+        print("{} rows read, {} rows updated in {:.1f} s ({:.0f} rows/s)".format(
+            stats["rowsRead"], stats["rowsUpdated"], stats["runTime"], stats["rowsPerSecond"]))
+
+        measRollup = rollup.Rollup.fromConfig(table, conf["rollup"])
+        if measRollup and stats["rowsUpdated"] > 0:
+            con = backend.connect()
+            try:
+                measRollup.rebuild(con, con.cursor())
+            finally:
+                con.close()
+            print("Rollup tables rebuilt")
+    except storage.DB_ERRORS as e:
+        print("Backfill failed: {}".format(e))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""
+Module for the reduction of atmospheric pressure to sea level
+
+pressureReduced calculates the reduced pressure for a single measurement.
+pressureReducedArray calculates it for arrays of measurements with NumPy,
+e.g. for recomputing the history after the station height has been corrected.
+Both yield the same values.
+
+Source: https://de.wikipedia.org/wiki/Barometrische_H%C3%B6henformel
+"""
+import math
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Constants
+g0 = 9.80665    # Gravitational acceleration (m/s**2)
+R  = 287.05     # Universal gas constant (m**2/s**2 K)
+t0 = 273.15     # Absolute temperature 0°C (K)
+a  = 0.0065     # Vertical temperature gradient
+C  = 0.12       # Parameter for consideration of vapor pressure
+tl = 9.1        # Temperature threshold for approximation of vapor pressure (°C)
+
+def pressureReduced(p, h, t):
+    """
+    Calculate reducet atmospheric pressure according to Barometric formula.
+
+    Input:
+    p: pressure at height h (in hPa)
+    h: height of measurement station in m
+    t: Temperature in °C
+    """
+    p0 = p
+    if (h != None) and (t != None):
+        if t < tl:
+            E = 5.6402 * (-0.0916 + math.exp(0.06 * t))
+        else:
+            E = 18.2194 * (1.0463 - math.exp(-0.0666 * t))
+
+        x = g0 * h / (R * (t + t0 + C * E + a * h / 2))
+
+        p0 = p * math.exp(x)
+
+    logger.debug("p0(p=%s, h=%s, t=%s) = %s", p, h, t, p0)
+
+    return p0
+
+def pressureReducedArray(p, h, t):
+    """
+    Calculate reduced atmospheric pressure for arrays of measurements
+
+    Missing values (None or NaN) in p result in NaN.
+    Where t is missing, or if h is None, the pressure is not reduced (as for pressureReduced).
+
+    Input:
+    p: Sequence or NumPy array of pressures at height h (in hPa)
+    h: height of measurement station in m
+    t: Sequence or NumPy array of temperatures in °C
+    """
+    import numpy
+    p = numpy.asarray(p, dtype=numpy.float64)
+    if h is None:
+        return p.copy()
+    t = numpy.asarray(t, dtype=numpy.float64)
+    with numpy.errstate(invalid="ignore"):
+        E = numpy.where(t < tl,
+                        5.6402 * (-0.0916 + numpy.exp(0.06 * t)),
+                        18.2194 * (1.0463 - numpy.exp(-0.0666 * t)))
+        x = g0 * h / (R * (t + t0 + C * E + a * h / 2))
+        return numpy.where(numpy.isnan(t), p, p * numpy.exp(x))
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+"""
+Module for scheduling measurement cycles
+
+Measurement cycles start at slots which are aligned to the wall clock:
+slot k starts k * interval seconds after midnight (local time or UTC),
+so that, for example, with an interval of 900 s measurements are taken
+at every full quarter of an hour and with 7200 s at every even hour.
+Intervals may be arbitrary, also below one second.
+
+Waiting is based on the monotonic clock, so that the schedule does not drift
+with the time taken by the cycle itself and is not affected by adjustments
+of the wall clock. If the wall clock is stepped (e.g. by NTP) or the UTC offset
+changes (daylight saving time), the schedule is aligned to the wall clock again.
+
+A cycle which takes longer than the interval is an overrun.
+If the next slot has passed by less than lateTolerance, the next cycle is started
+immediately. Otherwise, the slots which have passed are missed and the next
+cycle starts at the following slot, so that measurements stay aligned.
+
+The difference between the start of a slot and the actual wake-up (jitter)
+is recorded for each cycle.
+"""
+import time
+import math
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+schedulerDefaults = {
+    "lateTolerance"  : 0.5,
+    "resyncThreshold": 1.0
+}
+
+class CycleScheduler:
+    """
+    Class scheduling measurement cycles at slots aligned to the wall clock
+    """
+    def __init__(self, interval, utc=False, lateTolerance=0.5, resyncThreshold=1.0):
+        """
+        Constructor for CycleScheduler
+
+        Input:
+        - interval       : Interval in s between cycles (> 0, may be below 1)
+        - utc            : If True, slots are aligned to UTC midnight, otherwise to local midnight
+        - lateTolerance  : Time in s by which a slot may have passed to still be used.
+                           Limited to half the interval
+        - resyncThreshold: Change of the wall clock in s relative to the monotonic clock
+                           after which the schedule is aligned again
+        """
+        if interval <= 0:
+            raise ValueError("Measurement interval must be positive: ", interval)
+        self.interval = float(interval)
+        self.utc = utc
+        self.lateTolerance = min(lateTolerance, self.interval / 2)
+        self.resyncThreshold = resyncThreshold
+        # Monotonic time of the next slot
+        self.nextSlot = None
+        # Difference between wall clock and monotonic clock when the schedule was aligned
+        self.clockOffset = None
+        # UTC offset of local time when the schedule was aligned
+        self.utcOffset = None
+
+        self.stats = {
+            "cycles"     : 0,
+            "overruns"   : 0,
+            "missedSlots": 0,
+            "resyncs"    : 0,
+            "jitterLast" : 0.0,
+            "jitterAvg"  : 0.0,
+            "jitterMax"  : 0.0
+        }
+        self.jitterSum = 0.0
+
+    @classmethod
+    def fromConfig(cls, interval, schedulerCfg, utc=False):
+        """
+        Create a scheduler from the scheduler section of the configuration
+        """
+        par = schedulerDefaults.copy()
+        if schedulerCfg:
+            par.update(schedulerCfg)
+        return cls(interval, utc, par["lateTolerance"], par["resyncThreshold"])
+
+    def localOffset(self, wall):
+        """
+        Return the offset in s of the time to which slots are aligned from UTC
+        """
+        if self.utc:
+            return 0
+        return time.localtime(wall).tm_gmtoff
+
+    def align(self, mono, wall):
+        """
+        Set the next slot to the first slot after the given time, aligned to the wall clock
+        """
+        self.clockOffset = wall - mono
+        self.utcOffset = self.localOffset(wall)
+        local = wall + self.utcOffset
+        day = math.floor(local / 86400) * 86400
+        slot = day + (math.floor((local - day) / self.interval) + 1) * self.interval
+        self.nextSlot = slot - self.utcOffset - self.clockOffset
+
+    def wait(self):
+        """
+        Wait for the start of the next cycle
+
+        Returns the wall-clock time (epoch seconds) of the slot of the cycle
+        """
+        mono = time.monotonic()
+        wall = time.time()
+        if self.nextSlot is None:
+            self.align(mono, wall)
+            return self.sleep()
+        step = wall - mono - self.clockOffset
+        zoneStep = self.localOffset(wall) - self.utcOffset
+        if abs(step) > self.resyncThreshold or zoneStep != 0:
+            self.stats["resyncs"] = self.stats["resyncs"] + 1
+            logger.warning("Wall clock changed by %.3f s. Schedule aligned again", step + zoneStep)
+            self.align(mono, wall)
+        else:
+            late = mono - self.nextSlot
+            if late >= 0:
+                # The cycle took longer than the interval
+                self.stats["overruns"] = self.stats["overruns"] + 1
+                if late > self.lateTolerance:
+                    missed = math.floor(late / self.interval) + 1
+                    self.nextSlot = self.nextSlot + missed * self.interval
+                    self.stats["missedSlots"] = self.stats["missedSlots"] + missed
+                    logger.warning("Cycle overrun by %.3f s. %s slot(s) missed", late, missed)
+                else:
+                    logger.debug("Cycle overrun by %.3f s", late)
+        return self.sleep()
+
+    def sleep(self):
+        """
+        Sleep until the next slot and record the jitter
+
+        Returns the wall-clock time of the slot
+        """
+        while True:
+            waitTime = self.nextSlot - time.monotonic()
+            if waitTime <= 0:
+                break
+            time.sleep(waitTime)
+
+        slot = self.nextSlot
+        jitter = (time.monotonic() - slot) * 1000
+        self.nextSlot = slot + self.interval
+        self.stats["cycles"] = self.stats["cycles"] + 1
+        self.jitterSum = self.jitterSum + jitter
+        self.stats["jitterLast"] = jitter
+        self.stats["jitterAvg"] = self.jitterSum / self.stats["cycles"]
+        if jitter > self.stats["jitterMax"]:
+            self.stats["jitterMax"] = jitter
+        return slot + self.clockOffset
+
+    def getStats(self):
+        """
+        Return scheduler statistics
+
+        - cycles     : Number of cycles started
+        - overruns   : Number of cycles which took longer than the interval
+        - missedSlots: Number of slots skipped because of overruns
+        - resyncs    : Number of alignments after changes of the wall clock
+        - jitterLast : Delay in ms of the last wake-up after the start of its slot
+        - jitterAvg  : Average delay in ms of wake-ups
+        - jitterMax  : Maximum delay in ms of wake-ups
+        """
+        return self.stats.copy()
@@ -75,3 +75,76 @@ CREATE TABLE `alerts` (
 COLLATE='utf8_general_ci'
 ENGINE=InnoDB
 ;
+CREATE TABLE `weatherdata_hourly` (
+	`timestamp` TIMESTAMP NOT NULL DEFAULT current_timestamp() COMMENT 'Start of hour',
+	`temperature_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum temperature in °C',
+	`temperature_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum temperature in °C',
+	`temperature_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average temperature in °C',
+	`temperature_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of temperature values',
+	`humidity_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum humidity in %',
+	`humidity_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum humidity in %',
+	`humidity_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average humidity in %',
+	`humidity_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of humidity values',
+	`pressure_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum reduced atmospheric pressure in hPa',
+	`pressure_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum reduced atmospheric pressure in hPa',
+	`pressure_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average reduced atmospheric pressure in hPa',
+	`pressure_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of pressure values',
+	`pressure_m_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum measured atmospheric pressure in hPa',
+	`pressure_m_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum measured atmospheric pressure in hPa',
+	`pressure_m_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average measured atmospheric pressure in hPa',
+	`pressure_m_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of pressure_m values',
+	PRIMARY KEY (`timestamp`) USING BTREE
+)
+COLLATE='utf8_general_ci'
+ENGINE=InnoDB
+;
+CREATE TABLE `weatherdata_daily` (
+	`date` DATE NOT NULL COMMENT 'Date',
+	`temperature_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum temperature in °C',
+	`temperature_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum temperature in °C',
+	`temperature_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average temperature in °C',
+	`temperature_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of temperature values',
+	`humidity_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum humidity in %',
+	`humidity_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum humidity in %',
+	`humidity_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average humidity in %',
+	`humidity_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of humidity values',
+	`pressure_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum reduced atmospheric pressure in hPa',
+	`pressure_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum reduced atmospheric pressure in hPa',
+	`pressure_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average reduced atmospheric pressure in hPa',
+	`pressure_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of pressure values',
+	`pressure_m_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum measured atmospheric pressure in hPa',
+	`pressure_m_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum measured atmospheric pressure in hPa',
+	`pressure_m_avg` FLOAT NULL DEFAULT NULL COMMENT 'Average measured atmospheric pressure in hPa',
+	`pressure_m_count` INT(11) NOT NULL DEFAULT '0' COMMENT 'Number of pressure_m values',
+	PRIMARY KEY (`date`) USING BTREE
+)
+COLLATE='utf8_general_ci'
+ENGINE=InnoDB
+;
+ALTER TABLE `weatherdata`
+	ADD COLUMN `temperature_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum temperature in °C within the interval',
+	ADD COLUMN `temperature_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum temperature in °C within the interval',
+	ADD COLUMN `temperature_sd` FLOAT NULL DEFAULT NULL COMMENT 'Standard deviation of temperature in °C within the interval',
+	ADD COLUMN `humidity_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum humidity in % within the interval',
+	ADD COLUMN `humidity_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum humidity in % within the interval',
+	ADD COLUMN `humidity_sd` FLOAT NULL DEFAULT NULL COMMENT 'Standard deviation of humidity in % within the interval',
+	ADD COLUMN `pressure_m_min` FLOAT NULL DEFAULT NULL COMMENT 'Minimum measured atmospheric pressure in hPa within the interval',
+	ADD COLUMN `pressure_m_max` FLOAT NULL DEFAULT NULL COMMENT 'Maximum measured atmospheric pressure in hPa within the interval',
+	ADD COLUMN `pressure_m_sd` FLOAT NULL DEFAULT NULL COMMENT 'Standard deviation of measured atmospheric pressure in hPa within the interval',
+	ADD COLUMN `samples` INT NULL DEFAULT NULL COMMENT 'Number of sensor reads within the interval'
+;
+CREATE TABLE `weatherdata_outdoor` (
+	`timestamp` TIMESTAMP NOT NULL DEFAULT current_timestamp() COMMENT 'Time',
+	`date` DATE NOT NULL COMMENT 'Date',
+	`time` TIME NOT NULL COMMENT 'Time',
+	`temperature` FLOAT NULL DEFAULT NULL COMMENT 'Temperature in °C',
+	`humidity` FLOAT NULL DEFAULT NULL COMMENT 'Humidity in %',
+	`pressure_m` FLOAT NULL DEFAULT NULL COMMENT 'Measured atmospheric pressure in hPa',
+	`pressure` FLOAT NULL DEFAULT NULL COMMENT 'Reduced atmospheric pressure in hPa',
+	`altitude` FLOAT NULL DEFAULT NULL COMMENT 'Altitude',
+	`sensor` VARCHAR(32) NOT NULL COMMENT 'Sensor id',
+	PRIMARY KEY (`timestamp`, `sensor`) USING BTREE
+)
+COLLATE='utf8_general_ci'
+ENGINE=InnoDB
+;
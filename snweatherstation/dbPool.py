@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+"""
+Module for pooled database connections
+
+A pool holds a small number of connections which are checked out for a unit of work
+and returned afterwards. Connections which have been idle for some time are checked
+with a ping before they are handed out, so that connections closed by a server restart
+or by the server's idle timeout are replaced transparently.
+
+If the database cannot be reached, new connection attempts are delayed
+with exponentially increasing intervals.
+"""
+import threading
+import time
+import storage
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+poolDefaults = {
+    "size"               : 2,
+    "timeout"            : 30,
+    "healthCheckInterval": 60,
+    "reconnectInterval"  : 5,
+    "reconnectMax"       : 300
+}
+
+class ConnectionPool:
+    """
+    Class representing a pool of database connections
+    """
+    def __init__(self, backend, name="db", size=2, timeout=30, healthCheckInterval=60, reconnectInterval=5, reconnectMax=300):
+        """
+        Constructor for ConnectionPool
+
+        Input:
+        - backend            : Storage backend providing connections
+        - name               : Name of the pool used for logging
+        - size               : Maximum number of connections
+        - timeout            : Maximum time in s to wait for a free connection
+        - healthCheckInterval: Idle time in s after which a connection is checked before use
+        - reconnectInterval  : Delay in s before the first reconnection attempt
+        - reconnectMax       : Maximum delay in s between reconnection attempts
+        """
+        self.backend = backend
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+        self.healthCheckInterval = healthCheckInterval
+        self.reconnectInterval = reconnectInterval
+        self.reconnectMax = reconnectMax
+        self.reconnectDelay = reconnectInterval
+        self.nextConnect = 0
+        self.failed = False
+
+        self.lock = threading.Condition()
+        self.idle = list()
+        self.connections = 0
+
+        self.stats = {
+            "checkouts"     : 0,
+            "waits"         : 0,
+            "waitTime"      : 0.0,
+            "connects"      : 0,
+            "reconnects"    : 0,
+            "connectErrors" : 0,
+            "healthChecks"  : 0,
+            "healthFailures": 0,
+            "discarded"     : 0
+        }
+
+    @classmethod
+    def fromConfig(cls, backend, name, poolCfg):
+        """
+        Create a pool from the dbPool section of the configuration
+        """
+        par = poolDefaults.copy()
+        if poolCfg:
+            par.update(poolCfg)
+        return cls(backend, name, **par)
+
+    def timeToConnect(self):
+        """
+        Return the number of seconds until a new connection may be attempted
+        """
+        return max(0, self.nextConnect - time.monotonic())
+
+    def acquire(self, timeout=None):
+        """
+        Check out a connection
+
+        Raises storage.StorageError or a database error if the database is not available
+        or no connection becomes free within the timeout.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            if len(self.idle) == 0 and self.connections >= self.size:
+                self.stats["waits"] = self.stats["waits"] + 1
+                t0 = time.monotonic()
+                self.lock.wait_for(lambda: len(self.idle) > 0 or self.connections < self.size, timeout)
+                self.stats["waitTime"] = self.stats["waitTime"] + time.monotonic() - t0
+                if len(self.idle) == 0 and self.connections >= self.size:
+                    raise storage.StorageError("No free connection in pool " + self.name)
+
+            if len(self.idle) > 0:
+                con, lastUsed = self.idle.pop()
+            else:
+                con, lastUsed = None, None
+                self.connections = self.connections + 1
+            self.stats["checkouts"] = self.stats["checkouts"] + 1
+
+        try:
+            if con and time.monotonic() - lastUsed >= self.healthCheckInterval:
+                con = self.check(con)
+            if con is None:
+                con = self.connect()
+        except Exception:
+            with self.lock:
+                self.connections = self.connections - 1
+                self.lock.notify()
+            raise
+        return con
+
+    def check(self, con):
+        """
+        Check an idle connection
+
+        Returns the connection or None if it is no longer usable
+        """
+        with self.lock:
+            self.stats["healthChecks"] = self.stats["healthChecks"] + 1
+        try:
+            self.backend.ping(con)
+            return con
+        except storage.DB_ERRORS as e:
+            logger.warning("Connection of pool %s lost: %s", self.name, e)
+            with self.lock:
+                self.stats["healthFailures"] = self.stats["healthFailures"] + 1
+                self.failed = True
+            self.close(con)
+            return None
+
+    def connect(self):
+        """
+        Open a new connection, unless attempts are currently delayed
+        """
+        if time.monotonic() < self.nextConnect:
+            raise storage.StorageError("Database not available. Next attempt for pool " + self.name + " in {:.0f} s".format(self.timeToConnect()))
+        try:
+            con = self.backend.connect()
+        except storage.DB_ERRORS as e:
+            with self.lock:
+                self.stats["connectErrors"] = self.stats["connectErrors"] + 1
+                self.nextConnect = time.monotonic() + self.reconnectDelay
+                logger.error("Database not available for pool %s: %s. Next attempt in %s s", self.name, e, self.reconnectDelay)
+                self.reconnectDelay = min(self.reconnectDelay * 2, self.reconnectMax)
+                self.failed = True
+            raise
+
+        with self.lock:
+            self.stats["connects"] = self.stats["connects"] + 1
+            if self.failed:
+                self.stats["reconnects"] = self.stats["reconnects"] + 1
+                logger.info("Pool %s reconnected to database", self.name)
+            self.failed = False
+            self.reconnectDelay = self.reconnectInterval
+            self.nextConnect = 0
+        return con
+
+    def release(self, con, broken=False):
+        """
+        Return a checked out connection
+
+        A broken connection is closed and will be replaced with the next checkout.
+        """
+        if broken:
+            self.close(con)
+        with self.lock:
+            if broken:
+                self.failed = True
+                self.stats["discarded"] = self.stats["discarded"] + 1
+                self.connections = self.connections - 1
+            else:
+                self.idle.append((con, time.monotonic()))
+            self.lock.notify()
+
+    def close(self, con):
+        """
+        Close a connection, ignoring errors
+        """
+        try:
+            con.close()
+        except storage.DB_ERRORS:
+            pass
+
+    def getStats(self):
+        """
+        Return pool statistics
+
+        - connections   : Number of open connections
+        - idle          : Number of idle connections
+        - checkouts     : Number of connection checkouts
+        - waits         : Number of checkouts which had to wait for a free connection
+        - waitTime      : Total time in s waited for free connections
+        - connects      : Number of connections opened
+        - reconnects    : Number of connections opened after the database had been unavailable
+        - connectErrors : Number of failed connection attempts
+        - healthChecks  : Number of health checks of idle connections
+        - healthFailures: Number of idle connections found broken
+        - discarded     : Number of connections discarded after errors
+        """
+        with self.lock:
+            res = self.stats.copy()
+            res["connections"] = self.connections
+            res["idle"] = len(self.idle)
+        return res
+
+    def closeAll(self):
+        """
+        Close all idle connections
+        """
+        with self.lock:
+            for con, lastUsed in self.idle:
+                self.close(con)
+            self.connections = self.connections - len(self.idle)
+            self.idle = list()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""
+Module for parameterized database statements
+
+Each statement is generated once per table and column set and then taken from a cache.
+Values are bound as statement parameters (qmark style). Values which are not available
+are bound as NULL, so that the statement text is the same for all rows.
+
+Upserts are generated for the SQL dialect of the storage backend in use (see setDialect).
+"""
+import threading
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# SQL dialect ("mariadb" or "sqlite")
+dialect = "mariadb"
+
+# Cache of generated statements
+statements = {}
+statementsLock = threading.Lock()
+
+def setDialect(name):
+    """
+    Set the SQL dialect for which statements are generated
+    """
+    global dialect
+    with statementsLock:
+        dialect = name
+        statements.clear()
+
+def cachedStatement(key, build):
+    """
+    Return the statement for the given key from the cache.
+    If not yet available, the statement is generated with the build function.
+    """
+    stmt = statements.get(key)
+    if stmt is None:
+        stmt = build()
+        with statementsLock:
+            statements[key] = stmt
+        logger.debug("Statement cached: %s", stmt)
+    return stmt
+
+def insertStmt(tbl, cols, updateCols=(), keepCols=(), keyCols=None):
+    """
+    Return an INSERT statement
+
+    Input:
+    - tbl       : Table name
+    - cols      : Columns for which values are bound
+    - updateCols: Columns updated with the new value if the key already exists
+    - keepCols  : Columns updated with the new value if the key already exists,
+                  unless the new value is NULL
+    - keyCols   : Columns of the primary key (default: first column)
+    """
+    cols = tuple(cols)
+    updateCols = tuple(updateCols)
+    keepCols = tuple(keepCols)
+    keyCols = cols[:1] if keyCols is None else tuple(keyCols)
+
+    def build():
+        stmt = "INSERT INTO " + tbl + " (" + ", ".join(cols) + ") VALUES (" + ", ".join(["?"] * len(cols)) + ")"
+        if dialect == "sqlite":
+            upd = ["{0}=COALESCE(excluded.{0}, {0})".format(col) for col in keepCols]
+            upd = upd + ["{0}=excluded.{0}".format(col) for col in updateCols]
+            if len(upd) > 0:
+                stmt = stmt + " ON CONFLICT (" + ", ".join(keyCols) + ") DO UPDATE SET " + ", ".join(upd)
+        else:
+            upd = ["{0}=COALESCE(VALUES({0}), {0})".format(col) for col in keepCols]
+            upd = upd + ["{0}=VALUES({0})".format(col) for col in updateCols]
+            if len(upd) > 0:
+                stmt = stmt + " ON DUPLICATE KEY UPDATE " + ", ".join(upd)
+        return stmt
+
+    return cachedStatement(("insert", tbl, cols, updateCols, keepCols, keyCols), build)
+
+def deleteStmt(tbl, col, op):
+    """
+    Return a DELETE statement for rows where the given column compares with a bound value
+
+    Input:
+    - tbl: Table name
+    - col: Column to be compared
+    - op : Comparison operator (e.g. ">=")
+    """
+    return cachedStatement(("delete", tbl, col, op), lambda: "DELETE FROM " + tbl + " WHERE " + col + " " + op + " ?")
@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+"""
+Module for writing measurements to the database in a background thread
+
+Measurements are put into a bounded queue by the measurement loop.
+A writer thread takes them from the queue and stores them with group commits,
+either when a given number of rows is available or when a given time
+has elapsed since the first row of the group, whichever comes first.
+
+The writer checks out a connection from its connection pool for each group commit.
+If the database is unreachable, rows are put into the spool (if configured)
+and the pool reconnects with increasing delay. After reconnection,
+the spool is replayed before new rows are written.
+Errors caused by the data itself are not spooled; they terminate the writer.
+"""
+import threading
+import queue
+import time
+import storage
+import spool
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+writerDefaults = {
+    "batchSize"    : 50,
+    "flushInterval": 1000,
+    "queueSize"    : 10000
+}
+
+# Marker for the end of the queue
+_STOP = object()
+
+class MeasurementWriter(threading.Thread):
+    """
+    Class representing the background thread writing measurements to the database
+    """
+    def __init__(self, pool, table, columns, spool=None, batchSize=50, flushInterval=1000, queueSize=10000, rollup=None):
+        """
+        Constructor for MeasurementWriter
+
+        Input:
+        - pool         : Connection pool used for measurements, shared by the writers of all tables
+                         (closed by the owner after all writers have stopped)
+        - table        : Table for measurements
+        - columns      : Columns for which values are provided
+        - spool        : Spool for rows which cannot be written (None: rows are dropped)
+        - batchSize    : Maximum number of rows per group commit
+        - flushInterval: Maximum time in ms between queuing of a row and its commit
+        - queueSize    : Maximum number of rows waiting in the queue
+        - rollup       : Rollup tables updated together with the measurements (None: no rollup)
+        """
+        super().__init__(name="MeasurementWriter-" + table, daemon=True)
+        self.pool = pool
+        self.table = table
+        self.columns = columns
+        self.spool = spool
+        self.rollup = rollup
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval / 1000
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.error = None
+
+        self.statsLock = threading.Lock()
+        self.stats = {
+            "queued"       : 0,
+            "written"      : 0,
+            "dropped"      : 0,
+            "flushes"      : 0,
+            "maxQueueDepth": 0,
+            "flushTimeAvg" : 0.0,
+            "flushTimeMax" : 0.0,
+            "spooled"      : 0
+        }
+        self.flushTimeSum = 0.0
+
+    @classmethod
+    def fromConfig(cls, pool, table, columns, writerCfg, spool=None, rollup=None):
+        """
+        Create a writer from the dbWriter section of the configuration
+        """
+        par = writerDefaults.copy()
+        if writerCfg:
+            par.update(writerCfg)
+        return cls(pool, table, columns, spool, rollup=rollup, **par)
+
+    def put(self, row):
+        """
+        Queue a measurement sample (Measurement) without waiting
+
+        Returns False if the row had to be dropped because the queue is full.
+        """
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self.statsLock:
+                self.stats["dropped"] = self.stats["dropped"] + 1
+            logger.error("Measurement queue full. Measurement dropped: %s", row)
+            return False
+
+        depth = self.queue.qsize()
+        with self.statsLock:
+            self.stats["queued"] = self.stats["queued"] + 1
+            if depth > self.stats["maxQueueDepth"]:
+                self.stats["maxQueueDepth"] = depth
+        return True
+
+    def run(self):
+        """
+        Take rows from the queue and write them in group commits until stopped
+        """
+        stop = False
+        try:
+            self.replay()
+            while not stop:
+                try:
+                    row = self.queue.get(timeout=self.idleTimeout())
+                except queue.Empty:
+                    # Reconnect and replay the spool while no rows arrive
+                    self.replay()
+                    continue
+                if row is _STOP:
+                    break
+                rows = [row]
+                deadline = time.monotonic() + self.flushInterval
+                while len(rows) < self.batchSize:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        if timeout > 0:
+                            row = self.queue.get(timeout=timeout)
+                        else:
+                            row = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if row is _STOP:
+                        # Write the rows of the current group and those still queued
+                        stop = True
+                        break
+                    rows.append(row)
+                self.flush(rows)
+            self.drain()
+
+        except Exception as e:
+            logger.error("Measurement writer for %s terminated: %s", self.table, e)
+            self.error = e
+
+    def drain(self):
+        """
+        Write all rows remaining in the queue
+        """
+        rows = list()
+        while True:
+            try:
+                row = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                rows.append(row)
+            if len(rows) >= self.batchSize:
+                self.flush(rows)
+                rows = list()
+        if len(rows) > 0:
+            self.flush(rows)
+
+    def idleTimeout(self):
+        """
+        Return the time to wait for new rows before the spool is replayed
+
+        None if the spool is empty
+        """
+        if not self.spool or self.spool.pending() == 0:
+            return None
+        return self.pool.timeToConnect()
+
+    def replay(self):
+        """
+        Replay the spool, if it is not empty
+
+        Returns False if the database is not available
+        """
+        if not self.spool or self.spool.pending() == 0:
+            return True
+        try:
+            con = self.pool.acquire()
+        except storage.DB_ERRORS:
+            return False
+        try:
+            self.spool.replay(con)
+        except storage.DB_ERRORS as e:
+            logger.error("Replay of spool failed: %s", e)
+            self.pool.release(con, broken=isinstance(e, storage.CONNECTION_ERRORS))
+            return False
+        self.pool.release(con)
+        return True
+
+    def flush(self, samples):
+        """
+        Write samples with a single executemany and commit
+
+        If the database is not available, the rows are spooled.
+        Spooled rows are replayed first, so that the order of rows is kept.
+        Other database errors are raised.
+        """
+        t0 = time.perf_counter()
+        rows = [sample.astuple() for sample in samples]
+        if not self.replay():
+            self.spoolRows(rows)
+            return
+        try:
+            con = self.pool.acquire()
+        except storage.DB_ERRORS:
+            self.spoolRows(rows)
+            return
+        try:
+            cur = self.pool.backend.cursor(con)
+            stmt = self.pool.backend.insertMeasurements(cur, self.table, rows, self.columns)
+            logger.debug("%s (%s rows)", stmt, len(rows))
+            if self.rollup:
+                self.rollup.update(cur, rows)
+            con.commit()
+        except storage.CONNECTION_ERRORS as e:
+            logger.error("Writing measurements failed: %s", e)
+            self.pool.release(con, broken=True)
+            self.spoolRows(rows)
+            return
+        except storage.DB_ERRORS as e:
+            logger.error("Measurements rejected by database: %s", e)
+            con.rollback()
+            self.pool.release(con)
+            raise
+        self.pool.release(con)
+        flushTime = (time.perf_counter() - t0) * 1000
+
+        with self.statsLock:
+            self.stats["written"] = self.stats["written"] + len(rows)
+            self.stats["flushes"] = self.stats["flushes"] + 1
+            self.flushTimeSum = self.flushTimeSum + flushTime
+            self.stats["flushTimeAvg"] = self.flushTimeSum / self.stats["flushes"]
+            if flushTime > self.stats["flushTimeMax"]:
+                self.stats["flushTimeMax"] = flushTime
+
+    def spoolRows(self, rows):
+        """
+        Put rows into the spool, or drop them if no spool is available
+        """
+        if self.spool:
+            spoolCon = spool.SpoolConnection(self.spool)
+            spoolCur = spoolCon.cursor()
+            self.pool.backend.insertMeasurements(spoolCur, self.table, rows, self.columns)
+            if self.rollup:
+                self.rollup.update(spoolCur, rows)
+            spoolCon.commit()
+            with self.statsLock:
+                self.stats["spooled"] = self.stats["spooled"] + len(rows)
+        else:
+            with self.statsLock:
+                self.stats["dropped"] = self.stats["dropped"] + len(rows)
+            logger.error("No spool available. %s measurements dropped", len(rows))
+
+    def getStats(self):
+        """
+        Return writer statistics
+
+        - queueDepth   : Number of rows currently waiting
+        - maxQueueDepth: Maximum number of rows waiting
+        - queued       : Number of rows queued
+        - written      : Number of rows written
+        - dropped      : Number of rows dropped because the queue was full or the database was unavailable
+        - spooled      : Number of rows spooled because the database was unavailable
+        - flushes      : Number of group commits
+        - flushTimeAvg : Average time in ms for a group commit
+        - flushTimeMax : Maximum time in ms for a group commit
+        """
+        with self.statsLock:
+            res = self.stats.copy()
+        res["queueDepth"] = self.queue.qsize()
+        return res
+
+    def stop(self, timeout=None):
+        """
+        Stop the writer after all queued rows have been written
+        """
+        if self.is_alive():
+            while True:
+                try:
+                    self.queue.put(_STOP, timeout=1)
+                    break
+                except queue.Full:
+                    if not self.is_alive():
+                        break
+            self.join(timeout)
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+"""
+Module for exporting measurements and forecasts
+
+The rows of a measurement or forecast table within a period are exported with
+
+    python export.py [-c CONFIG] KIND [--start DATE] [--end DATE] [--format FORMAT] [-o FILE]
+
+KIND is one of
+- measurement   : Measurement table (dbConnection.table)
+- hourlyForecast: Hourly forecast table
+- dailyForecast : Daily forecast table
+- alertsForecast: Alerts table
+The forecast tables are taken from forecast.forecastTables or, with --location,
+from the forecast location. Any table of the same structure can be selected with --table.
+
+Available formats are csv, ndjson (one JSON object per line) and parquet.
+Rows are read through a streaming cursor and written chunk by chunk, so that
+memory does not depend on the number of rows exported.
+Parquet export requires pyarrow; each chunk is written as one row group.
+"""
+import sys
+import csv
+import json
+import time
+import storage
+import toolConfig
+from weatherForecastOWM import dbValue
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Number of rows per chunk
+CHUNK_SIZE = 10000
+
+FORMATS = ["csv", "ndjson", "parquet"]
+
+# Column used for selecting the period for each kind of table
+PERIOD_COLUMNS = {
+    "measurement"   : "timestamp",
+    "hourlyForecast": "timestamp",
+    "dailyForecast" : "date",
+    "alertsForecast": "start"
+}
+
+# Columns exported as text in Parquet files. Other columns are numeric
+TEXT_COLUMNS = ["timestamp", "date", "time", "sunrise", "sunset", "description", "icon",
+                "start", "end", "event", "sender_name", "time_cre", "time_mod"]
+# Numeric columns with integer values
+INTEGER_COLUMNS = ["alerts", "samples"]
+
+class CsvWriter:
+    """
+    Writer for CSV files with header
+    """
+    def __init__(self, f, columns):
+        self.writer = csv.writer(f)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+class NdjsonWriter:
+    """
+    Writer for newline-delimited JSON with one object per row
+    """
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+
+    def write(self, rows):
+        cols = self.columns
+        self.f.write("".join(json.dumps(dict(zip(cols, row))) + "\n" for row in rows))
+
+    def close(self):
+        pass
+
+class ParquetWriter:
+    """
+    Writer for Parquet files with one row group per chunk
+    """
+    def __init__(self, f, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet export requires pyarrow")
+        self.pa = pyarrow
+        self.columns = columns
+        fields = list()
+        for col in columns:
+            if col in TEXT_COLUMNS:
+                fields.append(pyarrow.field(col, pyarrow.string()))
+            elif col in INTEGER_COLUMNS or col.endswith("_count"):
+                fields.append(pyarrow.field(col, pyarrow.int64()))
+            else:
+                fields.append(pyarrow.field(col, pyarrow.float64()))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(f, self.schema)
+
+    def write(self, rows):
+        data = {col: list(values) for col, values in zip(self.columns, zip(*rows))}
+        self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {
+    "csv"    : CsvWriter,
+    "ndjson" : NdjsonWriter,
+    "parquet": ParquetWriter
+}
+
+def selectStmt(table, periodCol, start=None, end=None):
+    """
+    Return the statement selecting the rows of a period and its parameters
+    """
+    stmt = "SELECT * FROM " + table
+    cond = list()
+    params = list()
+    if start:
+        cond.append(periodCol + " >= ?")
+        params.append(start)
+    if end:
+        cond.append(periodCol + " < ?")
+        params.append(end)
+    if len(cond) > 0:
+        stmt = stmt + " WHERE " + " AND ".join(cond)
+    return stmt + " ORDER BY " + periodCol, tuple(params)
+
+def export(backend, table, periodCol, fmt, f, start=None, end=None, chunkSize=CHUNK_SIZE):
+    """
+    Export the rows of a table within a period
+
+    Input:
+    - backend  : Storage backend
+    - table    : Table to be exported
+    - periodCol: Column to which start and end apply
+    - fmt      : Output format (see FORMATS)
+    - f        : Output file (text file for csv and ndjson, binary file or path for parquet)
+    - start    : Start of the period (None: from the beginning)
+    - end      : End of the period, exclusive (None: until the end)
+    - chunkSize: Number of rows fetched and written together
+
+    Returns the number of rows exported
+    """
+    t0 = time.perf_counter()
+    count = 0
+    con = backend.connect()
+    try:
+        cur = backend.streamCursor(con)
+        stmt, params = selectStmt(table, periodCol, start, end)
+        logger.debug(stmt)
+        cur.execute(stmt, params)
+        columns = [d[0] for d in cur.description]
+        writer = WRITERS[fmt](f, columns)
+        try:
+            while True:
+                rows = cur.fetchmany(chunkSize)
+                if len(rows) == 0:
+                    break
+                writer.write([tuple(dbValue(v) for v in row) for row in rows])
+                count = count + len(rows)
+                logger.info("%s rows exported (%.0f rows/s)", count, count / (time.perf_counter() - t0))
+        finally:
+            writer.close()
+    finally:
+        con.close()
+    return count
+
+def main():
+    parser = toolConfig.argumentParser("Export measurements or forecasts")
+    parser.add_argument("kind", choices=list(PERIOD_COLUMNS.keys()), help="Kind of table to be exported")
+    parser.add_argument("--table", help="Table to be exported (default: table of the given kind from config file)")
+    parser.add_argument("--location", help="Forecast location from which forecast tables are taken")
+    parser.add_argument("--start", help="Start of the period (%%Y-%%m-%%d [%%H:%%M:%%S])")
+    parser.add_argument("--end", help="End of the period, exclusive")
+    parser.add_argument("-f", "--format", choices=FORMATS, help="Output format (default: from file extension or csv)")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="Number of rows per chunk (default: %(default)s)")
+    args = parser.parse_args()
+    toolConfig.setupLogging(args)
+
+    fmt = args.format
+    if not fmt:
+        fmt = "csv"
+        if args.output:
+            ext = args.output.rsplit(".", 1)[-1].lower()
+            if ext in FORMATS:
+                fmt = ext
+            elif ext == "json":
+                fmt = "ndjson"
+    if fmt == "parquet" and not args.output:
+        print("Parquet export requires an output file")
+        sys.exit(1)
+
+    conf = toolConfig.loadConfig(args.config)
+    table = args.table
+    if not table:
+        if args.kind == "measurement":
+            table = conf["dbConnection"]["table"]
+        else:
+            fcTables = conf["forecast"]["forecastTables"]
+            for location in conf["forecast"]["locations"]:
+                if location.get("name") == args.location and location["forecastTables"]:
+                    fcTables = location["forecastTables"]
+            if fcTables:
+                table = fcTables[args.kind]
+    if not table:
+        print("No table configured for {}".format(args.kind))
+        sys.exit(1)
+    backend = toolConfig.backendFromConfig(conf)
+
+    try:
+        if fmt == "parquet":
+            f = args.output
+        elif args.output:
+            f = open(args.output, "w", newline="")
+        else:
+            f = sys.stdout
+        try:
+            count = export(backend, table, PERIOD_COLUMNS[args.kind], fmt, f, args.start, args.end, args.chunk)
+        finally:
+            if args.output and fmt != "parquet":
+                f.close()
+    except (ValueError,) + storage.DB_ERRORS as e:
+        print("Export failed: {}".format(e))
+        sys.exit(1)
+    logger.info("%s rows exported from %s", count, table)
+
+if __name__ == "__main__":
+    main()
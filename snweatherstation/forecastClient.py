@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+"""
+Module with a reusable HTTP client for querying the forecast service
+
+The client keeps a persistent connection pool, enforces connect and read timeouts,
+retries failed requests with jittered exponential backoff and uses conditional requests
+(ETag / Last-Modified) as well as Cache-Control so that unchanged forecasts
+are not downloaded again.
+"""
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# HTTP status codes for which a request is retried
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Defaults
+httpDefaults = {
+    "connectTimeout": 5,
+    "readTimeout"   : 30,
+    "retries"       : 3,
+    "backoffFactor" : 1.0,
+    "backoffMax"    : 60,
+    "poolSize"      : 4
+}
+
+# Client used by getForecast if no client is specified
+defaultClient = None
+
+class RequestCancelled(requests.RequestException):
+    """
+    Error raised if the client is stopped while waiting for a retry
+    """
+
+class ForecastClient:
+    """
+    Class representing a pooled, keep-alive HTTP client for the forecast service
+    """
+    def __init__(self, connectTimeout=5, readTimeout=30, retries=3, backoffFactor=1.0, backoffMax=60, poolSize=4, stopEvent=None):
+        """
+        Constructor for ForecastClient
+
+        Input:
+        - connectTimeout: Timeout in seconds for establishing a connection
+        - readTimeout   : Timeout in seconds for waiting on response data
+        - retries       : Number of retries after a failed request
+        - backoffFactor : Base delay in seconds for exponential backoff
+        - backoffMax    : Maximum delay in seconds between retries
+        - poolSize      : Number of connections kept in the connection pool
+        - stopEvent     : Event which interrupts the wait for a retry when set (None: not interruptible)
+        """
+        self.timeout = (connectTimeout, readTimeout)
+        self.stopEvent = stopEvent
+        self.retries = retries
+        self.backoffFactor = backoffFactor
+        self.backoffMax = backoffMax
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.cache = {}
+        self.lock = threading.Lock()
+
+        self.stats = {
+            "requests"   : 0,
+            "downloads"  : 0,
+            "notModified": 0,
+            "cacheHits"  : 0,
+            "retries"    : 0
+        }
+
+    @classmethod
+    def fromConfig(cls, httpCfg, stopEvent=None):
+        """
+        Create a client from the forecast.http section of the configuration
+        """
+        par = httpDefaults.copy()
+        if httpCfg:
+            par.update(httpCfg)
+        return cls(stopEvent=stopEvent, **par)
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        self.session.close()
+
+    def count(self, key):
+        """
+        Increment a statistics counter (the client may be shared by several threads)
+        """
+        with self.lock:
+            self.stats[key] = self.stats[key] + 1
+
+    def backoff(self, attempt):
+        """
+        Return the delay before the given retry attempt (full jitter)
+        """
+        return random.uniform(0, min(self.backoffMax, self.backoffFactor * 2 ** attempt))
+
+    def wait(self, delay):
+        """
+        Wait before a retry
+
+        Raises RequestCancelled if the stop event is set in the meantime.
+        """
+        if self.stopEvent is None:
+            time.sleep(delay)
+        elif self.stopEvent.wait(delay):
+            raise RequestCancelled("Request cancelled because the client is stopped")
+
+    def getJson(self, url, payload):
+        """
+        Get JSON data from the given URL
+
+        If the cached response is still fresh according to Cache-Control, it is returned
+        without a request. Otherwise a conditional request is issued and a cached
+        response is reused if the server answers with 304 Not Modified.
+        """
+        key = (url, tuple(sorted((k, str(v)) for k, v in payload.items())))
+        with self.lock:
+            entry = self.cache.get(key)
+
+        if entry and entry["expires"] > time.monotonic():
+            self.count("cacheHits")
+            logger.debug("Response still fresh. Using cached response")
+            return entry["data"]
+
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["lastModified"]:
+                headers["If-Modified-Since"] = entry["lastModified"]
+
+        attempt = 0
+        while True:
+            self.count("requests")
+            try:
+                fcr = self.session.get(url, params=payload, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning("Request failed (%s). Retry in %.1f sec.", e, delay)
+            else:
+                if fcr.status_code == requests.codes.not_modified:
+                    if not entry:
+                        # Validators are only sent with a cached response, so there is nothing to reuse
+                        raise requests.HTTPError("304 Not Modified without cached response for url: " + fcr.url, response=fcr)
+                    self.count("notModified")
+                    logger.debug("Response not modified. Using cached response")
+                    self._store(key, fcr, entry["data"])
+                    return entry["data"]
+                if fcr.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    break
+                delay = self.backoff(attempt)
+                retryAfter = fcr.headers.get("Retry-After")
+                if retryAfter and retryAfter.isdigit():
+                    delay = max(delay, min(self.backoffMax, int(retryAfter)))
+                logger.warning("Request returned status %s. Retry in %.1f sec.", fcr.status_code, delay)
+            self.count("retries")
+            self.wait(delay)
+            attempt = attempt + 1
+
+        if fcr.status_code != requests.codes.ok:
+            fcr.raise_for_status()
+        self.count("downloads")
+
+        try:
+            fcrj = fcr.json()
+        except  Exception as e:
+            logger.error("Error parsing response: %s", e)
+            fcrj = None
+            logger.error("Request URL    : %s", url)
+            logger.error("Request payload: %s", payload)
+            logger.error("Response       : %s", fcr.text)
+
+        if fcrj is not None:
+            self._store(key, fcr, fcrj)
+
+        return fcrj
+
+    def getStats(self):
+        """
+        Return client statistics
+
+        - requests   : Number of HTTP requests, including retries
+        - downloads  : Number of responses with new data
+        - notModified: Number of responses 304 Not Modified
+        - cacheHits  : Number of responses served from the cache without request
+        - retries    : Number of retries
+        """
+        with self.lock:
+            return self.stats.copy()
+
+    def _store(self, key, fcr, data):
+        """
+        Store response data together with validators and freshness in the cache
+        """
+        cacheControl = parseCacheControl(fcr.headers.get("Cache-Control"))
+        if "no-store" in cacheControl:
+            with self.lock:
+                self.cache.pop(key, None)
+            return
+
+        maxAge = 0
+        if "no-cache" not in cacheControl:
+            try:
+                maxAge = int(cacheControl.get("max-age", 0))
+                maxAge = maxAge - int(fcr.headers.get("Age", 0))
+            except ValueError:
+                maxAge = 0
+
+        entry = {
+            "data"        : data,
+            "etag"        : fcr.headers.get("ETag"),
+            "lastModified": fcr.headers.get("Last-Modified"),
+            "expires"     : time.monotonic() + max(maxAge, 0)
+        }
+        with self.lock:
+            old = self.cache.get(key)
+            if old and fcr.status_code == requests.codes.not_modified:
+                # A 304 response need not repeat the validators
+                if not entry["etag"]:
+                    entry["etag"] = old["etag"]
+                if not entry["lastModified"]:
+                    entry["lastModified"] = old["lastModified"]
+            self.cache[key] = entry
+
+def parseCacheControl(value):
+    """
+    Parse a Cache-Control header into a dictionary of directives
+    """
+    res = {}
+    if value:
+        for directive in value.split(","):
+            directive = directive.strip().lower()
+            if not directive:
+                continue
+            if "=" in directive:
+                name, val = directive.split("=", 1)
+                res[name.strip()] = val.strip().strip('"')
+            else:
+                res[directive] = None
+    return res
+
+def getDefaultClient():
+    """
+    Return the client used by getForecast if no client is specified
+    """
+    global defaultClient
+
+    if defaultClient is None:
+        defaultClient = ForecastClient()
+    return defaultClient
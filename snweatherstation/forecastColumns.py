@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+"""
+Module for columnar forecast data
+
+A ColumnTable holds forecast rows as typed columns instead of one dictionary per row.
+Numeric columns are array.array objects with a null mask (bytearray, 1 for NULL),
+text columns are lists with None for NULL.
+
+Rows can be retrieved as tuples in column order for database statements or file output.
+For analytics, columns can be retrieved as NumPy masked arrays without copying
+the numeric data (NumPy is only required for this).
+"""
+import array
+
+# Column types
+TYPE_FLOAT = "d"
+TYPE_INT   = "q"
+TYPE_TEXT  = "s"
+
+class ColumnTable:
+    """
+    Class representing forecast rows stored column by column
+    """
+    def __init__(self, columns, types, keys=None, data=None, nulls=None):
+        """
+        Constructor for ColumnTable
+
+        Input:
+        - columns: Column names
+        - types  : Type for each column (TYPE_FLOAT, TYPE_INT, TYPE_TEXT)
+        - keys   : Row keys (timestamp or date)
+        - data   : Values for each column name (array.array or list)
+        - nulls  : Null mask for each column name
+        """
+        self.columns = list(columns)
+        self.types = dict(zip(columns, types))
+        self.keys = list() if keys is None else keys
+        if data is None:
+            data = {}
+            nulls = {}
+            for col in self.columns:
+                if self.types[col] == TYPE_TEXT:
+                    data[col] = list()
+                else:
+                    data[col] = array.array(self.types[col])
+                nulls[col] = bytearray()
+        self.data = data
+        self.nulls = nulls
+
+    @classmethod
+    def fromLists(cls, columns, types, keys, values):
+        """
+        Create a table from a list of keys and a list of values for each column
+
+        None in a value list denotes NULL.
+        """
+        data = {}
+        nulls = {}
+        for col, typ, vals in zip(columns, types, values):
+            if None in vals:
+                nulls[col] = bytearray([v is None for v in vals])
+                if typ != TYPE_TEXT:
+                    vals = [0 if v is None else v for v in vals]
+            else:
+                nulls[col] = bytearray(len(vals))
+            if typ == TYPE_TEXT:
+                data[col] = vals
+            else:
+                data[col] = array.array(typ, vals)
+        return cls(columns, types, list(keys), data, nulls)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def column(self, col):
+        """
+        Return values and null mask of a column
+        """
+        return self.data[col], self.nulls[col]
+
+    def value(self, col, i):
+        """
+        Return the value of a column in row i (None for NULL)
+        """
+        if self.nulls[col][i]:
+            return None
+        return self.data[col][i]
+
+    def row(self, i):
+        """
+        Return the values of row i in column order
+        """
+        return tuple(None if self.nulls[col][i] else self.data[col][i] for col in self.columns)
+
+    def rows(self):
+        """
+        Return (key, values) for all rows
+        """
+        return list(zip(self.keys, zip(*[self.values(col) for col in self.columns])))
+
+    def values(self, col):
+        """
+        Return the values of a column with None for NULL
+        """
+        data = self.data[col]
+        nulls = self.nulls[col]
+        if not any(nulls):
+            return data
+        return [None if null else v for v, null in zip(data, nulls)]
+
+    def asNumpy(self, col):
+        """
+        Return a column as NumPy masked array
+
+        Numeric columns share their memory with the column array.
+        """
+        import numpy
+        mask = numpy.frombuffer(bytes(self.nulls[col]), dtype=numpy.bool_)
+        if self.types[col] == TYPE_TEXT:
+            values = numpy.array(self.data[col], dtype=object)
+        elif len(self.data[col]) == 0:
+            values = numpy.array([], dtype=self.types[col])
+        else:
+            values = numpy.frombuffer(self.data[col], dtype=self.types[col])
+        return numpy.ma.masked_array(values, mask=mask)
+
+class ForecastColumns:
+    """
+    Class representing a mapped forecast in columnar form
+
+    It can be used instead of the result of mapForecast for storing forecasts in the database.
+    """
+    def __init__(self, current, hourly, daily):
+        """
+        Constructor for ForecastColumns
+
+        Input:
+        - current: ColumnTable with the single row of the current forecast
+        - hourly : ColumnTable with the hourly forecast
+        - daily  : ColumnTable with the daily forecast
+        """
+        self.current = current
+        self.hourly = hourly
+        self.daily = daily
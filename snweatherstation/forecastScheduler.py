@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+"""
+Module for scheduling forecast refreshes independently from the measurement cycle
+
+The forecast service is only queried when the configured refresh interval has elapsed.
+The last forecast received is kept in memory so that measurement cycles in between
+can reuse it without network, mapping or database activity.
+
+If several forecast locations are configured, forecasts are requested and mapped
+concurrently with a bounded number of threads. Storage in the database is done
+sequentially on the connection of the caller.
+"""
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+import weatherForecastOWM
+import forecastClient
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class ForecastScheduler:
+    """
+    Class scheduling forecast refreshes with an own refresh interval
+    and caching the last forecast received for each location
+    """
+    def __init__(self, cfg, stopEvent=None):
+        """
+        Constructor for ForecastScheduler
+
+        Input:
+        - cfg      : Configuration dictionary for weatherstation
+        - stopEvent: Event which interrupts retries of the forecast client when set
+        """
+        self.cfg = cfg
+        self.refreshInterval = cfg["forecast"]["refreshInterval"]
+        self.locations = list()
+        for location in cfg["forecast"]["locations"]:
+            self.locations.append((location["name"], weatherForecastOWM.locationConfig(cfg, location)))
+        self.multiLocation = len(self.locations) > 1
+        self.executor = None
+        maxWorkers = 1
+        if self.multiLocation:
+            maxWorkers = max(1, min(cfg["forecast"]["maxConcurrency"], len(self.locations)))
+            self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="ForecastFetch")
+        # The connection pool holds at least one connection per concurrent request
+        httpCfg = forecastClient.httpDefaults.copy()
+        httpCfg.update(cfg["forecast"]["http"])
+        httpCfg["poolSize"] = max(httpCfg["poolSize"], maxWorkers)
+        self.client = forecastClient.ForecastClient.fromConfig(httpCfg, stopEvent)
+        self.forecasts = {}
+        self.forecastTs = None
+        self.lastRefresh = None
+        self.refreshCount = 0
+        self.cacheHits = 0
+
+    def isDue(self):
+        """
+        Return True if the forecast needs to be refreshed
+        """
+        if self.lastRefresh is None:
+            return True
+        return time.monotonic() - self.lastRefresh >= self.refreshInterval
+
+    def handleForecast(self, curTs, curDate, curTime, dbCon, dbCur, fil, servRun):
+        """
+        Refresh the forecast if due and return the cached forecasts
+
+        The forecast is only written to file, mapped and stored in the database
+        when it has been refreshed.
+
+        Input:
+        - curTS  : Measurement timestamp
+        - curDate: Measurement Date
+        - curTime: Measurement Time
+        - dbCon  : Database connection
+        - dbCur  : Database cursor
+        - fil    : file handler for outpot file
+        - servRun: True for service run
+
+        Returns a dictionary with the forecast for each location name
+        """
+        if not self.isDue():
+            self.cacheHits = self.cacheHits + 1
+            logger.debug("Using cached forecast from %s", self.forecastTs)
+            return self.forecasts
+
+        self.refresh(curTs, curDate, curTime, dbCon, dbCur, fil, servRun)
+
+        return self.forecasts
+
+    def timeToNext(self):
+        """
+        Return the number of seconds until the next refresh is due
+        """
+        if self.lastRefresh is None:
+            return 0
+        return max(0, self.lastRefresh + self.refreshInterval - time.monotonic())
+
+    def fetchLocation(self, locCfg, curTs):
+        """
+        Get and map the forecast for a single location
+        """
+        url = locCfg["forecast"]["source"]["url"]
+        payload = locCfg["forecast"]["source"]["payload"]
+        fc = weatherForecastOWM.getForecast(url, payload, self.client)
+
+        fcData = None
+        if fc:
+            fcData = weatherForecastOWM.mapForecastData(fc, curTs, locCfg)
+        return fc, fcData
+
+    def fetch(self, curTs):
+        """
+        Get and map new forecasts for all locations
+
+        Input:
+        - curTs: Measurement timestamp
+
+        Returns a dictionary with the forecast and the mapped forecast for each location name
+        for which the service returned a forecast.
+        If no location returned a forecast, the first request error is raised.
+        """
+        # Register the attempt before the request so that a failing service
+        # is not queried again before the next refresh is due
+        self.lastRefresh = time.monotonic()
+
+        if self.executor:
+            pending = list()
+            for name, locCfg in self.locations:
+                pending.append((name, self.executor.submit(self.fetchLocation, locCfg, curTs)))
+        else:
+            name, locCfg = self.locations[0]
+            pending = [(name, None)]
+
+        fetched = {}
+        errors = list()
+        for name, future in pending:
+            try:
+                if future:
+                    fc, fcData = future.result()
+                else:
+                    fc, fcData = self.fetchLocation(locCfg, curTs)
+            except requests.RequestException as e:
+                logger.error("Forecast request for %s failed: %s", name, e)
+                errors.append(e)
+                continue
+
+            if fc:
+                self.forecasts[name] = fc
+                fetched[name] = (fc, fcData)
+
+        if errors and len(fetched) == 0:
+            raise errors[0]
+
+        if len(fetched) > 0:
+            self.forecastTs = curTs
+            self.refreshCount = self.refreshCount + 1
+            logger.debug("Forecast refreshed at %s for %s (refresh %s, cache hits %s)", curTs, list(fetched), self.refreshCount, self.cacheHits)
+
+        return fetched
+
+    def store(self, fetched, curTs, curDate, dbCon, dbCur, fil, servRun):
+        """
+        Write forecasts returned by fetch to file and store them in the database
+
+        Each location is removed from fetched when it has been stored, so that after
+        a database error, fetched holds the forecasts which have not been stored.
+        For parameters see handleForecast
+        """
+        for name, locCfg in self.locations:
+            if name not in fetched:
+                continue
+            fc, fcData = fetched[name]
+            if self.multiLocation:
+                if self.cfg["forecast"]["forecastFileOut"] and fil:
+                    weatherForecastOWM.forecastToFile(fc, locCfg, curTs, fil, servRun, name)
+                weatherForecastOWM.storeForecast(fc, fcData, locCfg, curTs, curDate, dbCon, dbCur, None, servRun)
+            else:
+                weatherForecastOWM.storeForecast(fc, fcData, locCfg, curTs, curDate, dbCon, dbCur, fil, servRun)
+            del fetched[name]
+
+    def refresh(self, curTs, curDate, curTime, dbCon, dbCur, fil, servRun):
+        """
+        Get new forecasts for all locations and store them
+
+        Returns a dictionary with the new forecast for each location name
+        for which the service returned a forecast.
+        For parameters see handleForecast
+        """
+        fetched = self.fetch(curTs)
+        res = {name: fc for name, (fc, fcData) in fetched.items()}
+        self.store(fetched, curTs, curDate, dbCon, dbCur, fil, servRun)
+        return res
+
+    def close(self):
+        """
+        Release resources held by the scheduler
+        """
+        logger.debug("Forecast client statistics: %s", self.client.getStats())
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.client.close()
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+"""
+Module for handling forecasts in a background thread
+
+Forecast requests, mapping and database storage are done by a worker thread
+so that the measurement cycle never waits on the network or on the database.
+Results are handed back to the measurement loop through a queue.
+
+The worker checks out a connection from its own connection pool for each refresh.
+If the database is unreachable, the forecasts of the refresh which have not been
+stored are put into the spool (if configured) and a new connection is tried
+with the next refresh.
+"""
+import threading
+import queue
+import requests
+import storage
+import forecastScheduler
+import weatherForecastOWM
+import spool
+import timestamps
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Maximum time in s to wait for the worker to terminate
+STOP_TIMEOUT = 10
+
+class ForecastResult:
+    """
+    Class representing the result of a forecast refresh
+    """
+    def __init__(self, curTs, forecast=None, error=None, location=None):
+        """
+        Constructor for ForecastResult
+
+        Input:
+        - curTs   : Timestamp of the refresh
+        - forecast: Forecast as received from the forecast service
+        - error   : Exception which terminated the worker
+        - location: Name of the forecast location (None for a single location)
+        """
+        self.curTs = curTs
+        self.forecast = forecast
+        self.error = error
+        self.location = location
+
+class ForecastWorker(threading.Thread):
+    """
+    Class representing the background thread handling forecasts
+    """
+    def __init__(self, cfg, pool, servRun, queueSize=10, fcSpool=None):
+        """
+        Constructor for ForecastWorker
+
+        Input:
+        - cfg      : Configuration dictionary for weatherstation
+        - pool     : Connection pool used exclusively for forecasts (None without database)
+        - servRun  : True for service run
+        - queueSize: Maximum number of results not yet collected by the measurement loop
+        - fcSpool  : Spool for forecasts which cannot be stored (None: forecasts are not stored)
+        """
+        super().__init__(name="ForecastWorker", daemon=True)
+        self.cfg = cfg
+        self.pool = pool
+        self.servRun = servRun
+        self.stopEvent = threading.Event()
+        self.scheduler = forecastScheduler.ForecastScheduler(cfg, self.stopEvent)
+        self.results = queue.Queue(maxsize=queueSize)
+        self.dbOut = pool is not None and cfg["forecast"]["forecastDbOut"]
+        self.spool = fcSpool
+        self.spooled = False
+
+    def run(self):
+        """
+        Refresh the forecast whenever it is due until the worker is stopped
+        """
+        try:
+            while not self.stopEvent.is_set():
+                if self.scheduler.isDue():
+                    self.refresh()
+                self.stopEvent.wait(self.scheduler.timeToNext())
+
+        except Exception as e:
+            logger.error("Forecast worker terminated: %s", e)
+            self.putResult(ForecastResult(None, error=e))
+
+        finally:
+            if self.pool:
+                self.pool.closeAll()
+            self.scheduler.close()
+
+    def connect(self):
+        """
+        Check out a database connection and replay the spool
+
+        Returns the connection or None if the database is not available
+        """
+        try:
+            con = self.pool.acquire()
+        except storage.DB_ERRORS as e:
+            logger.error("Database not available for forecast: %s", e)
+            return None
+
+        if self.spool and self.spool.pending() > 0:
+            try:
+                self.spool.replay(con)
+            except storage.DB_ERRORS as e:
+                logger.error("Replay of spool failed: %s", e)
+                self.pool.release(con, broken=isinstance(e, storage.CONNECTION_ERRORS))
+                return None
+
+        if self.spooled:
+            # Forecast images reflect spooled forecasts, so they are loaded again
+            weatherForecastOWM.fcImages.clear()
+            self.spooled = False
+        return con
+
+    def spoolTarget(self):
+        """
+        Return connection and cursor for storing the forecast in the spool
+        """
+        if not self.spool:
+            logger.error("No spool available. Forecast is not stored")
+            # A failed commit may have been applied. Images are loaded again with the next forecast
+            weatherForecastOWM.fcImages.clear()
+            return None, None
+        self.spooled = True
+        spoolCon = spool.SpoolConnection(self.spool)
+        return spoolCon, spoolCon.cursor()
+
+    def refresh(self):
+        """
+        Refresh the forecast and hand the result to the measurement loop
+
+        Errors from the forecast service are logged and the next refresh is awaited.
+        A database connection is only checked out once the forecast is available.
+        If the database is not available, the forecast is stored in the spool.
+        """
+        curTimestamp, curDate, curTime = timestamps.now()
+
+        try:
+            fetched = self.scheduler.fetch(curTimestamp)
+        except requests.RequestException as e:
+            logger.error("Forecast request failed: %s", e)
+            return
+        res = {name: fc for name, (fc, fcData) in fetched.items()}
+
+        con = None
+        dbCon, dbCur = None, None
+        if self.dbOut:
+            con = self.connect()
+            if con:
+                dbCon, dbCur = con, self.pool.backend.cursor(con)
+            else:
+                dbCon, dbCur = self.spoolTarget()
+        try:
+            self.scheduler.store(fetched, curTimestamp, curDate, dbCon, dbCur, None, self.servRun)
+        except storage.CONNECTION_ERRORS as e:
+            logger.error("Storing forecast failed: %s", e)
+            if con:
+                self.pool.release(con, broken=True)
+                con = None
+            # Only the forecasts of this refresh which have not been stored are spooled
+            dbCon, dbCur = self.spoolTarget()
+            if dbCon:
+                self.scheduler.store(fetched, curTimestamp, curDate, dbCon, dbCur, None, self.servRun)
+        except storage.DB_ERRORS as e:
+            logger.error("Forecast rejected by database: %s", e)
+        if con:
+            self.pool.release(con)
+
+        for name, fc in res.items():
+            if self.scheduler.multiLocation:
+                self.putResult(ForecastResult(curTimestamp, forecast=fc, location=name))
+            else:
+                self.putResult(ForecastResult(curTimestamp, forecast=fc))
+
+    def putResult(self, result):
+        """
+        Put a result into the queue, discarding the oldest one if the queue is full
+        """
+        while True:
+            try:
+                self.results.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    self.results.get_nowait()
+                    logger.warning("Forecast result queue full. Oldest result discarded")
+                except queue.Empty:
+                    pass
+
+    def getResults(self):
+        """
+        Return all results available without waiting
+        """
+        res = list()
+        while True:
+            try:
+                res.append(self.results.get_nowait())
+            except queue.Empty:
+                return res
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the worker and wait until it has terminated, at most timeout seconds
+
+        Waits for retries of forecast requests are interrupted.
+        A request in progress is ended by its timeouts.
+        """
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join(timeout)
+            if self.is_alive():
+                logger.warning("Forecast worker did not terminate within %s s", timeout)
@@ -0,0 +1,352 @@
+#!/usr/bin/python3
+"""
+Module for importing measurement files and forecast archives into the database
+
+Measurement files are written by weatherstation with fileOut (fileName),
+forecast archives with forecast.forecastFileOut (forecast.forecastFile).
+They are imported with
+
+    python importer.py [-c CONFIG] [-m FILE ...] [-f FILE ...] [-w WORKERS]
+
+Files are split into ranges of some MB which are parsed in a pool of processes.
+Parsed measurements are inserted with batched upserts, one transaction per batch,
+so that files can be imported again without creating duplicates.
+
+Archived forecasts are mapped with mapForecast in the worker processes and
+stored in chronological order with forecastToDbBulk, so that the forecast
+tables get the same content, including historical forecast, as if the
+forecasts had been stored when they were received.
+Forecast archives should therefore be imported into tables which do not
+contain newer forecasts.
+
+Rollup tables, if configured, are rebuilt after measurements have been imported.
+"""
+import os
+import sys
+import json
+import time
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import storage
+import rollup
+import timestamps
+import toolConfig
+import weatherForecastOWM
+from records import MEASUREMENT_COLUMNS, parseMeasurement
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Size in bytes of the file ranges parsed by one task
+RANGE_SIZE = 8 * 1024 * 1024
+# Number of measurements inserted per transaction
+BATCH_SIZE = 10000
+
+# Start of each entry in forecast archives (see weatherForecastOWM.forecastToFile)
+FC_MARKER = '{"time": "'
+# Size in bytes read in addition when an archive entry extends beyond a range
+FC_READ_AHEAD = 1024 * 1024
+
+def initWorker(utc):
+    """
+    Initialize a worker process
+    """
+    timestamps.setUtc(utc)
+
+def splitFile(fileName, rangeSize=RANGE_SIZE):
+    """
+    Return the tasks (fileName, start, end) for the ranges of a file
+    """
+    size = os.path.getsize(fileName)
+    return [(fileName, start, min(start + rangeSize, size)) for start in range(0, size, rangeSize)]
+
+def parseMeasurements(task):
+    """
+    Parse the lines of a range of a measurement file
+
+    Lines belong to the range in which they start.
+
+    Returns the rows, the number of bytes of the range and the number of invalid lines
+    """
+    fileName, start, end = task
+    rows = list()
+    errors = 0
+    with open(fileName, "rb") as f:
+        if start > 0:
+            # Skip the line started in the previous range
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                rows.append(parseMeasurement(line.decode("utf-8")))
+            except ValueError:
+                errors = errors + 1
+    return rows, end - start, errors
+
+def parseForecasts(task):
+    """
+    Parse and map the entries of a range of a forecast archive
+
+    Entries belong to the range in which they start.
+
+    Returns a list of (timestamp, location, mapped forecast, alerts) for each entry,
+    the number of bytes of the range and the number of invalid entries.
+    Alerts are returned as dictionary with the alerts of the forecast.
+    """
+    fileName, start, end = task
+    res = list()
+    errors = 0
+    decoder = json.JSONDecoder()
+    with open(fileName, "rb") as f:
+        f.seek(start)
+        # Archives are pure ASCII (json.dumps escapes other characters),
+        # so that string positions are byte positions
+        # The marker of an entry starting before the end of the range is read completely
+        text = f.read(end - start + len(FC_MARKER)).decode("ascii", errors="replace")
+        eof = False
+        pos = 0
+        while True:
+            pos = text.find(FC_MARKER, pos)
+            if pos < 0 or start + pos >= end:
+                break
+            try:
+                entry, nxt = decoder.raw_decode(text, pos)
+            except ValueError:
+                if eof:
+                    # Incomplete last entry, e.g. if weatherstation was killed
+                    errors = errors + 1
+                    pos = pos + len(FC_MARKER)
+                    continue
+                more = f.read(FC_READ_AHEAD)
+                eof = len(more) < FC_READ_AHEAD
+                text = text + more.decode("ascii", errors="replace")
+                continue
+            pos = nxt
+            try:
+                ts = entry["time"]
+                fc = entry["data"]
+                fcData = weatherForecastOWM.mapForecast(fc, ts)
+                res.append((ts, entry.get("location"), fcData, {"alerts": fc.get("alerts", [])}))
+            except (KeyError, TypeError, IndexError) as e:
+                logger.debug("Invalid forecast entry at %s: %s", start + pos, e)
+                errors = errors + 1
+    return res, end - start, errors
+
+def firstForecastTime(fileName):
+    """
+    Return the time of the first entry of a forecast archive (None if there is none)
+    """
+    with open(fileName, "rb") as f:
+        head = f.read(4096).decode("ascii", errors="replace")
+    pos = head.find(FC_MARKER)
+    if pos < 0:
+        return None
+    return head[pos + len(FC_MARKER):pos + len(FC_MARKER) + 19]
+
+class Importer:
+    """
+    Class importing measurement files and forecast archives
+    """
+    def __init__(self, backend, conf, workers=None, batchSize=BATCH_SIZE, rangeSize=RANGE_SIZE, progress=None):
+        """
+        Constructor for Importer
+
+        Input:
+        - backend  : Storage backend
+        - conf     : Configuration as returned by toolConfig.loadConfig
+        - workers  : Number of worker processes (None: number of CPUs)
+        - batchSize: Number of measurements inserted per transaction
+        - rangeSize: Size in bytes of the file ranges parsed by one task
+        - progress : Function called with the statistics after each parsed range
+        """
+        self.backend = backend
+        self.conf = conf
+        self.workers = workers if workers else os.cpu_count()
+        self.batchSize = batchSize
+        self.rangeSize = rangeSize
+        self.progress = progress
+
+        self.stats = {
+            "bytesTotal"   : 0,
+            "bytesDone"    : 0,
+            "measurements" : 0,
+            "forecasts"    : 0,
+            "errors"       : 0,
+            "runTime"      : 0.0,
+            "rowsPerSecond": 0.0
+        }
+        self.t0 = None
+
+    def results(self, fn, tasks):
+        """
+        Execute tasks in the process pool and return the results in task order
+
+        At most two tasks per worker are submitted in advance,
+        so that parsed results do not pile up if the database is slower than parsing.
+        """
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=initWorker, initargs=(timestamps.utc,)) as executor:
+            tasks = iter(tasks)
+            pending = collections.deque(executor.submit(fn, task) for task in itertools.islice(tasks, 2 * self.workers))
+            while len(pending) > 0:
+                res = pending.popleft().result()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(executor.submit(fn, task))
+                yield res
+
+    def updateStats(self, size, errors):
+        """
+        Update statistics after a range has been imported and report progress
+        """
+        self.stats["bytesDone"] = self.stats["bytesDone"] + size
+        self.stats["errors"] = self.stats["errors"] + errors
+        self.stats["runTime"] = time.perf_counter() - self.t0
+        if self.stats["runTime"] > 0:
+            self.stats["rowsPerSecond"] = (self.stats["measurements"] + self.stats["forecasts"]) / self.stats["runTime"]
+        logger.info("%.1f%%: %s measurements, %s forecasts (%.0f rows/s)",
+                    100 * self.stats["bytesDone"] / max(self.stats["bytesTotal"], 1),
+                    self.stats["measurements"], self.stats["forecasts"], self.stats["rowsPerSecond"])
+        if self.progress:
+            self.progress(self.getStats())
+
+    def importMeasurements(self, files):
+        """
+        Import measurement files
+        """
+        table = self.conf["dbConnection"]["table"]
+        tasks = [task for fileName in files for task in splitFile(fileName, self.rangeSize)]
+        con = self.backend.connect()
+        try:
+            cur = self.backend.cursor(con)
+            for rows, size, errors in self.results(parseMeasurements, tasks):
+                for i in range(0, len(rows), self.batchSize):
+                    self.backend.insertMeasurements(cur, table, rows[i:i + self.batchSize], MEASUREMENT_COLUMNS)
+                    con.commit()
+                self.stats["measurements"] = self.stats["measurements"] + len(rows)
+                self.updateStats(size, errors)
+        finally:
+            con.close()
+
+    def forecastConfigs(self):
+        """
+        Return the configuration for storing forecasts of each location
+
+        Forecasts without location use the key None.
+        """
+        cfgs = {}
+        if self.conf["forecast"]["forecastTables"]:
+            cfgs[None] = self.conf
+        for location in self.conf["forecast"]["locations"]:
+            if location["forecastTables"] or self.conf["forecast"]["forecastTables"]:
+                cfgs[location["name"]] = weatherForecastOWM.locationConfig(self.conf, location)
+        return cfgs
+
+    def importForecasts(self, files):
+        """
+        Import forecast archives
+
+        Archives are imported in the order of their first forecast.
+        """
+        cfgs = self.forecastConfigs()
+        files = sorted(files, key=lambda fileName: firstForecastTime(fileName) or "")
+        tasks = [task for fileName in files for task in splitFile(fileName, self.rangeSize)]
+        con = self.backend.connect()
+        try:
+            cur = self.backend.cursor(con)
+            for entries, size, errors in self.results(parseForecasts, tasks):
+                for ts, location, fcData, alerts in entries:
+                    locCfg = cfgs.get(location)
+                    if locCfg is None:
+                        logger.warning("No forecast tables for location %s. Forecast %s skipped", location, ts)
+                        errors = errors + 1
+                        continue
+                    weatherForecastOWM.forecastToDbBulk(alerts, fcData, locCfg, ts, ts[0:10], con, cur, True)
+                    self.stats["forecasts"] = self.stats["forecasts"] + 1
+                self.updateStats(size, errors)
+        finally:
+            con.close()
+
+    def run(self, measurementFiles=(), forecastFiles=()):
+        """
+        Import measurement files and forecast archives
+
+        Returns the statistics
+        """
+        self.t0 = time.perf_counter()
+        self.stats["bytesTotal"] = sum(os.path.getsize(fileName) for fileName in list(measurementFiles) + list(forecastFiles))
+        if len(measurementFiles) > 0:
+            self.importMeasurements(measurementFiles)
+            measRollup = rollup.Rollup.fromConfig(self.conf["dbConnection"]["table"], self.conf["rollup"])
+            if measRollup and self.stats["measurements"] > 0:
+                con = self.backend.connect()
+                try:
+                    measRollup.rebuild(con, con.cursor())
+                finally:
+                    con.close()
+        if len(forecastFiles) > 0:
+            self.importForecasts(forecastFiles)
+        self.stats["runTime"] = time.perf_counter() - self.t0
+        return self.getStats()
+
+    def getStats(self):
+        """
+        Return import statistics
+
+        - bytesTotal   : Total size of the files to be imported
+        - bytesDone    : Size of the files parsed and imported so far
+        - measurements : Number of measurements imported
+        - forecasts    : Number of forecasts imported
+        - errors       : Number of lines or forecast entries which could not be imported
+        - runTime      : Time in s
+        - rowsPerSecond: Throughput in measurements and forecasts per second
+        """
+        return self.stats.copy()
+
+def printProgress(stats):
+    """
+    Show the progress of an import on stderr
+    """
+    sys.stderr.write("\r{:5.1f}%  {} measurements  {} forecasts  {:.0f} rows/s  ".format(
+        100 * stats["bytesDone"] / max(stats["bytesTotal"], 1),
+        stats["measurements"], stats["forecasts"], stats["rowsPerSecond"]))
+    sys.stderr.flush()
+
+def main():
+    parser = toolConfig.argumentParser("Import measurement files and forecast archives")
+    parser.add_argument("-m", "--measurements", nargs="+", default=[], metavar="FILE", help="Measurement files (fileName)")
+    parser.add_argument("-f", "--forecasts", nargs="+", default=[], metavar="FILE", help="Forecast archives (forecast.forecastFile)")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="Number of measurements per transaction (default: %(default)s)")
+    parser.add_argument("-q", "--quiet", action = "store_true", help="Do not show progress")
+    args = parser.parse_args()
+    toolConfig.setupLogging(args)
+
+    if len(args.measurements) == 0 and len(args.forecasts) == 0:
+        parser.error("No files to be imported")
+    conf = toolConfig.loadConfig(args.config)
+    if len(args.forecasts) > 0 and not conf["forecast"]["forecastTables"] \
+       and not any(location["forecastTables"] for location in conf["forecast"]["locations"]):
+        print("No forecast tables configured")
+        sys.exit(1)
+    backend = toolConfig.backendFromConfig(conf)
+    importer = Importer(backend, conf, args.workers, args.batch, progress=None if args.quiet else printProgress)
+    try:
+        stats = importer.run(args.measurements, args.forecasts)
+    except storage.DB_ERRORS as e:
+        print("\nImport failed: {}".format(e))
+        sys.exit(1)
+    if not args.quiet:
+        sys.stderr.write("\n")
+    print("{} measurements and {} forecasts imported in {:.1f} s ({:.0f} rows/s), {} errors".format(
+        stats["measurements"], stats["forecasts"], stats["runTime"], stats["rowsPerSecond"], stats["errors"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,549 @@
+#!/usr/bin/python3
+"""
+Module for maintenance of measurement and forecast tables
+
+Without maintenance, the measurement table grows by about 15 million rows per year
+at a measurement interval of 2 s, and forecast history is never removed.
+A maintenance run
+- creates monthly range partitions for the coming months (MariaDB, partitioned tables)
+- downsamples measurements older than downsampleAfterDays to one row per downsampleInterval
+- removes measurements older than retainDays and forecasts older than forecastRetainDays
+
+For partitioned tables, expired data are removed by dropping whole partitions,
+which takes constant time independent of the number of rows. Tables are converted
+into monthly partitions once with the --partition option of the command line tool.
+Tables which are not partitioned (and all SQLite tables) are cleaned up with
+deletes of one day per transaction.
+
+Downsampling replaces the measurements of a day by their averages per interval.
+For tables with oversampling statistics, the minimum of the minima, the maximum
+of the maxima and the total number of reads are kept, together with the standard
+deviation pooled over the reads of the interval.
+Days are downsampled from the oldest to the newest one, so that a day which
+already has at most one row per interval marks the end of the raw history.
+Rollup tables are not affected. For tables shared by several sensors,
+the measurements of each sensor are downsampled separately.
+
+Maintenance is run periodically by weatherstation (maintenance.interval)
+or with this module as command line tool:
+
+    python maintenance.py [-c CONFIG] [--partition]
+"""
+import sys
+import math
+import time
+import threading
+import storage
+import timestamps
+import toolConfig
+import stationSensors
+from weatherForecastOWM import dbValue
+from records import MEASUREMENT_COLUMNS, SENSOR_COLUMN, measurementColumns
+from oversampling import STATISTICS_COLUMNS
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+maintenanceDefaults = {
+    "interval"           : 0,
+    "retainDays"         : None,
+    "downsampleAfterDays": None,
+    "downsampleInterval" : 300,
+    "forecastRetainDays" : None,
+    "partitionAhead"     : 2
+}
+
+# Measurement columns averaged by downsampling
+DOWNSAMPLE_COLUMNS = MEASUREMENT_COLUMNS[3:]
+
+# Name of the partition for all future rows
+PMAX = "pmax"
+
+# Maximum time in s to wait for the maintenance worker to terminate
+STOP_TIMEOUT = 10
+
+def nextMonth(month):
+    """
+    Return the first day of the month following the month of the given date ("%Y-%m-%d")
+    """
+    year, mon = int(month[0:4]), int(month[5:7])
+    if mon == 12:
+        return "{:04d}-01-01".format(year + 1)
+    return "{:04d}-{:02d}-01".format(year, mon + 1)
+
+def partitionName(month):
+    """
+    Return the name of the partition for the month of the given date
+    """
+    return "p" + month[0:4] + month[5:7]
+
+def partitionMonth(name):
+    """
+    Return the first day of the month of a partition
+    """
+    return name[1:5] + "-" + name[5:7] + "-01"
+
+class Maintenance:
+    """
+    Class for maintenance of measurement and forecast tables
+    """
+    def __init__(self, backend, tables=(), forecastTables=(), retainDays=None, downsampleAfterDays=None,
+                 downsampleInterval=300, forecastRetainDays=None, partitionAhead=2):
+        """
+        Constructor for Maintenance
+
+        Input:
+        - backend            : Storage backend
+        - tables             : Measurement tables (dictionary with the columns of each table, see stationSensors.measurementTables)
+        - forecastTables     : Dictionaries with hourlyForecast, dailyForecast and alertsForecast tables
+        - retainDays         : Number of days for which measurements are retained (None: unlimited)
+        - downsampleAfterDays: Age in days after which measurements are downsampled (None: no downsampling)
+        - downsampleInterval : Interval in s for downsampled measurements
+        - forecastRetainDays : Number of days for which forecasts are retained (None: unlimited)
+        - partitionAhead     : Number of months for which partitions are created in advance
+        """
+        self.backend = backend
+        self.tables = dict(tables)
+        self.forecastTables = list(forecastTables)
+        self.retainDays = retainDays
+        self.downsampleAfterDays = downsampleAfterDays
+        self.downsampleInterval = int(downsampleInterval)
+        self.forecastRetainDays = forecastRetainDays
+        self.partitionAhead = partitionAhead
+        # Event interrupting a maintenance run between days and tables when set
+        self.stopEvent = None
+
+        self.stats = {
+            "runs"             : 0,
+            "partitionsCreated": 0,
+            "partitionsDropped": 0,
+            "rowsDeleted"      : 0,
+            "daysDownsampled"  : 0,
+            "rowsDownsampled"  : 0,
+            "runTime"          : 0.0
+        }
+
+    @classmethod
+    def fromConfig(cls, backend, cfg):
+        """
+        Create the maintenance from the weatherstation configuration
+        """
+        par = maintenanceDefaults.copy()
+        if cfg.get("maintenance"):
+            par.update(cfg["maintenance"])
+        del par["interval"]
+        tables = {}
+        if cfg["includeMeasurement"]:
+            tables = stationSensors.measurementTables(cfg)
+        fcTables = list()
+        if cfg["includeForecast"] and cfg["forecast"]["forecastDbOut"]:
+            fcTables = toolConfig.forecastTables(cfg)
+        return cls(backend, tables, fcTables, **par)
+
+    def partitionedTables(self):
+        """
+        Return the tables which can be partitioned by timestamp
+        """
+        res = list(self.tables)
+        for fcTables in self.forecastTables:
+            res.append(fcTables["hourlyForecast"])
+        return res
+
+    def cutoff(self, days):
+        """
+        Return the date days before today
+        """
+        today = timestamps.seconds(timestamps.now()[1])
+        return timestamps.fromSeconds(today - days * 86400)[:10]
+
+    def partitions(self, cur, tbl):
+        """
+        Return the names of the partitions of a table in ascending order
+
+        The list is empty if the table is not partitioned.
+        """
+        if self.backend.name != "mariadb":
+            return []
+        cur.execute("SELECT PARTITION_NAME FROM INFORMATION_SCHEMA.PARTITIONS"
+                    " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? ORDER BY PARTITION_ORDINAL_POSITION", (tbl,))
+        return [row[0] for row in cur.fetchall() if row[0]]
+
+    def partitionDefinition(self, month):
+        """
+        Return the definition of the partition for a month
+        """
+        return "PARTITION " + partitionName(month) + " VALUES LESS THAN (UNIX_TIMESTAMP('" + nextMonth(month) + " 00:00:00'))"
+
+    def partitionMonths(self, first):
+        """
+        Return the months from the month of the given date until partitionAhead months ahead
+        """
+        last = timestamps.now()[1]
+        for i in range(self.partitionAhead):
+            last = nextMonth(last)
+        months = list()
+        month = first[0:8] + "01"
+        while month <= last:
+            months.append(month)
+            month = nextMonth(month)
+        return months
+
+    def partition(self, con, tbl):
+        """
+        Convert a table into monthly range partitions
+
+        The table is rebuilt, which may take some time for large tables.
+        """
+        if self.backend.name != "mariadb":
+            raise storage.StorageError("Partitioning is only available for MariaDB")
+        cur = con.cursor()
+        if len(self.partitions(cur, tbl)) > 0:
+            logger.info("Table %s is already partitioned", tbl)
+            return
+        cur.execute("SELECT MIN(timestamp) FROM " + tbl)
+        first = cur.fetchone()[0]
+        first = dbValue(first) if first else timestamps.now()[1]
+        defs = [self.partitionDefinition(month) for month in self.partitionMonths(first)]
+        defs.append("PARTITION " + PMAX + " VALUES LESS THAN MAXVALUE")
+        t0 = time.perf_counter()
+        cur.execute("ALTER TABLE " + tbl + " PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (" + ", ".join(defs) + ")")
+        self.stats["partitionsCreated"] = self.stats["partitionsCreated"] + len(defs)
+        logger.info("Table %s converted into %s partitions in %.1f s", tbl, len(defs), time.perf_counter() - t0)
+
+    def addPartitions(self, con, tbl):
+        """
+        Create partitions for the coming months by splitting the partition for future rows
+        """
+        cur = con.cursor()
+        names = self.partitions(cur, tbl)
+        if len(names) == 0:
+            return
+        if names[-1] != PMAX:
+            logger.warning("Table %s has no partition %s. No partitions added", tbl, PMAX)
+            return
+        existing = set(names)
+        months = [m for m in self.partitionMonths(timestamps.now()[1]) if partitionName(m) not in existing]
+        if len(names) > 1:
+            months = [m for m in months if m > partitionMonth(names[-2])]
+        if len(months) == 0:
+            return
+        defs = [self.partitionDefinition(month) for month in months]
+        defs.append("PARTITION " + PMAX + " VALUES LESS THAN MAXVALUE")
+        cur.execute("ALTER TABLE " + tbl + " REORGANIZE PARTITION " + PMAX + " INTO (" + ", ".join(defs) + ")")
+        self.stats["partitionsCreated"] = self.stats["partitionsCreated"] + len(months)
+        logger.info("Table %s: partitions added for %s", tbl, ", ".join(partitionName(m) for m in months))
+
+    def dropPartitions(self, con, tbl, cutoff):
+        """
+        Drop the partitions which only contain rows before the cutoff date
+
+        Returns False if the table is not partitioned
+        """
+        cur = con.cursor()
+        names = self.partitions(cur, tbl)
+        if len(names) == 0:
+            return False
+        expired = [name for name in names if name != PMAX and nextMonth(partitionMonth(name)) <= cutoff]
+        if len(expired) > 0:
+            cur.execute("ALTER TABLE " + tbl + " DROP PARTITION " + ", ".join(expired))
+            self.stats["partitionsDropped"] = self.stats["partitionsDropped"] + len(expired)
+            logger.info("Table %s: partitions dropped: %s", tbl, ", ".join(expired))
+        return True
+
+    def deleteBefore(self, con, tbl, col, cutoff):
+        """
+        Delete rows before the cutoff date, one day per transaction
+        """
+        cur = con.cursor()
+        cur.execute("SELECT MIN(" + col + ") FROM " + tbl)
+        first = cur.fetchone()[0]
+        if first is None:
+            return
+        day = timestamps.seconds(dbValue(first)[0:10])
+        end = timestamps.seconds(cutoff)
+        stmt = "DELETE FROM " + tbl + " WHERE " + col + " < ?"
+        deleted = 0
+        while day < end and not self.stopped():
+            day = min(day + 86400, end)
+            limit = timestamps.fromSeconds(day)
+            cur.execute(stmt, (limit[0:10] if col == "date" else limit,))
+            deleted = deleted + max(cur.rowcount, 0)
+            con.commit()
+        self.stats["rowsDeleted"] = self.stats["rowsDeleted"] + deleted
+        if deleted > 0:
+            logger.info("Table %s: %s rows before %s deleted", tbl, deleted, cutoff)
+
+    def expire(self, con):
+        """
+        Remove measurements and forecasts which are older than their retention period
+        """
+        if self.retainDays:
+            cutoff = self.cutoff(self.retainDays)
+            for tbl in self.tables:
+                if self.stopped():
+                    return
+                if not self.dropPartitions(con, tbl, cutoff):
+                    self.deleteBefore(con, tbl, "timestamp", cutoff)
+        if self.forecastRetainDays:
+            cutoff = self.cutoff(self.forecastRetainDays)
+            for fcTables in self.forecastTables:
+                if self.stopped():
+                    return
+                if not self.dropPartitions(con, fcTables["hourlyForecast"], cutoff):
+                    self.deleteBefore(con, fcTables["hourlyForecast"], "timestamp", cutoff)
+                self.deleteBefore(con, fcTables["dailyForecast"], "date", cutoff)
+                self.deleteBefore(con, fcTables["alertsForecast"], "end", cutoff)
+
+    def bucketExpr(self):
+        """
+        Return the expression for the number of the downsampling interval within the day
+        """
+        if self.backend.dialect == "sqlite":
+            secs = "(CAST(substr(time, 1, 2) AS INTEGER) * 3600 + CAST(substr(time, 4, 2) AS INTEGER) * 60 + CAST(substr(time, 7, 2) AS INTEGER))"
+            return secs + " / " + str(self.downsampleInterval)
+        return "TIME_TO_SEC(time) DIV " + str(self.downsampleInterval)
+
+    def bucketStmt(self, tbl, sensorCol=False, statistics=False):
+        """
+        Return the statement for averaging the measurements of a day per downsampling interval
+
+        With statistics, the aggregates of the statistics columns follow the averages
+        (see statisticsValues).
+        With sensorCol, the measurements are averaged per sensor and the sensor is returned last.
+        """
+        stmt = "SELECT " + self.bucketExpr() + ", COUNT(*), " + ", ".join("AVG(" + col + ")" for col in DOWNSAMPLE_COLUMNS)
+        if statistics:
+            for col in STATISTICS_COLUMNS.values():
+                sd = col + "_sd"
+                # Sums for the pooled standard deviation over the rows with a standard deviation
+                stmt = stmt + ", MIN(" + col + "_min), MAX(" + col + "_max)" \
+                     + ", SUM(CASE WHEN " + sd + " IS NOT NULL THEN samples END)" \
+                     + ", SUM(CASE WHEN " + sd + " IS NOT NULL THEN samples * " + col + " END)" \
+                     + ", SUM(CASE WHEN " + sd + " IS NOT NULL THEN samples * (" + sd + " * " + sd + " + " + col + " * " + col + ") END)" \
+                     + ", COUNT(" + sd + "), COUNT(" + col + ")"
+            stmt = stmt + ", SUM(samples)"
+        if sensorCol:
+            return stmt + ", " + SENSOR_COLUMN + " FROM " + tbl + " WHERE timestamp >= ? AND timestamp < ? GROUP BY 1, " + SENSOR_COLUMN
+        return stmt + " FROM " + tbl + " WHERE timestamp >= ? AND timestamp < ? GROUP BY 1"
+
+    def maxPerBucket(self, cur, tbl, day, sensorCol=False):
+        """
+        Return the maximum number of measurements in a downsampling interval of a day (wall-clock seconds)
+
+        With sensorCol, measurements are counted per sensor.
+        A downsampled day has one measurement per interval, a day without measurements 0.
+        """
+        group = "1, " + SENSOR_COLUMN if sensorCol else "1"
+        stmt = "SELECT MAX(n) FROM (SELECT " + self.bucketExpr() + " AS bucket, COUNT(*) AS n FROM " + tbl \
+             + " WHERE timestamp >= ? AND timestamp < ? GROUP BY " + group + ") AS c"
+        cur.execute(stmt, (timestamps.fromSeconds(day), timestamps.fromSeconds(day + 86400)))
+        n = cur.fetchone()[0]
+        return n if n else 0
+
+    def downsampleDay(self, con, cur, tbl, day, sensorCol=False, statistics=False):
+        """
+        Replace the measurements of a day by their averages per downsampling interval
+
+        Returns the number of rows removed
+        """
+        start = timestamps.fromSeconds(day)
+        end = timestamps.fromSeconds(day + 86400)
+        cur.execute(self.bucketStmt(tbl, sensorCol, statistics), (start, end))
+        buckets = cur.fetchall()
+        count = sum(b[1] for b in buckets)
+        if count <= len(buckets):
+            return 0
+        rows = list()
+        n = len(DOWNSAMPLE_COLUMNS)
+        for b in buckets:
+            ts = timestamps.fromSeconds(day + int(b[0]) * self.downsampleInterval)
+            row = (ts, ts[0:10], ts[11:19]) + tuple(b[2:2 + n])
+            if statistics:
+                row = row + statisticsValues(b[2 + n:3 + n + 7 * len(STATISTICS_COLUMNS)])
+            if sensorCol:
+                row = row + (b[-1],)
+            rows.append(row)
+        cur.execute("DELETE FROM " + tbl + " WHERE timestamp >= ? AND timestamp < ?", (start, end))
+        self.backend.insertMeasurements(cur, tbl, rows, measurementColumns(statistics, sensorCol))
+        con.commit()
+        return count - len(rows)
+
+    def downsample(self, con):
+        """
+        Downsample all days before the downsampling age which have not yet been downsampled
+        """
+        if not self.downsampleAfterDays:
+            return
+        for tbl, columns in self.tables.items():
+            if self.stopped():
+                return
+            self.downsampleTable(con, tbl, SENSOR_COLUMN in columns, "samples" in columns)
+
+    def downsampleTable(self, con, tbl, sensorCol=False, statistics=False):
+        """
+        Downsample the days of a measurement table which have not yet been downsampled
+        """
+        cur = con.cursor()
+        cur.execute("SELECT MIN(timestamp) FROM " + tbl)
+        first = cur.fetchone()[0]
+        if first is None:
+            return
+        firstDay = timestamps.seconds(dbValue(first)[0:10])
+        cutoffDay = timestamps.seconds(self.cutoff(self.downsampleAfterDays))
+
+        # Walk back to the newest day which has already been downsampled.
+        # Days with gaps (e.g. outages) are recognized by the number of measurements per interval
+        day = cutoffDay
+        while day > firstDay:
+            if self.maxPerBucket(cur, tbl, day - 86400, sensorCol) == 1:
+                break
+            day = day - 86400
+
+        # Downsample from the oldest raw day on
+        while day < cutoffDay and not self.stopped():
+            removed = self.downsampleDay(con, cur, tbl, day, sensorCol, statistics)
+            if removed > 0:
+                self.stats["daysDownsampled"] = self.stats["daysDownsampled"] + 1
+                self.stats["rowsDownsampled"] = self.stats["rowsDownsampled"] + removed
+                logger.info("Table %s: %s downsampled, %s rows removed", tbl, timestamps.fromSeconds(day)[0:10], removed)
+            day = day + 86400
+
+    def partitionAll(self):
+        """
+        Convert all tables which can be partitioned into monthly partitions
+        """
+        con = self.backend.connect()
+        try:
+            for tbl in self.partitionedTables():
+                self.partition(con, tbl)
+        finally:
+            con.close()
+
+    def stopped(self):
+        """
+        Return True if the maintenance run is to be interrupted
+        """
+        return self.stopEvent is not None and self.stopEvent.is_set()
+
+    def run(self):
+        """
+        Execute a maintenance run
+        """
+        t0 = time.perf_counter()
+        con = self.backend.connect()
+        try:
+            for tbl in self.partitionedTables():
+                self.addPartitions(con, tbl)
+            self.expire(con)
+            self.downsample(con)
+        finally:
+            con.close()
+        self.stats["runs"] = self.stats["runs"] + 1
+        runTime = time.perf_counter() - t0
+        self.stats["runTime"] = self.stats["runTime"] + runTime
+        if self.stopped():
+            logger.info("Maintenance run interrupted after %.1f s", runTime)
+        else:
+            logger.info("Maintenance run completed in %.1f s", runTime)
+
+    def getStats(self):
+        """
+        Return maintenance statistics
+
+        - runs             : Number of maintenance runs
+        - partitionsCreated: Number of partitions created
+        - partitionsDropped: Number of expired partitions dropped
+        - rowsDeleted      : Number of expired rows deleted
+        - daysDownsampled  : Number of days downsampled
+        - rowsDownsampled  : Number of measurements removed by downsampling
+        - runTime          : Total time in s of maintenance runs
+        """
+        return self.stats.copy()
+
+def statisticsValues(aggregates):
+    """
+    Return the values of OVERSAMPLING_COLUMNS for the aggregated statistics of an interval
+
+    Input:
+    - aggregates: For each quantity of STATISTICS_COLUMNS: minimum, maximum, sum of reads,
+                  sum of reads * mean, sum of reads * (sd^2 + mean^2), number of standard deviations
+                  and number of values, followed by the total number of reads (see Maintenance.bucketStmt)
+
+    The standard deviation is pooled over the reads of all rows.
+    It is None if it is not known for all rows with a value.
+    """
+    values = list()
+    for k in range(len(STATISTICS_COLUMNS)):
+        vMin, vMax, n, s1, s2, nSd, nValues = aggregates[7 * k:7 * k + 7]
+        sd = None
+        if n and nSd == nValues:
+            mean = float(s1) / float(n)
+            sd = math.sqrt(max(float(s2) / float(n) - mean * mean, 0.0))
+        values = values + [vMin, vMax, sd]
+    return tuple(values) + (aggregates[-1],)
+
+class MaintenanceWorker(threading.Thread):
+    """
+    Class representing the background thread running maintenance periodically
+    """
+    def __init__(self, maintenance, interval, delay=60):
+        """
+        Constructor for MaintenanceWorker
+
+        Input:
+        - maintenance: Maintenance to be run
+        - interval   : Interval in hours between maintenance runs
+        - delay      : Delay in s before the first run
+        """
+        super().__init__(name="Maintenance", daemon=True)
+        self.maintenance = maintenance
+        self.interval = interval * 3600
+        self.delay = delay
+        self.stopEvent = threading.Event()
+        self.maintenance.stopEvent = self.stopEvent
+
+    def run(self):
+        wait = self.delay
+        while not self.stopEvent.wait(wait):
+            try:
+                self.maintenance.run()
+            except Exception as e:
+                # Any failure is logged and the next run is attempted after the interval
+                logger.error("Maintenance run failed: %s", e)
+            wait = self.interval
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the worker and wait until it has terminated, at most timeout seconds
+
+        A running maintenance run is interrupted after the current day or table.
+        """
+        self.stopEvent.set()
+        self.join(timeout)
+        if self.is_alive():
+            logger.warning("Maintenance worker did not terminate within %s s", timeout)
+
+def main():
+    parser = toolConfig.argumentParser("Maintenance of weatherstation tables: partitions, downsampling and retention")
+    parser.add_argument("-p", "--partition", action = "store_true", help="Convert tables into monthly partitions first (MariaDB)")
+    args = parser.parse_args()
+    toolConfig.setupLogging(args)
+
+    conf = toolConfig.loadConfig(args.config)
+    backend = toolConfig.backendFromConfig(conf)
+    maint = Maintenance.fromConfig(backend, conf)
+    try:
+        if args.partition:
+            maint.partitionAll()
+        maint.run()
+    except storage.DB_ERRORS as e:
+        print("Maintenance failed: {}".format(e))
+        sys.exit(1)
+    print(maint.getStats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+"""
+Module for oversampling of sensor reads
+
+With oversampling, the sensor is read several times per measurement interval.
+The reads are evenly spaced within the interval, starting at the measurement timestamp.
+One measurement per interval is stored with the averages of the accepted values,
+optionally together with minimum, maximum and standard deviation.
+
+Reads which deviate from the median of the recent reads by more than
+madThreshold times the median absolute deviation (MAD, scaled to the standard
+deviation of a normal distribution) are rejected as glitches (Hampel filter).
+The recent reads of each quantity are kept in a ring buffer of fixed size,
+which also includes reads of preceding intervals, so that the filter is
+effective from the first read of an interval. At the end of an interval,
+the accepted values are checked again against the complete ring buffer,
+which removes glitches accepted while the buffer was filling up.
+Because all reads are kept in the ring buffer, a persistent change of the
+measured value is accepted as soon as it holds for half the buffer.
+Until then, all values of a quantity in an interval may be rejected. In this case,
+the median of all values read in the interval is stored instead, so that a
+step change does not result in missing measurements.
+
+Failed reads (RuntimeError, e.g. DHT checksum errors) are skipped.
+Only if all reads of an interval fail, a RuntimeError is raised.
+"""
+import time
+import math
+import statistics
+from records import SensorReading, SENSOR_QUANTITIES
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+oversamplingDefaults = {
+    "samples"     : 1,
+    "bufferSize"  : 30,
+    "madThreshold": 3.5,
+    "statistics"  : False
+}
+
+# Minimum time in s between reads for each sensor type
+# (the DHT driver returns the values of the last handshake within this time)
+MIN_READ_INTERVAL = {
+    "DHT11": 1.0,
+    "DHT22": 2.0
+}
+
+# Deviation from the median which is always accepted, for each quantity
+# (avoids rejecting values if the recent values are (almost) constant)
+MIN_DEVIATION = {
+    "temperature": 0.5,
+    "humidity"   : 2.0,
+    "pressure"   : 0.5,
+    "altitude"   : 5.0
+}
+
+# Number of values in the ring buffer required before outliers are rejected
+MIN_VALUES = 5
+
+# Factor scaling the MAD to the standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+
+# Column prefix of the statistics for each quantity (see OVERSAMPLING_COLUMNS)
+STATISTICS_COLUMNS = {
+    "temperature": "temperature",
+    "humidity"   : "humidity",
+    "pressure"   : "pressure_m"
+}
+
+class RingBuffer:
+    """
+    Class representing a ring buffer of fixed size for float values
+    """
+    def __init__(self, size):
+        """
+        Constructor for RingBuffer
+
+        Input:
+        - size: Maximum number of values. If full, the oldest value is replaced
+        """
+        self.data = [0.0] * size
+        self.size = size
+        self.count = 0
+        self.next = 0
+
+    def append(self, value):
+        """
+        Add a value
+        """
+        self.data[self.next] = value
+        self.next = (self.next + 1) % self.size
+        if self.count < self.size:
+            self.count = self.count + 1
+
+    def values(self):
+        """
+        Return the values in the buffer (in arbitrary order)
+        """
+        if self.count < self.size:
+            return self.data[:self.count]
+        return self.data
+
+class OutlierFilter:
+    """
+    Class rejecting values which deviate too much from the recent values (Hampel filter)
+    """
+    def __init__(self, size, threshold, minDeviation=0.0):
+        """
+        Constructor for OutlierFilter
+
+        Input:
+        - size        : Number of recent values considered
+        - threshold   : Maximum deviation from the median in multiples of the scaled MAD
+        - minDeviation: Deviation from the median which is always accepted
+        """
+        self.buffer = RingBuffer(size)
+        self.threshold = threshold
+        self.minDeviation = minDeviation
+
+    def isOutlier(self, value):
+        """
+        Check a value against the recent values
+
+        Values are not rejected before MIN_VALUES values are available.
+        """
+        if self.buffer.count < MIN_VALUES:
+            return False
+        values = self.buffer.values()
+        median = statistics.median(values)
+        mad = statistics.median([abs(v - median) for v in values])
+        return abs(value - median) > max(self.threshold * MAD_SCALE * mad, self.minDeviation)
+
+    def accept(self, value):
+        """
+        Check a value against the recent values and add it to the recent values
+
+        Returns False if the value is an outlier
+        """
+        res = not self.isOutlier(value)
+        self.buffer.append(value)
+        return res
+
+class Oversampler:
+    """
+    Class aggregating several sensor reads to one measurement per interval
+    """
+    def __init__(self, samples, bufferSize=30, madThreshold=3.5):
+        """
+        Constructor for Oversampler
+
+        Input:
+        - samples     : Number of sensor reads per measurement interval
+        - bufferSize  : Size of the ring buffer with recent reads of each quantity
+        - madThreshold: Maximum deviation from the median of recent reads in multiples of the scaled MAD
+        """
+        self.samples = samples
+        self.filters = {q: OutlierFilter(bufferSize, madThreshold, MIN_DEVIATION[q]) for q in SENSOR_QUANTITIES}
+
+        self.stats = {
+            "intervals": 0,
+            "reads"    : 0,
+            "failures" : 0,
+            "rejected" : 0,
+            "fallbacks": 0
+        }
+
+    @classmethod
+    def fromConfig(cls, oversamplingCfg, sensorType, interval):
+        """
+        Create an oversampler from the oversampling section of the configuration
+
+        The number of samples is limited so that the minimum read interval of the sensor is kept.
+        Returns None if oversampling is not configured.
+        """
+        par = oversamplingDefaults.copy()
+        if oversamplingCfg:
+            par.update(oversamplingCfg)
+        samples = par["samples"]
+        minInterval = MIN_READ_INTERVAL.get(sensorType, 0.0)
+        if minInterval > 0 and samples * minInterval > interval:
+            samples = max(int(interval // minInterval), 1)
+            logger.warning("Sensor %s can be read at most every %s s. Oversampling limited to %s samples", sensorType, minInterval, samples)
+        if samples <= 1:
+            return None
+        return cls(samples, par["bufferSize"], par["madThreshold"])
+
+    def collect(self, reader, duration):
+        """
+        Read the sensor repeatedly and return the aggregated reading and its statistics
+
+        Input:
+        - reader  : SensorReader
+        - duration: Time in s over which the reads are spread (0: reads without delay)
+
+        Returns a SensorReading with averages and a dictionary with values for OVERSAMPLING_COLUMNS
+        """
+        spacing = duration / self.samples
+        t0 = time.monotonic()
+        accepted = {q: [] for q in SENSOR_QUANTITIES}
+        read = {q: [] for q in SENSOR_QUANTITIES}
+        reads = 0
+        for k in range(self.samples):
+            if k > 0:
+                wait = t0 + k * spacing - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            try:
+                reading = reader.read()
+            except RuntimeError as e:
+                self.stats["failures"] = self.stats["failures"] + 1
+                logger.debug("Sensor read %s failed: %s", k, e)
+                continue
+            reads = reads + 1
+            for q in SENSOR_QUANTITIES:
+                value = getattr(reading, q)
+                if value is None:
+                    continue
+                read[q].append(value)
+                if self.filters[q].accept(value):
+                    accepted[q].append(value)
+                else:
+                    self.stats["rejected"] = self.stats["rejected"] + 1
+                    logger.debug("Outlier rejected: %s=%s", q, value)
+        self.stats["intervals"] = self.stats["intervals"] + 1
+        self.stats["reads"] = self.stats["reads"] + reads
+        if reads == 0:
+            raise RuntimeError("All {} sensor reads of the interval failed".format(self.samples))
+
+        # Values accepted while the ring buffer was filling up are checked again
+        for q in SENSOR_QUANTITIES:
+            values = [v for v in accepted[q] if not self.filters[q].isOutlier(v)]
+            self.stats["rejected"] = self.stats["rejected"] + len(accepted[q]) - len(values)
+            accepted[q] = values
+
+        reading = SensorReading()
+        for q in SENSOR_QUANTITIES:
+            values = accepted[q]
+            if len(values) > 0:
+                setattr(reading, q, math.fsum(values) / len(values))
+            elif len(read[q]) > 0:
+                # All values rejected (e.g. step change): fall back to the median of the interval
+                self.stats["fallbacks"] = self.stats["fallbacks"] + 1
+                logger.debug("All values of %s rejected. Median of %s values used", q, len(read[q]))
+                setattr(reading, q, statistics.median(read[q]))
+                accepted[q] = read[q]
+        stats = {"samples": reads}
+        for q, col in STATISTICS_COLUMNS.items():
+            values = accepted[q]
+            if len(values) > 0:
+                stats[col + "_min"] = min(values)
+                stats[col + "_max"] = max(values)
+                stats[col + "_sd"] = statistics.pstdev(values)
+            else:
+                stats[col + "_min"] = None
+                stats[col + "_max"] = None
+                stats[col + "_sd"] = None
+        return reading, stats
+
+    def getStats(self):
+        """
+        Return oversampling statistics
+
+        - intervals: Number of measurement intervals
+        - reads    : Number of successful sensor reads
+        - failures : Number of failed sensor reads
+        - rejected : Number of values rejected as outliers
+        - fallbacks: Number of intervals in which all values of a quantity were rejected
+                     and the median of the interval was used
+        """
+        return self.stats.copy()
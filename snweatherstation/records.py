@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+"""
+Module with record types for measurements, forecast rows and alerts
+
+Records are compact objects with __slots__ whose fields correspond to table columns.
+They are shared by all sinks (database, file, spool):
+- astuple returns the values of all fields in column order (statement parameters)
+- toDict returns a dictionary of all fields (JSON serialisation)
+"""
+import operator
+import timestamps
+
+# Columns of forecast tables (in addition to the key and administrative columns)
+HOURLY_COLUMNS = ["temperature", "humidity", "pressure", "clouds", "uvi", "visibility",
+                  "windspeed", "winddir", "rain", "snow", "description", "icon", "alerts"]
+HOURLY_HIST_COLUMNS = ["temperature", "humidity", "pressure"]
+DAILY_COLUMNS = ["sunrise", "sunset", "temperature_m", "temperature_d", "temperature_e", "temperature_n",
+                 "temperature_min", "temperature_max", "humidity", "pressure", "windspeed", "winddir",
+                 "clouds", "uvi", "pop", "rain", "snow", "description", "icon", "alerts"]
+# Columns of the measurement table
+MEASUREMENT_COLUMNS = ["timestamp", "date", "time", "temperature", "humidity", "pressure_m", "pressure", "altitude"]
+# Columns of the alerts table
+ALERT_COLUMNS = ["start", "end", "event", "sender_name", "description"]
+# Columns with statistics of oversampled measurements (optional columns of the measurement table)
+OVERSAMPLING_COLUMNS = [m + "_" + a for m in ["temperature", "humidity", "pressure_m"] for a in ["min", "max", "sd"]] + ["samples"]
+# Column identifying the sensor, for measurement tables shared by several sensors
+SENSOR_COLUMN = "sensor"
+# Quantities read from environment sensors
+SENSOR_QUANTITIES = ["temperature", "humidity", "pressure", "altitude"]
+
+def measurementColumns(statistics=False, sensorId=False):
+    """
+    Return the columns of a measurement table
+
+    Input:
+    - statistics: If True, the table includes OVERSAMPLING_COLUMNS
+    - sensorId  : If True, the table includes SENSOR_COLUMN
+    """
+    columns = MEASUREMENT_COLUMNS
+    if statistics:
+        columns = columns + OVERSAMPLING_COLUMNS
+    if sensorId:
+        columns = columns + [SENSOR_COLUMN]
+    return columns
+
+class Record:
+    """
+    Base class for records
+
+    Subclasses define __slots__ and, optionally, DEFAULTS for fields which are not None by default.
+    """
+    __slots__ = ()
+    DEFAULTS = {}
+
+    def __init__(self, *args, **kwargs):
+        """
+        Constructor for Record
+
+        Fields can be given positionally in field order or by name.
+        Fields not given are set to their default.
+        """
+        for field, value in zip(self.__slots__, args):
+            setattr(self, field, value)
+        for field in self.__slots__[len(args):]:
+            setattr(self, field, kwargs.pop(field, self.DEFAULTS.get(field)))
+        if kwargs:
+            raise TypeError("Invalid fields for " + type(self).__name__ + ": " + ", ".join(kwargs))
+
+    def astuple(self):
+        """
+        Return the values of all fields in field order
+        """
+        return self._getter(self)
+
+    def toDict(self):
+        """
+        Return a dictionary with all fields
+        """
+        return dict(zip(self.__slots__, self.astuple()))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.astuple() == other.astuple()
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + ", ".join(f + "=" + repr(v) for f, v in zip(self.__slots__, self.astuple())) + ")"
+
+def _record(cls):
+    """
+    Complete a record class with a getter for all fields
+    """
+    cls._getter = operator.attrgetter(*cls.__slots__)
+    return cls
+
+@_record
+class Measurement(Record):
+    """
+    Class representing a measurement sample
+    """
+    __slots__ = tuple(MEASUREMENT_COLUMNS)
+
+    def toText(self):
+        """
+        Return the sample as line for the measurement output file
+        """
+        txt = self.timestamp
+        if self.temperature is None:
+            txt = txt + ","
+        else:
+            txt = txt + "{:+.1f},".format(self.temperature)
+        if self.humidity is None:
+            txt = txt + ","
+        else:
+            txt = txt + "{:.1f},".format(self.humidity)
+        if self.pressure_m is None:
+            txt = txt + ","
+        else:
+            txt = txt + "{:.1f},".format(self.pressure_m)
+            txt = txt + "{:.1f},".format(self.pressure)
+        if self.pressure_m is None:
+            txt = txt + ","
+        else:
+            txt = txt + "{:.1f}".format(self.altitude)
+        return txt + "\n"
+
+def parseMeasurement(line):
+    """
+    Return the measurement row for a line of a measurement file
+
+    Lines are written by Measurement.toText: the timestamp is directly followed
+    by temperature, humidity, pressure_m, pressure and altitude, separated by commas.
+
+    Raises ValueError if the line cannot be parsed.
+    """
+    line = line.rstrip("\r\n")
+    ts = line[0:19]
+    if len(ts) < 19 or ts[4] != "-" or ts[10] != " " or ts[13] != ":":
+        raise ValueError("Invalid timestamp: " + ts)
+    fields = line[19:].split(",")
+    if len(fields) > 5:
+        raise ValueError("Too many values: " + line)
+    fields = fields + [""] * (5 - len(fields))
+    return (ts, ts[0:10], ts[11:19]) + tuple(float(v) if v else None for v in fields)
+
+@_record
+class OversampledMeasurement(Record):
+    """
+    Class representing a measurement aggregated from several sensor reads, with statistics
+    """
+    __slots__ = tuple(MEASUREMENT_COLUMNS + OVERSAMPLING_COLUMNS)
+
+    toText = Measurement.toText
+
+@_record
+class SensorMeasurement(Record):
+    """
+    Class representing a measurement sample of one of several sensors stored in the same table
+    """
+    __slots__ = tuple(MEASUREMENT_COLUMNS + [SENSOR_COLUMN])
+
+    toText = Measurement.toText
+
+@_record
+class OversampledSensorMeasurement(Record):
+    """
+    Class representing an oversampled measurement of one of several sensors stored in the same table
+    """
+    __slots__ = tuple(MEASUREMENT_COLUMNS + OVERSAMPLING_COLUMNS + [SENSOR_COLUMN])
+
+    toText = Measurement.toText
+
+def measurementClass(statistics=False, sensorId=False):
+    """
+    Return the record class for rows of a measurement table (see measurementColumns)
+    """
+    if statistics:
+        return OversampledSensorMeasurement if sensorId else OversampledMeasurement
+    return SensorMeasurement if sensorId else Measurement
+
+@_record
+class SensorReading(Record):
+    """
+    Class representing the quantities read from a sensor in one read
+    """
+    __slots__ = tuple(SENSOR_QUANTITIES)
+
+@_record
+class HourlyRow(Record):
+    """
+    Class representing a row of the current or hourly forecast
+    """
+    __slots__ = ("timestamp",) + tuple(HOURLY_COLUMNS)
+    DEFAULTS = {"alerts": 0}
+
+    def values(self):
+        """
+        Return the values of HOURLY_COLUMNS
+        """
+        return self.astuple()[1:]
+
+@_record
+class DailyRow(Record):
+    """
+    Class representing a row of the daily forecast
+    """
+    __slots__ = ("date",) + tuple(DAILY_COLUMNS)
+    DEFAULTS = {"alerts": 0}
+
+    def values(self):
+        """
+        Return the values of DAILY_COLUMNS
+        """
+        return self.astuple()[1:]
+
+@_record
+class Alert(Record):
+    """
+    Class representing a weather alert
+    """
+    __slots__ = tuple(ALERT_COLUMNS)
+
+    @classmethod
+    def fromOwm(cls, alert):
+        """
+        Create an alert from an alert of the OpenWeatherMap forecast
+        """
+        return cls(
+            timestamps.timestamp(alert["start"]),
+            timestamps.timestamp(alert["end"]),
+            alert["event"],
+            alert["sender_name"],
+            alert["description"]
+        )
+
+    def key(self):
+        """
+        Return the key of the alert (start, end, event, sender_name)
+        """
+        return self.astuple()[:4]
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+"""
+Module for maintaining hourly and daily rollup tables of measurements
+
+For each hour and each day, the rollup tables hold minimum, maximum, average
+and number of values of temperature, humidity, pressure and pressure_m.
+Queries for charts over long periods can use these tables instead of
+aggregating all measurements.
+
+The rollup tables are maintained incrementally: for the hours and days of the
+measurements written with a group commit, the rollup rows are computed again from
+the measurement table within the same transaction. Because measurements are
+upserted, rows which are written again (spool replay, retried commits) do not
+distort the rollup.
+
+rebuild computes the rollup tables from the complete measurement table,
+e.g. for existing history or after rows have been imported or deleted.
+"""
+import time
+import dbStatements
+import timestamps
+from records import MEASUREMENT_COLUMNS
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+rollupDefaults = {
+    "hourlyTable": None,
+    "dailyTable" : None
+}
+
+# Measurement columns which are aggregated
+ROLLUP_MEASURES = ["temperature", "humidity", "pressure", "pressure_m"]
+# Aggregates for each measure
+ROLLUP_AGGREGATES = ["min", "max", "avg", "count"]
+# Columns of rollup tables in addition to the key
+ROLLUP_COLUMNS = [m + "_" + a for m in ROLLUP_MEASURES for a in ROLLUP_AGGREGATES]
+
+def bucketExpr(keyCol):
+    """
+    Return the expression for the rollup key of a row with a timestamp column
+    """
+    if keyCol == "date":
+        if dbStatements.dialect == "sqlite":
+            return "substr(timestamp, 1, 10)"
+        return "DATE(timestamp)"
+    if dbStatements.dialect == "sqlite":
+        return "substr(timestamp, 1, 13) || ':00:00'"
+    return "TIMESTAMP(DATE(timestamp), MAKETIME(HOUR(timestamp), 0, 0))"
+
+def rebuildStmt(tbl, keyCol, measTbl, ranged=False):
+    """
+    Return the statement computing a rollup table from the measurement table
+
+    With ranged, only the measurements in a timestamp range (two parameters) are aggregated.
+    """
+    def build():
+        sel = list()
+        for m in ROLLUP_MEASURES:
+            sel = sel + ["MIN(" + m + ")", "MAX(" + m + ")", "AVG(" + m + ")", "COUNT(" + m + ")"]
+        where = " WHERE timestamp >= ? AND timestamp < ?" if ranged else ""
+        return "INSERT INTO " + tbl + " (" + ", ".join([keyCol] + ROLLUP_COLUMNS) + ")" \
+             + " SELECT " + bucketExpr(keyCol) + ", " + ", ".join(sel) + " FROM " + measTbl + where \
+             + " GROUP BY " + bucketExpr(keyCol)
+
+    return dbStatements.cachedStatement(("rollupRebuild", tbl, keyCol, measTbl, ranged), build)
+
+def dailyFromHourlyStmt(tbl, hourlyTbl):
+    """
+    Return the statement computing the daily rollup for a timestamp range (two parameters) from the hourly rollup
+
+    Averages are weighted with the number of values of each hour.
+    """
+    def build():
+        sel = list()
+        for m in ROLLUP_MEASURES:
+            mn, mx, avg, cnt = [m + "_" + a for a in ROLLUP_AGGREGATES]
+            sel = sel + ["MIN(" + mn + ")", "MAX(" + mx + ")",
+                         "SUM(" + avg + " * " + cnt + ") / NULLIF(SUM(" + cnt + "), 0)", "SUM(" + cnt + ")"]
+        return "INSERT INTO " + tbl + " (" + ", ".join(["date"] + ROLLUP_COLUMNS) + ")" \
+             + " SELECT " + bucketExpr("date") + ", " + ", ".join(sel) + " FROM " + hourlyTbl \
+             + " WHERE timestamp >= ? AND timestamp < ? GROUP BY " + bucketExpr("date")
+
+    return dbStatements.cachedStatement(("rollupDaily", tbl, hourlyTbl), build)
+
+class Rollup:
+    """
+    Class maintaining the rollup tables for a measurement table
+    """
+    def __init__(self, table, hourlyTable=None, dailyTable=None, columns=MEASUREMENT_COLUMNS):
+        """
+        Constructor for Rollup
+
+        Input:
+        - table      : Measurement table
+        - hourlyTable: Hourly rollup table (None: not maintained)
+        - dailyTable : Daily rollup table (None: not maintained)
+        - columns    : Columns of measurement rows
+        """
+        self.table = table
+        self.hourlyTable = hourlyTable
+        self.dailyTable = dailyTable
+        self.tsIndex = columns.index("timestamp")
+
+    @classmethod
+    def fromConfig(cls, table, rollupCfg, columns=MEASUREMENT_COLUMNS):
+        """
+        Create a rollup from the rollup section of the configuration
+
+        Returns None if no rollup table is configured.
+        """
+        par = rollupDefaults.copy()
+        if rollupCfg:
+            par.update(rollupCfg)
+        if not par["hourlyTable"] and not par["dailyTable"]:
+            return None
+        return cls(table, par["hourlyTable"], par["dailyTable"], columns)
+
+    def update(self, cur, rows):
+        """
+        Recompute the rollup rows of the hours and days of the given measurement rows
+
+        Must be executed in the transaction in which the rows are inserted.
+        The rollup rows are computed from the measurement table, so that rows which are
+        written again (spool replay, retried commits, several samples per second)
+        are not counted twice. The daily rollup is computed from the hourly rollup, if available.
+        """
+        if len(rows) == 0:
+            return
+        ts = self.tsIndex
+        if self.hourlyTable:
+            hours = list()
+            for hour in sorted(set(row[ts][:13] + ":00:00" for row in rows)):
+                hours.append((hour, timestamps.fromSeconds(timestamps.seconds(hour) + 3600)))
+            cur.executemany("DELETE FROM " + self.hourlyTable + " WHERE timestamp >= ? AND timestamp < ?", hours)
+            stmt = rebuildStmt(self.hourlyTable, "timestamp", self.table, ranged=True)
+            logger.debug("%s (%s hours)", stmt, len(hours))
+            cur.executemany(stmt, hours)
+        if self.dailyTable:
+            days = list()
+            for day in sorted(set(row[ts][:10] for row in rows)):
+                nextDay = timestamps.fromSeconds(timestamps.seconds(day) + 86400)
+                days.append((day + " 00:00:00", nextDay))
+            cur.executemany("DELETE FROM " + self.dailyTable + " WHERE date >= ? AND date < ?", [(start[:10], end[:10]) for start, end in days])
+            if self.hourlyTable:
+                stmt = dailyFromHourlyStmt(self.dailyTable, self.hourlyTable)
+            else:
+                stmt = rebuildStmt(self.dailyTable, "date", self.table, ranged=True)
+            logger.debug("%s (%s days)", stmt, len(days))
+            cur.executemany(stmt, days)
+
+    def rebuild(self, con, cur):
+        """
+        Compute the rollup tables from all measurements
+
+        Existing rollup rows are replaced within one transaction.
+        """
+        for tbl, keyCol in [(self.hourlyTable, "timestamp"), (self.dailyTable, "date")]:
+            if not tbl:
+                continue
+            t0 = time.perf_counter()
+            cur.execute("DELETE FROM " + tbl)
+            stmt = rebuildStmt(tbl, keyCol, self.table)
+            logger.debug(stmt)
+            cur.execute(stmt)
+            logger.info("Rollup table %s rebuilt from %s in %.1f s", tbl, self.table, time.perf_counter() - t0)
+        con.commit()
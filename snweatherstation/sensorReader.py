@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""
+Module for reading the quantities of an environment sensor with as few sensor accesses as possible
+
+The EnvironmentSensor objects of snraspi provide each quantity as a property
+which accesses the sensor. Reading temperature, humidity, pressure and altitude
+one after the other therefore costs several bus transactions:
+on a BME280, each of humidity, pressure and altitude reads the temperature again
+and altitude reads the pressure again.
+
+SensorReader reads only the quantities supported by the sensor type back to back,
+one driver call per quantity, and computes the altitude from the pressure,
+as the sensor driver does. On a BME280, temperature, humidity and pressure
+therefore still come from separate conversions, taken within a few milliseconds.
+For DHT sensors, the driver keeps the values of a handshake for 2 s,
+so that temperature and humidity come from the same handshake.
+
+Sensors which provide a method snapshot() returning a SensorReading
+(e.g. sensors which are not snraspi sensors) are read with this method.
+
+The time spent for reading the sensor (bus time) is recorded for each read.
+"""
+import time
+from records import SensorReading
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Quantities read from the sensor for each snraspi sensor type
+# (altitude is derived from pressure)
+SENSOR_QUANTITIES = {
+    "BME280_I2C": ["temperature", "humidity", "pressure"],
+    "BME280_SPI": ["temperature", "humidity", "pressure"],
+    "DHT11"     : ["temperature", "humidity"],
+    "DHT22"     : ["temperature", "humidity"]
+}
+
+# Sea level pressure in hPa assumed for the altitude (as in the BME280 driver)
+SEA_LEVEL_PRESSURE = 1013.25
+
+def altitude(pressure, seaLevelPressure=SEA_LEVEL_PRESSURE):
+    """
+    Return the altitude in m for a pressure in hPa (international barometric formula)
+    """
+    if pressure is None:
+        return None
+    return 44330.0 * (1.0 - (pressure / seaLevelPressure) ** 0.1903)
+
+class SensorReader:
+    """
+    Class reading all quantities of a sensor back to back
+    """
+    def __init__(self, sensor, sensorType):
+        """
+        Constructor for SensorReader
+
+        Input:
+        - sensor    : Sensor object (snraspi EnvironmentSensor or object with a snapshot method)
+        - sensorType: Type of the sensor (see SENSOR_QUANTITIES)
+        """
+        self.sensor = sensor
+        self.sensorType = sensorType
+        self.quantities = SENSOR_QUANTITIES.get(sensorType, ["temperature", "humidity", "pressure"])
+        self.snapshot = getattr(sensor, "snapshot", None)
+
+        self.stats = {
+            "reads"      : 0,
+            "failures"   : 0,
+            "busTimeLast": 0.0,
+            "busTimeAvg" : 0.0,
+            "busTimeMax" : 0.0
+        }
+        self.busTimeSum = 0.0
+
+    def readSensor(self):
+        """
+        Read the quantities from the sensor
+        """
+        if self.snapshot:
+            return self.snapshot()
+        reading = SensorReading()
+        for quantity in self.quantities:
+            setattr(reading, quantity, getattr(self.sensor, quantity))
+        reading.altitude = altitude(reading.pressure)
+        return reading
+
+    def read(self):
+        """
+        Return a SensorReading with all quantities of the sensor
+
+        Each quantity supported by the sensor type is read with its own driver call
+        (or all with snapshot(), if provided); the altitude is computed from the pressure.
+
+        Errors of the sensor (e.g. RuntimeError for a failed DHT handshake) are raised.
+        """
+        t0 = time.perf_counter()
+        try:
+            reading = self.readSensor()
+        except Exception:
+            self.stats["failures"] = self.stats["failures"] + 1
+            raise
+        finally:
+            busTime = (time.perf_counter() - t0) * 1000
+            self.stats["reads"] = self.stats["reads"] + 1
+            self.busTimeSum = self.busTimeSum + busTime
+            self.stats["busTimeLast"] = busTime
+            self.stats["busTimeAvg"] = self.busTimeSum / self.stats["reads"]
+            if busTime > self.stats["busTimeMax"]:
+                self.stats["busTimeMax"] = busTime
+        logger.debug("Sensor %s read in %.1f ms: %s", self.sensorType, busTime, reading)
+        return reading
+
+    def getStats(self):
+        """
+        Return sensor read statistics
+
+        - reads      : Number of sensor reads
+        - failures   : Number of failed sensor reads
+        - busTimeLast: Time in ms for the last read
+        - busTimeAvg : Average time in ms for a read
+        - busTimeMax : Maximum time in ms for a read
+        """
+        return self.stats.copy()
@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+"""
+Module for spooling database statements while the database is unreachable
+
+Statements with their parameters are stored in a local SQLite file
+in the order in which they have been issued. Each spooling operation
+is committed with synchronous writes, so that spooled rows survive
+a crash or power loss of the Raspberry Pi.
+
+When the database is available again, the spool is replayed in large batches.
+Consecutive entries for the same statement are sent with a single executemany.
+Entries are only removed from the spool after the database has committed them.
+If a batch is rejected by the database because of its data, the batch is
+replayed entry by entry and rejected entries are moved to a quarantine table
+in the spool file, so that a single bad entry does not block the spool.
+"""
+import sqlite3
+import storage
+import threading
+import json
+import time
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+spoolDefaults = {
+    "file"           : None,
+    "maxRows"        : 1000000,
+    "maxSize"        : 100,
+    "replayBatchSize": 5000
+}
+
+class Spool:
+    """
+    Class representing a crash-safe on-disk spool of database statements
+    """
+    def __init__(self, file, maxRows=1000000, maxSize=100, replayBatchSize=5000):
+        """
+        Constructor for Spool
+
+        Input:
+        - file           : Path to the SQLite spool file
+        - maxRows        : Maximum number of spooled rows
+        - maxSize        : Maximum size of the spool file in MB
+        - replayBatchSize: Number of rows committed together when the spool is replayed
+
+        If a limit is exceeded, the oldest rows are discarded.
+        """
+        self.file = file
+        self.maxRows = maxRows
+        self.maxSize = maxSize * 1024 * 1024
+        self.replayBatchSize = replayBatchSize
+        self.lock = threading.RLock()
+
+        self.db = sqlite3.connect(file, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, stmt TEXT NOT NULL, params TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS quarantine (id INTEGER PRIMARY KEY, stmt TEXT NOT NULL, params TEXT NOT NULL, error TEXT)")
+        self.pageSize = self.db.execute("PRAGMA page_size").fetchone()[0]
+        self.rows = self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+        self.stats = {
+            "spooled"     : 0,
+            "replayed"    : 0,
+            "discarded"   : 0,
+            "quarantined" : 0,
+            "replayTime"  : 0.0,
+            "replayRate"  : 0.0
+        }
+        if self.rows > 0:
+            logger.info("Spool %s contains %s rows to be replayed", file, self.rows)
+
+    @classmethod
+    def fromConfig(cls, spoolCfg):
+        """
+        Create a spool from the spool section of the configuration
+
+        Returns None if no spool file is configured.
+        """
+        par = spoolDefaults.copy()
+        if spoolCfg:
+            par.update(spoolCfg)
+        if not par["file"]:
+            return None
+        return cls(**par)
+
+    def pending(self):
+        """
+        Return the number of rows waiting for replay
+        """
+        with self.lock:
+            return self.rows
+
+    def append(self, stmt, rows):
+        """
+        Add rows for a statement to the spool
+        """
+        self.appendMany([(stmt, params) for params in rows])
+
+    def appendMany(self, entries):
+        """
+        Add a sequence of (statement, parameters) entries to the spool in one transaction
+        """
+        if len(entries) == 0:
+            return
+        data = [(stmt, json.dumps(list(params))) for stmt, params in entries]
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany("INSERT INTO spool (stmt, params) VALUES (?, ?)", data)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            self.rows = self.rows + len(data)
+            self.stats["spooled"] = self.stats["spooled"] + len(data)
+            self.enforceLimits()
+        logger.debug("%s rows spooled. Pending: %s", len(data), self.rows)
+
+    def enforceLimits(self):
+        """
+        Discard the oldest rows if the spool exceeds its limits
+        """
+        excess = self.rows - self.maxRows
+        if excess <= 0 and self.size() > self.maxSize:
+            # Discard a tenth of the spool, so that the check is not repeated for every row
+            excess = max(1, self.rows // 10)
+        if excess <= 0:
+            return
+        self.db.execute("DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)", (excess,))
+        self.rows = self.rows - excess
+        self.stats["discarded"] = self.stats["discarded"] + excess
+        logger.warning("Spool limit exceeded. %s oldest rows discarded", excess)
+
+    def size(self):
+        """
+        Return the size of the spool in bytes
+        """
+        pages = self.db.execute("PRAGMA page_count").fetchone()[0]
+        return pages * self.pageSize
+
+    def replay(self, con):
+        """
+        Send all spooled rows to the database
+
+        Rows are committed in batches of replayBatchSize.
+        A connection error stops the replay; rows not yet committed remain in the spool.
+        If a batch fails for other reasons, it is replayed entry by entry
+        and failing entries are quarantined.
+
+        Returns the number of rows replayed
+        """
+        with self.lock:
+            if self.rows == 0:
+                return 0
+            logger.info("Replaying %s spooled rows", self.rows)
+            cur = con.cursor()
+            count = 0
+            t0 = time.perf_counter()
+            while True:
+                batch = self.db.execute("SELECT id, stmt, params FROM spool ORDER BY id LIMIT ?", (self.replayBatchSize,)).fetchall()
+                if len(batch) == 0:
+                    break
+
+                try:
+                    self.replayBatch(cur, batch)
+                    con.commit()
+                    replayed = len(batch)
+                except storage.CONNECTION_ERRORS:
+                    raise
+                except storage.DB_ERRORS as e:
+                    logger.warning("Replay of spooled batch failed: %s. Replaying entry by entry", e)
+                    con.rollback()
+                    replayed = self.replayEntries(cur, batch)
+                    con.commit()
+
+                self.db.execute("DELETE FROM spool WHERE id <= ?", (batch[-1][0],))
+                self.rows = self.rows - len(batch)
+                count = count + replayed
+
+            replayTime = time.perf_counter() - t0
+            self.stats["replayed"] = self.stats["replayed"] + count
+            self.stats["replayTime"] = self.stats["replayTime"] + replayTime
+            if self.stats["replayTime"] > 0:
+                self.stats["replayRate"] = self.stats["replayed"] / self.stats["replayTime"]
+            logger.info("%s spooled rows replayed in %.1f s (%.0f rows/s)", count, replayTime, count / replayTime if replayTime > 0 else 0)
+            return count
+
+    def replayBatch(self, cur, batch):
+        """
+        Send a batch of spool entries
+
+        Consecutive rows for the same statement are sent together.
+        """
+        stmt = None
+        rows = list()
+        for entry in batch:
+            if entry[1] != stmt:
+                if rows:
+                    cur.executemany(stmt, rows)
+                stmt = entry[1]
+                rows = list()
+            rows.append(tuple(json.loads(entry[2])))
+        if rows:
+            cur.executemany(stmt, rows)
+
+    def replayEntries(self, cur, batch):
+        """
+        Send a batch of spool entries one by one
+
+        Entries rejected by the database are moved to the quarantine table.
+
+        Returns the number of entries replayed
+        """
+        count = 0
+        for entry in batch:
+            try:
+                cur.execute(entry[1], tuple(json.loads(entry[2])))
+                count = count + 1
+            except storage.CONNECTION_ERRORS:
+                raise
+            except storage.DB_ERRORS as e:
+                logger.error("Spooled entry %s quarantined: %s (%s, %s)", entry[0], e, entry[1], entry[2])
+                self.db.execute("INSERT OR REPLACE INTO quarantine (id, stmt, params, error) VALUES (?, ?, ?, ?)", (entry[0], entry[1], entry[2], str(e)))
+                self.stats["quarantined"] = self.stats["quarantined"] + 1
+        return count
+
+    def getStats(self):
+        """
+        Return spool statistics
+
+        - pending   : Number of rows waiting for replay
+        - spooled   : Number of rows added to the spool
+        - replayed  : Number of rows replayed to the database
+        - discarded : Number of rows discarded because of size limits
+        - quarantined: Number of rows rejected by the database during replay and moved to the quarantine table
+        - replayTime: Total time in s spent replaying
+        - replayRate: Replay throughput in rows/s
+        """
+        with self.lock:
+            res = self.stats.copy()
+            res["pending"] = self.rows
+        return res
+
+    def close(self):
+        """
+        Close the spool file
+        """
+        with self.lock:
+            self.db.close()
+
+class SpoolConnection:
+    """
+    Class standing in for a database connection while the database is unreachable
+
+    Statements issued through its cursor are collected and added to the spool on commit.
+    Queries return no rows.
+    """
+    def __init__(self, spool):
+        self.spool = spool
+        self.entries = list()
+
+    def cursor(self, prepared=False):
+        return SpoolCursor(self)
+
+    def commit(self):
+        entries = self.entries
+        self.entries = list()
+        self.spool.appendMany(entries)
+
+    def rollback(self):
+        self.entries = list()
+
+    def close(self):
+        self.entries = list()
+
+class SpoolCursor:
+    """
+    Cursor of a SpoolConnection
+    """
+    def __init__(self, con):
+        self.con = con
+
+    def execute(self, stmt, params=()):
+        if stmt.lstrip().upper().startswith("SELECT"):
+            return
+        self.con.entries.append((stmt, params))
+
+    def executemany(self, stmt, rows):
+        for params in rows:
+            self.con.entries.append((stmt, params))
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def __iter__(self):
+        return iter([])
@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+"""
+Module for polling several environment sensors of one station
+
+A station may carry several sensors, e.g. an indoor BME280 on I2C
+and outdoor DHT22 sensors on GPIO. Each sensor has its own type, pin and height
+and stores its measurements either in its own table or, identified by
+a sensor id in the sensor column, in a table shared with other sensors.
+
+All sensors are polled concurrently on a thread pool, so that all measurements
+of a cycle get the timestamp of the cycle start, independent of how long
+the other sensors take. Each sensor has a deadline in s, counted from the end
+of the time over which its reads are spread. A sensor which has not delivered
+its measurement by then is reported as missed and the cycle goes on without it.
+Its read keeps running in the background; the late result is discarded and
+the sensor is skipped in the following cycles until the read has completed.
+"""
+import concurrent.futures
+import time
+import sensorReader
+from records import measurementColumns, measurementClass
+from barometric import pressureReduced
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults for each sensor
+sensorDefaults = {
+    "name"      : None,
+    "sensorType": "BME280_I2C",
+    "raspiPin"  : None,
+    "height"    : None,
+    "table"     : None,
+    "sensorId"  : None,
+    "deadline"  : 5.0,
+    "simulation": None,
+    "replay"    : None
+}
+
+# Quantities of a measurement which are rounded to ROUND_DECIMALS before they are stored
+ROUND_QUANTITIES = ["temperature", "humidity", "pressure_m", "pressure", "altitude"]
+ROUND_DECIMALS = 1
+
+class DeadlineExceeded(RuntimeError):
+    """
+    Error reported for a sensor which has not delivered its measurement in time
+    """
+
+def measurementTables(cfg):
+    """
+    Return the measurement tables of all sensors with their columns
+
+    Input:
+    - cfg: Configuration dictionary for weatherstation
+
+    Returns a dictionary with the list of columns for each table.
+    Sensors without table use dbConnection.table. A table includes the sensor column
+    if a sensor id is configured for any of its sensors.
+    """
+    statistics = bool(cfg.get("oversampling") and cfg["oversampling"].get("statistics"))
+    sensors = cfg.get("sensors")
+    if not sensors:
+        sensors = [sensorDefaults]
+    sensorIds = {}
+    for sensorCfg in sensors:
+        table = sensorCfg.get("table") or cfg["dbConnection"]["table"]
+        sensorIds[table] = sensorIds.get(table, False) or sensorCfg.get("sensorId") is not None
+    return {table: measurementColumns(statistics, sensorId) for table, sensorId in sensorIds.items()}
+
+class StationSensor:
+    """
+    Class representing one sensor of the station
+    """
+    def __init__(self, name, sensorType, sensor, height, table=None, sensorId=None, deadline=5.0, oversampler=None, statistics=False):
+        """
+        Constructor for StationSensor
+
+        Input:
+        - name       : Name of the sensor (for logging)
+        - sensorType : Type of the sensor
+        - sensor     : Sensor object (None: measurements without values)
+        - height     : Height of the sensor above sea level in m (for the reduced pressure)
+        - table      : Table in which the measurements are stored
+        - sensorId   : Value of the sensor column (None: table without sensor column)
+        - deadline   : Time in s after the end of the reads by which the measurement must be available
+        - oversampler: Oversampler aggregating several reads per measurement (None: one read)
+        - statistics : If True, the statistics of the oversampler are included in the measurement
+        """
+        self.name = name
+        self.sensorType = sensorType
+        self.sensor = sensor
+        self.height = height
+        self.table = table
+        self.sensorId = sensorId
+        self.deadline = deadline
+        self.oversampler = oversampler
+        self.statistics = statistics
+        self.reader = sensorReader.SensorReader(sensor, sensorType) if sensor else None
+        self.sampleClass = measurementClass(statistics, sensorId is not None)
+        # Last temperature for the reduction of pressure if a measurement has no temperature
+        self.lastTemperature = None
+        # Read in progress
+        self.future = None
+
+        self.stats = {
+            "polls"   : 0,
+            "missed"  : 0,
+            "busy"    : 0,
+            "failures": 0
+        }
+
+    def measure(self, curTimestamp, curDate, curTime, duration):
+        """
+        Read the sensor and return the measurement sample
+
+        Input:
+        - curTimestamp, curDate, curTime: Time of the measurement
+        - duration                      : Time in s over which oversampled reads are spread
+        """
+        sample = self.sampleClass(curTimestamp, curDate, curTime)
+        if self.sensorId is not None:
+            sample.sensor = self.sensorId
+
+        # Get values from sensor with one read
+        # or aggregated from reads spread over the measurement interval
+        if self.oversampler:
+            reading, readingStats = self.oversampler.collect(self.reader, duration)
+            if self.statistics:
+                for col, value in readingStats.items():
+                    setattr(sample, col, value)
+        elif self.reader:
+            reading = self.reader.read()
+        if self.reader:
+            sample.temperature = reading.temperature
+            sample.humidity = reading.humidity
+            sample.pressure_m = reading.pressure
+            sample.altitude = reading.altitude
+        if sample.temperature is not None:
+            self.lastTemperature = sample.temperature
+        if sample.pressure_m is not None:
+            # Without any temperature, pressure is left empty rather than storing the unreduced value
+            if self.height is None or self.lastTemperature is not None:
+                sample.pressure = pressureReduced(sample.pressure_m, self.height, self.lastTemperature)
+
+        # Values are stored with the resolution of the sensors, as in the measurement file
+        for q in ROUND_QUANTITIES:
+            value = getattr(sample, q)
+            if value is not None:
+                setattr(sample, q, round(value, ROUND_DECIMALS))
+        return sample
+
+    def getStats(self):
+        """
+        Return sensor statistics
+
+        - polls   : Number of cycles in which the sensor was polled
+        - missed  : Number of measurements not available by the deadline
+        - busy    : Number of cycles skipped because a late read was still running
+        - failures: Number of failed measurements
+        Together with the statistics of the reader (see SensorReader.getStats),
+        of the oversampler (prefixed with "oversampling.") and of the sensor,
+        if it provides statistics (prefixed with "sensor.")
+        """
+        res = self.stats.copy()
+        if self.reader:
+            res.update(self.reader.getStats())
+        if self.oversampler:
+            for key, value in self.oversampler.getStats().items():
+                res["oversampling." + key] = value
+        if hasattr(self.sensor, "getStats"):
+            for key, value in self.sensor.getStats().items():
+                res["sensor." + key] = value
+        return res
+
+class SensorPoller:
+    """
+    Class polling all sensors of the station concurrently
+    """
+    def __init__(self, sensors):
+        """
+        Constructor for SensorPoller
+
+        Input:
+        - sensors: List of StationSensor
+        """
+        self.sensors = sensors
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(sensors), 1), thread_name_prefix="Sensor")
+
+    def poll(self, curTimestamp, curDate, curTime, duration=0):
+        """
+        Take the measurements of all sensors for one cycle
+
+        Input:
+        - curTimestamp, curDate, curTime: Time of the measurement
+        - duration                      : Time in s over which oversampled reads are spread
+
+        Returns a list with a tuple (sensor, sample, error) for each sensor,
+        where either sample or error is None.
+        """
+        t0 = time.monotonic()
+        busy = list()
+        for sensor in self.sensors:
+            if sensor.future and not sensor.future.done():
+                busy.append(sensor)
+                continue
+            sensor.stats["polls"] = sensor.stats["polls"] + 1
+            sensor.future = self.executor.submit(sensor.measure, curTimestamp, curDate, curTime, duration)
+
+        results = list()
+        for sensor in self.sensors:
+            if sensor in busy:
+                sensor.stats["busy"] = sensor.stats["busy"] + 1
+                results.append((sensor, None, DeadlineExceeded("Read of a previous cycle still running")))
+                continue
+            spread = duration if sensor.oversampler else 0
+            timeout = max(t0 + spread + sensor.deadline - time.monotonic(), 0)
+            try:
+                sample = sensor.future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                # The future is kept, so that the sensor is not polled again before the read has completed
+                sensor.stats["missed"] = sensor.stats["missed"] + 1
+                results.append((sensor, None, DeadlineExceeded("No measurement within deadline of {} s".format(sensor.deadline))))
+                continue
+            except Exception as e:
+                sensor.future = None
+                sensor.stats["failures"] = sensor.stats["failures"] + 1
+                results.append((sensor, None, e))
+                continue
+            sensor.future = None
+            results.append((sensor, sample, None))
+        return results
+
+    def getStats(self):
+        """
+        Return the statistics of all sensors (see StationSensor.getStats) by sensor name
+        """
+        return {sensor.name: sensor.getStats() for sensor in self.sensors}
+
+    def close(self):
+        """
+        Stop the thread pool without waiting for reads still running
+        """
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+"""
+Module for storage backends
+
+A storage backend provides connections to the database in which measurements,
+forecasts and alerts are stored, together with the operations for storing them:
+- insertMeasurements: Insert measurement rows (existing rows are replaced)
+- upsertForecast    : Insert or update forecast rows
+- upsertAlerts      : Insert or update alerts
+- cleanup           : Delete rows which are no longer valid
+
+Operations are executed on a cursor of a connection obtained from the backend,
+so that transactions remain under control of the caller. Each operation returns
+the statement used, so that rows can be spooled if the database is not available.
+
+Available backends:
+- MariaDbBackend: MariaDB server. Tables are created with data/createDBtable.sql
+- SqliteBackend : Local SQLite file in WAL mode. Tables are created by the backend
+
+The backend in use is set with setBackend.
+"""
+import sqlite3
+import threading
+import dbStatements
+from rollup import ROLLUP_MEASURES
+import stationSensors
+from records import MEASUREMENT_COLUMNS, OVERSAMPLING_COLUMNS, ALERT_COLUMNS, SENSOR_COLUMN
+
+try:
+    import mariadb
+except ImportError:
+    # Only required for MariaDbBackend
+    mariadb = None
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Defaults
+storageDefaults = {
+    "backend"    : "mariadb",
+    "file"       : None,
+    "busyTimeout": 30
+}
+
+BACKENDS = ["mariadb", "sqlite"]
+
+class StorageError(Exception):
+    """
+    Error raised for storage problems which are not reported by the database driver
+    """
+
+# Errors which are handled as database errors
+DB_ERRORS = (StorageError, sqlite3.Error)
+if mariadb:
+    DB_ERRORS = DB_ERRORS + (mariadb.Error,)
+
+# Errors indicating that the database is not reachable, rather than a problem with the data.
+# Only for these, statements are spooled for later replay.
+CONNECTION_ERRORS = (StorageError, sqlite3.OperationalError, sqlite3.InterfaceError)
+if mariadb:
+    CONNECTION_ERRORS = CONNECTION_ERRORS + (mariadb.OperationalError, mariadb.InterfaceError)
+
+class StorageBackend:
+    """
+    Base class for storage backends
+    """
+    # Name of the backend
+    name = None
+    # SQL dialect for dbStatements
+    dialect = None
+
+    def connect(self):
+        """
+        Open a new connection
+        """
+        raise NotImplementedError
+
+    def ping(self, con):
+        """
+        Check whether a connection is still usable
+
+        Raises a database error if not.
+        """
+        raise NotImplementedError
+
+    def cursor(self, con):
+        """
+        Return a cursor for a connection
+        """
+        return con.cursor()
+
+    def streamCursor(self, con):
+        """
+        Return a cursor for reading large results in chunks with fetchmany
+
+        Rows are transferred from the database as they are fetched, so that memory
+        does not grow with the size of the result. The connection cannot be used for
+        other statements until the result has been read completely.
+        """
+        return con.cursor()
+
+    def createSchema(self, con):
+        """
+        Create the tables required by the weatherstation, if they do not exist
+        """
+        pass
+
+    def insertMeasurements(self, cur, table, rows, columns=MEASUREMENT_COLUMNS):
+        """
+        Insert measurement rows
+
+        Rows may be sent again when the spool is replayed, so existing rows are overwritten.
+        For tables shared by several sensors, the key includes the sensor column.
+        """
+        keyCols = ["timestamp"]
+        if SENSOR_COLUMN in columns:
+            keyCols.append(SENSOR_COLUMN)
+        stmt = dbStatements.insertStmt(table, columns, updateCols=[col for col in columns if col not in keyCols], keyCols=keyCols)
+        cur.executemany(stmt, rows)
+        return stmt
+
+    def upsertForecast(self, cur, table, columns, rows, updateCols=(), keepCols=()):
+        """
+        Insert or update forecast rows
+
+        Input:
+        - cur       : Cursor
+        - table     : Forecast table
+        - columns   : Columns for which values are provided. The first one is the key
+        - rows      : Rows with values in column order
+        - updateCols: Columns updated with the new value for existing rows
+        - keepCols  : Columns updated with the new value for existing rows, unless it is NULL
+        """
+        stmt = dbStatements.insertStmt(table, columns, updateCols=updateCols, keepCols=keepCols)
+        cur.executemany(stmt, rows)
+        return stmt
+
+    def upsertAlerts(self, cur, table, rows):
+        """
+        Insert alerts or update their description
+        """
+        stmt = dbStatements.insertStmt(table, ALERT_COLUMNS, updateCols=ALERT_COLUMNS[4:], keyCols=ALERT_COLUMNS[:4])
+        cur.executemany(stmt, rows)
+        return stmt
+
+    def cleanup(self, cur, table, column, op, keys):
+        """
+        Delete rows where the given column compares with the given keys
+
+        Input:
+        - cur   : Cursor
+        - table : Table
+        - column: Column to be compared
+        - op    : Comparison operator (e.g. "=", ">=")
+        - keys  : Values to be compared with
+        """
+        stmt = dbStatements.deleteStmt(table, column, op)
+        cur.executemany(stmt, [(key,) for key in keys])
+        return stmt
+
+class MariaDbBackend(StorageBackend):
+    """
+    Storage backend for a MariaDB server
+    """
+    name = "mariadb"
+    dialect = "mariadb"
+
+    def __init__(self, host=None, port=None, database=None, user=None, password=None, utc=False):
+        """
+        Constructor for MariaDbBackend
+
+        Input:
+        - host    : Database host
+        - port    : Database port
+        - database: Database name
+        - user    : User
+        - password: Password
+        - utc     : If True, the session time zone is set to UTC
+        """
+        self.host = host
+        self.port = port
+        self.database = database
+        self.user = user
+        self.password = password
+        self.utc = utc
+
+    def connect(self):
+        if mariadb is None:
+            raise StorageError("MariaDB connector is not installed")
+        con = mariadb.connect(
+            user=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+            database=self.database
+        )
+        if self.utc:
+            # Timestamps are written in UTC
+            cur = con.cursor()
+            cur.execute("SET time_zone = '+00:00'")
+            cur.close()
+        logger.debug("Database connection successful")
+        return con
+
+    def ping(self, con):
+        con.ping()
+
+    def cursor(self, con):
+        return con.cursor(prepared=True)
+
+    def streamCursor(self, con):
+        # Unbuffered: the result is not stored on the client
+        return con.cursor(buffered=False)
+
+def measurementSchema(columns):
+    """
+    Return the statement creating a measurement table with the given columns in SQLite
+
+    For tables shared by several sensors, the primary key includes the sensor column.
+    """
+    defs = ["timestamp TEXT NOT NULL", "date TEXT NOT NULL", "time TEXT NOT NULL"]
+    for col in columns[3:]:
+        if col == SENSOR_COLUMN:
+            defs.append(col + " TEXT NOT NULL")
+        elif col == "samples":
+            defs.append(col + " INTEGER")
+        else:
+            defs.append(col + " REAL")
+    key = "timestamp, " + SENSOR_COLUMN if SENSOR_COLUMN in columns else "timestamp"
+    return "CREATE TABLE IF NOT EXISTS {table} (" + ", ".join(defs) + ", PRIMARY KEY (" + key + "))"
+
+def measurementKind(columns):
+    """
+    Return the kind of table in SQLITE_SCHEMA for a measurement table with the given columns
+    """
+    kind = "oversampledMeasurement" if "samples" in columns else "measurement"
+    if SENSOR_COLUMN in columns:
+        kind = "oversampledSensorMeasurement" if "samples" in columns else "sensorMeasurement"
+    return kind
+
+# Tables created by SqliteBackend
+SQLITE_SCHEMA = {
+    "measurement"                 : measurementSchema(MEASUREMENT_COLUMNS),
+    "oversampledMeasurement"      : measurementSchema(MEASUREMENT_COLUMNS + OVERSAMPLING_COLUMNS),
+    "sensorMeasurement"           : measurementSchema(MEASUREMENT_COLUMNS + [SENSOR_COLUMN]),
+    "oversampledSensorMeasurement": measurementSchema(MEASUREMENT_COLUMNS + OVERSAMPLING_COLUMNS + [SENSOR_COLUMN]),
+    "hourlyForecast":
+        "CREATE TABLE IF NOT EXISTS {table} ("
+        " timestamp TEXT NOT NULL PRIMARY KEY,"
+        " temperature REAL, temperature_hist REAL, humidity REAL, humidity_hist REAL, pressure REAL, pressure_hist REAL,"
+        " clouds REAL, uvi REAL, visibility REAL, windspeed REAL, winddir REAL, rain REAL, snow REAL,"
+        " description TEXT, icon TEXT, alerts INTEGER DEFAULT 0, time_cre TEXT, time_mod TEXT)",
+    "dailyForecast":
+        "CREATE TABLE IF NOT EXISTS {table} ("
+        " date TEXT NOT NULL PRIMARY KEY, sunrise TEXT, sunset TEXT,"
+        " temperature_m REAL, temperature_d REAL, temperature_e REAL, temperature_n REAL,"
+        " temperature_min REAL, temperature_max REAL, pressure REAL, humidity REAL, windspeed REAL, winddir REAL,"
+        " clouds REAL, uvi REAL, pop REAL, rain REAL, snow REAL,"
+        " description TEXT, icon TEXT, alerts INTEGER NOT NULL DEFAULT 0)",
+    "alertsForecast":
+        "CREATE TABLE IF NOT EXISTS {table} ("
+        " start TEXT NOT NULL, end TEXT NOT NULL, event TEXT NOT NULL, sender_name TEXT NOT NULL, description TEXT,"
+        " PRIMARY KEY (start, end, event, sender_name))",
+    "hourlyRollup":
+        "CREATE TABLE IF NOT EXISTS {table} (timestamp TEXT NOT NULL PRIMARY KEY, "
+        + ", ".join(m + "_min REAL, " + m + "_max REAL, " + m + "_avg REAL, " + m + "_count INTEGER NOT NULL DEFAULT 0" for m in ROLLUP_MEASURES) + ")",
+    "dailyRollup":
+        "CREATE TABLE IF NOT EXISTS {table} (date TEXT NOT NULL PRIMARY KEY, "
+        + ", ".join(m + "_min REAL, " + m + "_max REAL, " + m + "_avg REAL, " + m + "_count INTEGER NOT NULL DEFAULT 0" for m in ROLLUP_MEASURES) + ")"
+}
+
+class SqliteBackend(StorageBackend):
+    """
+    Storage backend for a local SQLite file
+
+    The file is used in WAL mode, so that readers (e.g. a dashboard) do not block the station.
+    Tables are created when the first connection is opened.
+    """
+    name = "sqlite"
+    dialect = "sqlite"
+
+    def __init__(self, file, tables=None, busyTimeout=30):
+        """
+        Constructor for SqliteBackend
+
+        Input:
+        - file       : Path to the SQLite database file
+        - tables     : Table names for each kind of table (keys of SQLITE_SCHEMA)
+        - busyTimeout: Maximum time in s to wait for a lock held by another connection
+        """
+        self.file = file
+        self.tables = tables if tables else {}
+        self.busyTimeout = busyTimeout
+        self.lock = threading.Lock()
+        self.schemaCreated = False
+
+    def connect(self):
+        con = sqlite3.connect(self.file, timeout=self.busyTimeout, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, NORMAL does not risk corruption; only the last commits may be lost on power loss
+        con.execute("PRAGMA synchronous=NORMAL")
+        with self.lock:
+            if not self.schemaCreated:
+                self.createSchema(con)
+                self.schemaCreated = True
+        logger.debug("Database connection successful: %s", self.file)
+        return con
+
+    def ping(self, con):
+        con.execute("SELECT 1")
+
+    def createSchema(self, con):
+        for kind, tables in self.tables.items():
+            for table in tables:
+                con.execute(SQLITE_SCHEMA[kind].format(table=table))
+                logger.debug("Table %s available", table)
+        con.commit()
+
+# Backend in use
+backend = MariaDbBackend()
+
+def setBackend(newBackend):
+    """
+    Set the backend in use
+    """
+    global backend
+    backend = newBackend
+    dbStatements.setDialect(newBackend.dialect)
+    logger.info("Storage backend: %s", newBackend.name)
+
+def fromConfig(cfg):
+    """
+    Create the backend from the weatherstation configuration
+
+    Input:
+    - cfg: Configuration dictionary for weatherstation
+    """
+    par = storageDefaults.copy()
+    if cfg.get("storage"):
+        par.update(cfg["storage"])
+
+    if par["backend"] == "sqlite":
+        tables = {kind: [] for kind in SQLITE_SCHEMA}
+        if cfg["includeMeasurement"]:
+            for table, columns in stationSensors.measurementTables(cfg).items():
+                tables[measurementKind(columns)].append(table)
+            if cfg.get("rollup"):
+                if cfg["rollup"].get("hourlyTable"):
+                    tables["hourlyRollup"].append(cfg["rollup"]["hourlyTable"])
+                if cfg["rollup"].get("dailyTable"):
+                    tables["dailyRollup"].append(cfg["rollup"]["dailyTable"])
+        if cfg["includeForecast"] and cfg["forecast"]["forecastDbOut"]:
+            for location in cfg["forecast"]["locations"]:
+                fcTables = location["forecastTables"] if location["forecastTables"] else cfg["forecast"]["forecastTables"]
+                for kind in ["hourlyForecast", "dailyForecast", "alertsForecast"]:
+                    if fcTables[kind] not in tables[kind]:
+                        tables[kind].append(fcTables[kind])
+        return SqliteBackend(par["file"], tables, par["busyTimeout"])
+
+    return MariaDbBackend(
+        host=cfg["dbConnection"]["host"],
+        port=cfg["dbConnection"]["port"],
+        database=cfg["dbConnection"]["database"],
+        user=cfg["dbConnection"]["user"],
+        password=cfg["dbConnection"]["password"],
+        utc=cfg["utc"]
+    )
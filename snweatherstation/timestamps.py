@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+"""
+Module for converting timestamps
+
+Epoch times are converted to the string representation used for storage
+("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%H:%M:%S") in local time or, optionally, in UTC.
+
+The UTC offset is determined once for each quarter of an hour and the date string once for each day.
+The remaining conversion is integer arithmetic, so that converting the timestamps of a
+forecast does not require a strftime call per row. Since the offset is determined for
+the given time, daylight saving time transitions are handled correctly.
+
+For comparisons, timestamp strings can be converted to integer seconds of wall-clock time
+(seconds since 1970-01-01 00:00:00 in the time zone of the timestamp).
+"""
+import time
+import datetime
+
+# If True, timestamps are represented in UTC
+utc = False
+
+# Cache of UTC offsets in seconds for each quarter of an hour
+# (time zone transitions occur at quarter hours)
+_offsets = {}
+# Cache of date strings for each day number (days since 1970-01-01)
+_dates = {}
+# Cache of day numbers for each date string
+_days = {}
+# Maximum number of cache entries
+_CACHE_MAX = 10000
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def setUtc(flag):
+    """
+    Set whether timestamps are represented in UTC (True) or local time (False)
+    """
+    global utc
+    utc = flag
+    _offsets.clear()
+
+def offset(epoch):
+    """
+    Return the UTC offset in seconds of the represented time zone at the given epoch time
+    """
+    if utc:
+        return 0
+    slot = epoch // 900
+    res = _offsets.get(slot)
+    if res is None:
+        if len(_offsets) >= _CACHE_MAX:
+            _offsets.clear()
+        res = time.localtime(slot * 900).tm_gmtoff
+        _offsets[slot] = res
+    return res
+
+def dateOfDay(day):
+    """
+    Return the date string for a day number (days since 1970-01-01)
+    """
+    res = _dates.get(day)
+    if res is None:
+        if len(_dates) >= _CACHE_MAX:
+            _dates.clear()
+        res = datetime.date.fromordinal(day + _EPOCH_ORDINAL).isoformat()
+        _dates[day] = res
+    return res
+
+def split(epoch):
+    """
+    Return timestamp, date and time strings for an epoch time
+    """
+    epoch = int(epoch)
+    secs = epoch + offset(epoch)
+    day, sod = divmod(secs, 86400)
+    d = dateOfDay(day)
+    t = "{:02d}:{:02d}:{:02d}".format(sod // 3600, sod // 60 % 60, sod % 60)
+    return d + " " + t, d, t
+
+def timestamp(epoch):
+    """
+    Return the timestamp string ("%Y-%m-%d %H:%M:%S") for an epoch time
+    """
+    return split(epoch)[0]
+
+def date(epoch):
+    """
+    Return the date string ("%Y-%m-%d") for an epoch time
+    """
+    epoch = int(epoch)
+    return dateOfDay((epoch + offset(epoch)) // 86400)
+
+def timeOfDay(epoch):
+    """
+    Return the time string ("%H:%M:%S") for an epoch time
+    """
+    return split(epoch)[2]
+
+def now():
+    """
+    Return timestamp, date and time strings for the current time
+    """
+    return split(time.time())
+
+def seconds(ts):
+    """
+    Return the wall-clock seconds for a timestamp string ("%Y-%m-%d %H:%M:%S")
+    or a date string ("%Y-%m-%d")
+    """
+    d = ts[:10]
+    day = _days.get(d)
+    if day is None:
+        if len(_days) >= _CACHE_MAX:
+            _days.clear()
+        day = datetime.date(int(d[0:4]), int(d[5:7]), int(d[8:10])).toordinal() - _EPOCH_ORDINAL
+        _days[d] = day
+    res = day * 86400
+    if len(ts) > 10:
+        res = res + int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])
+    return res
+
+def fromSeconds(secs):
+    """
+    Return the timestamp string for wall-clock seconds
+    """
+    day, sod = divmod(secs, 86400)
+    return dateOfDay(day) + " " + "{:02d}:{:02d}:{:02d}".format(sod // 3600, sod // 60 % 60, sod % 60)
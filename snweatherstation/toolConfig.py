@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+"""
+Module with common support for the command line tools of weatherstation
+
+The tools (maintenance, backfill, export, import) use the configuration file
+of weatherstation, which is searched in the same locations:
+./tests/data, $HOME/.config and /etc.
+Only the sections required for database access are evaluated.
+"""
+import os
+import json
+import argparse
+import storage
+import timestamps
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Constants
+CFGFILENAME = "weatherstation.json"
+
+def findConfig(cfgFile=None):
+    """
+    Return the path of the configuration file
+
+    Raises ValueError if no configuration file is found.
+    """
+    if cfgFile:
+        if not os.path.exists(cfgFile):
+            raise ValueError("Configuration file from command line does not exist: ", cfgFile)
+        return cfgFile
+
+    curDir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    candidates = [
+        curDir + "/tests/data/" + CFGFILENAME,
+        os.environ.get("HOME", "") + "/.config/" + CFGFILENAME,
+        "/etc/" + CFGFILENAME
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+        logger.info("Config file not found: %s", candidate)
+    raise ValueError("No configuration file available")
+
+def loadConfig(cfgFile=None):
+    """
+    Load the configuration file and complete the sections required for database access
+
+    Returns the configuration dictionary.
+    """
+    cfgFile = findConfig(cfgFile)
+    logger.info("Using cfgFile: %s", cfgFile)
+    with open(cfgFile, "r") as f:
+        conf = json.load(f)
+
+    conf.setdefault("utc", False)
+    conf.setdefault("includeMeasurement", True)
+    conf.setdefault("includeForecast", False)
+    conf.setdefault("height", None)
+    conf.setdefault("sensors", [])
+    conf.setdefault("rollup", None)
+    conf.setdefault("dbConnection", {})
+    for key in ["host", "port", "database", "table", "user", "password"]:
+        conf["dbConnection"].setdefault(key, None)
+    conf.setdefault("storage", {})
+    for key, value in storage.storageDefaults.items():
+        conf["storage"].setdefault(key, value)
+    conf.setdefault("forecast", {})
+    conf["forecast"].setdefault("forecastDbOut", False)
+    conf["forecast"].setdefault("forecastTables", None)
+    conf["forecast"].setdefault("forecastRetain", 4)
+    conf["forecast"].setdefault("mapping", "rows")
+    conf["forecast"].setdefault("source", {})
+    conf["forecast"]["source"].setdefault("payload", {})
+    conf["forecast"].setdefault("locations", [])
+    for location in conf["forecast"]["locations"]:
+        location.setdefault("name", "{},{}".format(location.get("lat"), location.get("lon")))
+        location.setdefault("payload", None)
+        location.setdefault("forecastTables", None)
+    if conf["includeForecast"] and len(conf["forecast"]["locations"]) == 0:
+        # Single forecast location from forecast source (as in weatherstation)
+        payload = conf["forecast"]["source"]["payload"]
+        conf["forecast"]["locations"].append({
+            "name"          : "{},{}".format(payload.get("lat"), payload.get("lon")),
+            "payload"       : payload,
+            "forecastTables": conf["forecast"]["forecastTables"]
+        })
+    timestamps.setUtc(conf["utc"])
+    return conf
+
+def forecastTables(conf):
+    """
+    Return the forecast tables of all forecast locations
+
+    Returns a list of dictionaries with hourlyForecast, dailyForecast and alertsForecast
+    """
+    res = list()
+    if conf["forecast"]["forecastTables"]:
+        res.append(conf["forecast"]["forecastTables"])
+    for location in conf["forecast"]["locations"]:
+        if location["forecastTables"] and location["forecastTables"] not in res:
+            res.append(location["forecastTables"])
+    return res
+
+def backendFromConfig(conf):
+    """
+    Create and activate the storage backend for a configuration loaded with loadConfig
+    """
+    backend = storage.fromConfig(conf)
+    storage.setBackend(backend)
+    return backend
+
+def argumentParser(description):
+    """
+    Return an argument parser with the options common to all tools
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-c", "--config", help="Path to config file to be used")
+    parser.add_argument("-v", "--verbose", action = "store_true", help="Verbose - log INFO level")
+    parser.add_argument("-l", "--log", action = "store_true", help="Log DEBUG level")
+    return parser
+
+def setupLogging(args):
+    """
+    Set up logging to stderr according to the common options
+    """
+    level = logging.WARNING
+    if args.verbose:
+        level = logging.INFO
+    if args.log:
+        level = logging.DEBUG
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)-20s %(levelname)-8s %(message)s'))
+    rLogger = logging_plus.getLogger()
+    rLogger.addHandler(handler)
+    rLogger.setLevel(level)
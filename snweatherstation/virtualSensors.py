@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+"""
+Module with sensors which do not require Raspberry Pi hardware
+
+With these sensors, the complete weatherstation (sensor polling, oversampling,
+database writer, spool, rollup, maintenance) can be run, load-tested and
+benchmarked on any Linux server.
+
+Sensor types:
+- SIMULATED: Synthetic values following a diurnal (cosine) curve with a maximum
+             at peakHour, with gaussian noise. Read failures (RuntimeError, as for
+             DHT sensors) and read latency can be injected.
+- REPLAY   : Measurements played back from a recorded measurement file (fileName
+             of weatherstation) or from a CSV or NDJSON file written by export.py.
+             Each read returns the next measurement of the file. At the end of
+             the file, replay starts again from the beginning (loop) or reads fail.
+
+Both sensors provide a method snapshot() returning a SensorReading, which is used by SensorReader.
+"""
+import os
+import csv
+import json
+import math
+import time
+import random
+import timestamps
+from records import SensorReading, MEASUREMENT_COLUMNS, parseMeasurement
+from sensorReader import altitude
+
+# Set up logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Sensor types
+type_SIMULATED = "SIMULATED"
+type_REPLAY = "REPLAY"
+SENSOR_TYPES = [type_SIMULATED, type_REPLAY]
+
+# Defaults for simulated sensors
+simulationDefaults = {
+    "temperature"         : 15.0,
+    "temperatureAmplitude": 5.0,
+    "temperatureNoise"    : 0.1,
+    "humidity"            : 70.0,
+    "humidityAmplitude"   : -15.0,
+    "humidityNoise"       : 0.5,
+    "pressure"            : 1013.25,
+    "pressureAmplitude"   : 1.0,
+    "pressureNoise"       : 0.05,
+    "peakHour"            : 15.0,
+    "failureRate"         : 0.0,
+    "latency"             : 0.0,
+    "latencyJitter"       : 0.0,
+    "seed"                : None
+}
+
+# Defaults for replay sensors
+replayDefaults = {
+    "file"  : None,
+    "format": None,
+    "loop"  : True
+}
+
+REPLAY_FORMATS = ["text", "csv", "ndjson"]
+
+class SimulatedSensor:
+    """
+    Class representing a sensor with synthetic values
+    """
+    def __init__(self, temperature=15.0, temperatureAmplitude=5.0, temperatureNoise=0.1,
+                 humidity=70.0, humidityAmplitude=-15.0, humidityNoise=0.5,
+                 pressure=1013.25, pressureAmplitude=1.0, pressureNoise=0.05,
+                 peakHour=15.0, failureRate=0.0, latency=0.0, latencyJitter=0.0, seed=None):
+        """
+        Constructor for SimulatedSensor
+
+        Input:
+        - temperature, humidity, pressure: Daily mean of the quantity (None: quantity not provided, e.g. pressure for a DHT)
+        - ...Amplitude                   : Difference between the value at peakHour and the daily mean
+        - ...Noise                       : Standard deviation of the gaussian noise
+        - peakHour                       : Hour of the day (local time or UTC) with the maximum of the curve
+        - failureRate                    : Probability of a failed read (0 .. 1)
+        - latency                        : Mean time in s for a read
+        - latencyJitter                  : Standard deviation of the time for a read
+        - seed                           : Seed of the random generator (None: random)
+        """
+        self.curves = {
+            "temperature": (temperature, temperatureAmplitude, temperatureNoise),
+            "humidity"   : (humidity, humidityAmplitude, humidityNoise),
+            "pressure"   : (pressure, pressureAmplitude, pressureNoise)
+        }
+        self.peakHour = peakHour
+        self.failureRate = failureRate
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        self.random = random.Random(seed)
+
+    @classmethod
+    def fromConfig(cls, simulationCfg):
+        """
+        Create a simulated sensor from the simulation section of the sensor configuration
+        """
+        par = simulationDefaults.copy()
+        if simulationCfg:
+            par.update(simulationCfg)
+        return cls(**par)
+
+    def hourOfDay(self):
+        """
+        Return the current hour of the day as float (local time or UTC as for timestamps)
+        """
+        t = time.gmtime() if timestamps.utc else time.localtime()
+        return t.tm_hour + t.tm_min / 60 + t.tm_sec / 3600
+
+    def value(self, quantity, hour):
+        """
+        Return the value of a quantity for the given hour of the day
+        """
+        mean, amplitude, noise = self.curves[quantity]
+        if mean is None:
+            return None
+        value = mean + amplitude * math.cos(2 * math.pi * (hour - self.peakHour) / 24)
+        if noise:
+            value = value + self.random.gauss(0.0, noise)
+        return value
+
+    def snapshot(self):
+        """
+        Return a SensorReading with synthetic values
+
+        Raises RuntimeError for an injected read failure.
+        """
+        if self.latency or self.latencyJitter:
+            time.sleep(max(self.random.gauss(self.latency, self.latencyJitter), 0.0))
+        if self.failureRate and self.random.random() < self.failureRate:
+            raise RuntimeError("Simulated read failure")
+        hour = self.hourOfDay()
+        reading = SensorReading()
+        reading.temperature = self.value("temperature", hour)
+        reading.humidity = self.value("humidity", hour)
+        if reading.humidity is not None:
+            reading.humidity = min(max(reading.humidity, 0.0), 100.0)
+        reading.pressure = self.value("pressure", hour)
+        reading.altitude = altitude(reading.pressure)
+        return reading
+
+class ReplaySensor:
+    """
+    Class representing a sensor playing back recorded measurements
+    """
+    def __init__(self, file, fmt=None, loop=True):
+        """
+        Constructor for ReplaySensor
+
+        Input:
+        - file: Recorded measurements
+        - fmt : Format of the file (see REPLAY_FORMATS). Default: from the file extension
+                (.csv: csv, .ndjson/.json: ndjson, otherwise text as written by weatherstation)
+        - loop: If True, replay starts again at the end of the file. Otherwise, reads fail
+        """
+        if not fmt:
+            ext = os.path.splitext(file)[1].lower()
+            fmt = "text"
+            if ext == ".csv":
+                fmt = "csv"
+            elif ext in [".ndjson", ".json"]:
+                fmt = "ndjson"
+        if fmt not in REPLAY_FORMATS:
+            raise ValueError("Invalid replay format. Allowed values are: " + ", ".join(REPLAY_FORMATS))
+        self.file = file
+        self.fmt = fmt
+        self.loop = loop
+        self.f = open(file, "r", newline="")
+        self.rows = self.reader()
+
+        self.stats = {
+            "replayed": 0,
+            "skipped" : 0,
+            "loops"   : 0
+        }
+
+    @classmethod
+    def fromConfig(cls, replayCfg):
+        """
+        Create a replay sensor from the replay section of the sensor configuration
+        """
+        par = replayDefaults.copy()
+        if replayCfg:
+            par.update(replayCfg)
+        if not par["file"]:
+            raise ValueError("Configuration file requires replay.file for sensor type " + type_REPLAY)
+        return cls(par["file"], par["format"], par["loop"])
+
+    def reader(self):
+        """
+        Return an iterator over the records of the file (dictionaries for csv, lines otherwise)
+        """
+        if self.fmt == "csv":
+            return csv.DictReader(self.f)
+        return iter(self.f)
+
+    def toReading(self, record):
+        """
+        Return a SensorReading for a record of the file
+
+        Raises ValueError if the record is invalid.
+        """
+        if self.fmt == "text":
+            record = dict(zip(MEASUREMENT_COLUMNS, parseMeasurement(record)))
+        elif self.fmt == "ndjson":
+            record = json.loads(record)
+        reading = SensorReading()
+        for quantity, col in [("temperature", "temperature"), ("humidity", "humidity"), ("pressure", "pressure_m"), ("altitude", "altitude")]:
+            value = record.get(col)
+            if value is not None and value != "":
+                setattr(reading, quantity, float(value))
+        if reading.altitude is None:
+            reading.altitude = altitude(reading.pressure)
+        return reading
+
+    def snapshot(self):
+        """
+        Return a SensorReading with the next valid measurement of the file
+
+        Raises RuntimeError at the end of the file without loop
+        or if the file contains no valid measurement.
+        """
+        restarted = False
+        while True:
+            try:
+                record = next(self.rows)
+            except StopIteration:
+                if not self.loop:
+                    raise RuntimeError("End of replay file reached: " + self.file)
+                if restarted:
+                    raise RuntimeError("No valid measurements in replay file: " + self.file)
+                self.f.seek(0)
+                self.rows = self.reader()
+                self.stats["loops"] = self.stats["loops"] + 1
+                restarted = True
+                continue
+            if self.fmt != "csv" and not record.strip():
+                continue
+            try:
+                reading = self.toReading(record)
+            except (ValueError, AttributeError) as e:
+                self.stats["skipped"] = self.stats["skipped"] + 1
+                logger.debug("Replay record skipped: %s", e)
+                continue
+            self.stats["replayed"] = self.stats["replayed"] + 1
+            return reading
+
+    def getStats(self):
+        """
+        Return replay statistics
+
+        - replayed: Number of measurements replayed
+        - skipped : Number of invalid records skipped
+        - loops   : Number of restarts at the beginning of the file
+        """
+        return self.stats.copy()
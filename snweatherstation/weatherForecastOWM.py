@@ -3,8 +3,16 @@
 Module for querying weather forecast data from OpenWeatherMap and storage in database
 """
 import json
-import requests
+import math
 import datetime
+import bisect
+import forecastClient
+import dbStatements
+import storage
+import spool
+import timestamps
+from records import HourlyRow, DailyRow, Alert, HOURLY_COLUMNS, HOURLY_HIST_COLUMNS, DAILY_COLUMNS
+from forecastColumns import ColumnTable, ForecastColumns, TYPE_FLOAT, TYPE_INT, TYPE_TEXT
 
 # Set up logging
 import logging
@@ -12,119 +20,86 @@ import logging_plus
 logger = logging_plus.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
-# Defaults
-# Current / hourly forecast
-cfc = {
-    "timestamp"   : None,
-    "temperature" : None,
-    "humidity"    : None,
-    "pressure"    : None,
-    "clouds"      : None,
-    "uvi"         : None,
-    "visibility"  : None,
-    "windspeed"   : None,
-    "winddir"     : None,
-    "rain"        : None,
-    "snow"        : None,
-    "description" : None,
-    "icon"        : None,
-    "alerts"      : 0
-}
-# Daily forecast
-dfc = {
-    "date": None,
-    "sunrise": None,
-    "sunset": None,
-    "temperature_m": None,
-    "temperature_d": None,
-    "temperature_e": None,
-    "temperature_n": None,
-    "temperature_min": None,
-    "temperature_max": None,
-    "humidity" : None,
-    "pressure" : None,
-    "windspeed" : None,
-    "winddir" : None,
-    "clouds" : None,
-    "uvi" : None,
-    "pop": None,
-    "rain" : None,
-    "snow" : None,
-    "description" : None,
-    "icon" : None,
-    "alerts"      : 0
-}
-
-def getForecast(url, payload):
+HOURLY_HIST_INDEX = [HOURLY_COLUMNS.index(col) for col in HOURLY_HIST_COLUMNS]
+
+# Columns of statement parameters for forecast rows
+HOURLY_ROW_COLUMNS = ["timestamp"] + HOURLY_COLUMNS + ["time_cre", "time_mod"]
+HOURLY_HIST_ROW_COLUMNS = HOURLY_ROW_COLUMNS + [col + "_hist" for col in HOURLY_HIST_COLUMNS]
+DAILY_ROW_COLUMNS = ["date"] + DAILY_COLUMNS
+
+# Column types for columnar mapping
+HOURLY_TYPES = [TYPE_FLOAT] * 10 + [TYPE_TEXT, TYPE_TEXT, TYPE_INT]
+DAILY_TYPES = [TYPE_TEXT, TYPE_TEXT] + [TYPE_FLOAT] * 15 + [TYPE_TEXT, TYPE_TEXT, TYPE_INT]
+
+def getForecast(url, payload, client=None):
     """
     Get weather forecast data from openweb service
-    """
-    fcr = requests.get(url, params=payload)
-    if fcr.status_code != requests.codes.ok:
-        fcr.raise_for_status()
 
-    try:
-        fcrj = fcr.json()
-    except  Exception as e:
-        logger.error("Error parsing response: %s", e)
-        fcrj = None
-        logger.error("Request URL    : %s", url)
-        logger.error("Request payload: %s", payload)
-        logger.error("Response       : %s", fcr.text)
+    Input:
+    - url    : URL of the forecast service
+    - payload: Service call parameters
+    - client : ForecastClient to be used (default client if None)
+    """
+    if client is None:
+        client = forecastClient.getDefaultClient()
 
-    return fcrj
+    return client.getJson(url, payload)
 
 def mapForecast(fc, ts):
     """
     Map forecast data to standard structure
+
+    Returns a list with the current forecast (HourlyRow),
+    the list of hourly forecast rows (HourlyRow) and the list of daily forecast rows (DailyRow)
     """
-    global cfc
+    # Index of alert periods for counting alerts per entry
+    alerts = AlertIndex(fc)
 
     # Map current forecast
-    curfc = cfc.copy()
-    curfc["timestamp"] = ts
-    curfc["temperature"] = fc["current"]["temp"]
-    curfc["humidity"] = fc["current"]["humidity"]
-    curfc["pressure"] = fc["current"]["pressure"]
-    curfc["clouds"] = fc["current"]["clouds"]
-    curfc["uvi"] = fc["current"]["uvi"]
-    curfc["visibility"] = fc["current"]["visibility"]
-    curfc["windspeed"] = fc["current"]["wind_speed"]
-    curfc["winddir"] = fc["current"]["wind_deg"]
+    curfc = HourlyRow()
+    curfc.timestamp = ts
+    curfc.temperature = fc["current"]["temp"]
+    curfc.humidity = fc["current"]["humidity"]
+    curfc.pressure = fc["current"]["pressure"]
+    curfc.clouds = fc["current"]["clouds"]
+    curfc.uvi = fc["current"]["uvi"]
+    curfc.visibility = fc["current"]["visibility"]
+    curfc.windspeed = fc["current"]["wind_speed"]
+    curfc.winddir = fc["current"]["wind_deg"]
     if "rain" in fc["current"]:
-        curfc["rain"] = fc["current"]["rain"]["1h"]
+        curfc.rain = fc["current"]["rain"]["1h"]
     if "snow" in fc["current"]:
-        curfc["snow"] = fc["current"]["snow"]["1h"]
+        curfc.snow = fc["current"]["snow"]["1h"]
     if len(fc["current"]["weather"]) > 0:
         w = fc["current"]["weather"][0]
-        curfc["description"] = w["description"]
-        curfc["icon"] = w["icon"]
-    curfc["alerts"] = getAlerts(fc, fc["current"]["dt"])
+        curfc.description = w["description"]
+        curfc.icon = w["icon"]
+    curfc.alerts = alerts.count(fc["current"]["dt"])
 
     # Map hourly forecast
     hourlyfc = list()
     if len(fc["hourly"]) > 0:
         for i in range(0, len(fc["hourly"])):
-            hourfc = cfc.copy()
+            hourfc = HourlyRow()
             hfc = fc["hourly"][i]
-            hourfc["timestamp"] = datetime.datetime.fromtimestamp(hfc["dt"]).strftime("%Y-%m-%d %H:%M:%S")
-            hourfc["temperature"] = hfc["temp"]
-            hourfc["humidity"] = hfc["humidity"]
-            hourfc["pressure"] = hfc["pressure"]
-            hourfc["clouds"] = hfc["clouds"]
-            hourfc["uvi"] = hfc["uvi"]
-            hourfc["visibility"] = hfc["visibility"]
-            hourfc["windspeed"] = hfc["wind_speed"]
-            hourfc["winddir"] = hfc["wind_deg"]
+            hourfc.timestamp = timestamps.timestamp(hfc["dt"])
+            hourfc.temperature = hfc["temp"]
+            hourfc.humidity = hfc["humidity"]
+            hourfc.pressure = hfc["pressure"]
+            hourfc.clouds = hfc["clouds"]
+            hourfc.uvi = hfc["uvi"]
+            hourfc.visibility = hfc["visibility"]
+            hourfc.windspeed = hfc["wind_speed"]
+            hourfc.winddir = hfc["wind_deg"]
             if "rain" in hfc:
-                hourfc["rain"] = hfc["rain"]["1h"]
+                hourfc.rain = hfc["rain"]["1h"]
             if "snow" in hfc:
-                hourfc["snow"] = hfc["snow"]["1h"]
+                hourfc.snow = hfc["snow"]["1h"]
             if len(hfc["weather"]) > 0:
                 w = hfc["weather"][0]
-                hourfc["description"] = w["description"]
-                hourfc["icon"] = w["icon"]
-                hourfc["alerts"] = getAlerts(fc, hfc["dt"])
+                hourfc.description = w["description"]
+                hourfc.icon = w["icon"]
+                hourfc.alerts = alerts.count(hfc["dt"])
 
             hourlyfc.append(hourfc)
     
@@ -132,42 +107,177 @@ def mapForecast(fc, ts):
     dailyfc = list()
     if len(fc["daily"]) > 0:
         for i in range(0, len(fc["daily"])):
-            dayfc = dfc.copy()
+            dayfc = DailyRow()
             dyfc = fc["daily"][i]
-            dayfc["date"] = datetime.datetime.fromtimestamp(dyfc["dt"]).strftime("%Y-%m-%d")
-            dayfc["sunrise"] = datetime.datetime.fromtimestamp(dyfc["sunrise"]).strftime("%H:%M:%S")
-            dayfc["sunset"] = datetime.datetime.fromtimestamp(dyfc["sunset"]).strftime("%H:%M:%S")
+            dayfc.date = timestamps.date(dyfc["dt"])
+            dayfc.sunrise = timestamps.timeOfDay(dyfc["sunrise"])
+            dayfc.sunset = timestamps.timeOfDay(dyfc["sunset"])
             dyfct = dyfc["temp"]
-            dayfc["temperature_m"] = dyfct["morn"]
-            dayfc["temperature_d"] = dyfct["day"]
-            dayfc["temperature_e"] = dyfct["eve"]
-            dayfc["temperature_n"] = dyfct["night"]
-            dayfc["temperature_min"] = dyfct["min"]
-            dayfc["temperature_max"] = dyfct["max"]
-            dayfc["humidity"] = dyfc["humidity"]
-            dayfc["pressure"] = dyfc["pressure"]
-            dayfc["windspeed"] = dyfc["wind_speed"]
-            dayfc["winddir"] = dyfc["wind_deg"]
-            dayfc["clouds"] = dyfc["clouds"]
-            dayfc["uvi"] = dyfc["uvi"]
-            dayfc["pop"] = dyfc["pop"]
+            dayfc.temperature_m = dyfct["morn"]
+            dayfc.temperature_d = dyfct["day"]
+            dayfc.temperature_e = dyfct["eve"]
+            dayfc.temperature_n = dyfct["night"]
+            dayfc.temperature_min = dyfct["min"]
+            dayfc.temperature_max = dyfct["max"]
+            dayfc.humidity = dyfc["humidity"]
+            dayfc.pressure = dyfc["pressure"]
+            dayfc.windspeed = dyfc["wind_speed"]
+            dayfc.winddir = dyfc["wind_deg"]
+            dayfc.clouds = dyfc["clouds"]
+            dayfc.uvi = dyfc["uvi"]
+            dayfc.pop = dyfc["pop"]
             if "rain" in dyfc:
-                dayfc["rain"] = dyfc["rain"]
+                dayfc.rain = dyfc["rain"]
             if "snow" in dyfc:
-                dayfc["snow"] = dyfc["snow"]
+                dayfc.snow = dyfc["snow"]
             if len(dyfc["weather"]) > 0:
                 w = dyfc["weather"][0]
-                dayfc["description"] = w["description"]
-                dayfc["icon"] = w["icon"]
-                dayfc["alerts"] = getAlerts(fc, dyfc["dt"])
+                dayfc.description = w["description"]
+                dayfc.icon = w["icon"]
+                dayfc.alerts = alerts.count(dyfc["dt"])
 
             dailyfc.append(dayfc)
 
     return [curfc, hourlyfc, dailyfc]
 
+def mapAlerts(fc):
+    """
+    Return the alerts of a forecast as list of Alert
+    """
+    return [Alert.fromOwm(alert) for alert in fc.get("alerts", [])]
+
+class AlertIndex:
+    """
+    Class representing an index of the alert periods of a forecast
+
+    Start and end times of all alerts are kept in sorted lists.
+    The number of alerts active at a given time is the number of alerts started
+    up to this time minus the number of alerts ended before this time,
+    so that each count requires only two binary searches.
+    """
+    def __init__(self, fc):
+        """
+        Constructor for AlertIndex
+
+        Input:
+        - fc: Forecast as returned by getForecast
+        """
+        alerts = fc.get("alerts", [])
+        self.starts = sorted(alert["start"] for alert in alerts)
+        self.ends = sorted(alert["end"] for alert in alerts)
+
+    def count(self, dt):
+        """
+        Count the number of alerts for a given date/time (dt)
+        """
+        return bisect.bisect_right(self.starts, dt) - bisect.bisect_left(self.ends, dt)
+
+def mapForecastColumns(fc, ts):
+    """
+    Map forecast data to columnar structure
+
+    Each column is built with a single pass over the hourly or daily entries.
+    The result can be used instead of the result of mapForecast for forecastToDbBulk.
+    """
+    alerts = AlertIndex(fc)
+
+    current = ColumnTable.fromLists(HOURLY_COLUMNS, HOURLY_TYPES, [ts],
+                                    hourlyColumnValues([fc["current"]], alerts, True))
+
+    keys = [timestamps.timestamp(hfc["dt"]) for hfc in fc["hourly"]]
+    hourly = ColumnTable.fromLists(HOURLY_COLUMNS, HOURLY_TYPES, keys,
+                                   hourlyColumnValues(fc["hourly"], alerts, False))
+
+    days = fc["daily"]
+    weather = [dyfc["weather"][0] if len(dyfc["weather"]) > 0 else None for dyfc in days]
+    keys = [timestamps.date(dyfc["dt"]) for dyfc in days]
+    values = [
+        [timestamps.timeOfDay(dyfc["sunrise"]) for dyfc in days],
+        [timestamps.timeOfDay(dyfc["sunset"]) for dyfc in days],
+        [dyfc["temp"]["morn"] for dyfc in days],
+        [dyfc["temp"]["day"] for dyfc in days],
+        [dyfc["temp"]["eve"] for dyfc in days],
+        [dyfc["temp"]["night"] for dyfc in days],
+        [dyfc["temp"]["min"] for dyfc in days],
+        [dyfc["temp"]["max"] for dyfc in days],
+        [dyfc["humidity"] for dyfc in days],
+        [dyfc["pressure"] for dyfc in days],
+        [dyfc["wind_speed"] for dyfc in days],
+        [dyfc["wind_deg"] for dyfc in days],
+        [dyfc["clouds"] for dyfc in days],
+        [dyfc["uvi"] for dyfc in days],
+        [dyfc["pop"] for dyfc in days],
+        [dyfc.get("rain") for dyfc in days],
+        [dyfc.get("snow") for dyfc in days],
+        [w["description"] if w else None for w in weather],
+        [w["icon"] if w else None for w in weather],
+        [alerts.count(dyfc["dt"]) if w else 0 for dyfc, w in zip(days, weather)]
+    ]
+    daily = ColumnTable.fromLists(DAILY_COLUMNS, DAILY_TYPES, keys, values)
+
+    return ForecastColumns(current, hourly, daily)
+
+def hourlyColumnValues(entries, alerts, allAlerts):
+    """
+    Return the values of HOURLY_COLUMNS for current or hourly forecast entries
+
+    Input:
+    - entries  : List of current or hourly entries of the forecast
+    - alerts   : AlertIndex for the forecast
+    - allAlerts: If False, alerts are only counted for entries with weather condition
+                 (as in mapForecast)
+    """
+    weather = [hfc["weather"][0] if len(hfc["weather"]) > 0 else None for hfc in entries]
+    return [
+        [hfc["temp"] for hfc in entries],
+        [hfc["humidity"] for hfc in entries],
+        [hfc["pressure"] for hfc in entries],
+        [hfc["clouds"] for hfc in entries],
+        [hfc["uvi"] for hfc in entries],
+        [hfc["visibility"] for hfc in entries],
+        [hfc["wind_speed"] for hfc in entries],
+        [hfc["wind_deg"] for hfc in entries],
+        [hfc["rain"]["1h"] if "rain" in hfc else None for hfc in entries],
+        [hfc["snow"]["1h"] if "snow" in hfc else None for hfc in entries],
+        [w["description"] if w else None for w in weather],
+        [w["icon"] if w else None for w in weather],
+        [alerts.count(hfc["dt"]) if w or allAlerts else 0 for hfc, w in zip(entries, weather)]
+    ]
+
+def mapForecastData(fc, ts, cfg):
+    """
+    Map forecast data according to the configured mapping mode
+    ("rows": mapForecast, "columns": mapForecastColumns)
+    """
+    if cfg["forecast"].get("mapping", "rows") == "columns":
+        return mapForecastColumns(fc, ts)
+    return mapForecast(fc, ts)
+
+def forecastEntries(fcData):
+    """
+    Return the current, hourly and daily forecast as (key, values) pairs
+
+    Input:
+    - fcData: Forecast as returned by mapForecast or mapForecastColumns
+
+    Returns a tuple with
+    - (timestamp, values of HOURLY_COLUMNS) for the current forecast
+    - a list of (timestamp, values of HOURLY_COLUMNS) for the hourly forecast
+    - a list of (date, values of DAILY_COLUMNS) for the daily forecast
+    """
+    if isinstance(fcData, ForecastColumns):
+        return fcData.current.rows()[0], fcData.hourly.rows(), fcData.daily.rows()
+    return (
+        (fcData[0].timestamp, fcData[0].values()),
+        [(hourfc.timestamp, hourfc.values()) for hourfc in fcData[1]],
+        [(dayfc.date, dayfc.values()) for dayfc in fcData[2]]
+    )
+
 def getAlerts(fc, dt):
     """
     Count the number of alerts for a given date/time (dt)
+
+    For counting alerts of many entries, AlertIndex should be used.
     """
     res = 0
 
@@ -193,18 +303,15 @@ def forecastToDb(fcData, cfg, curTs, curDate, dbCon, dbCur, servRun):
     # Retain forecast for the next fcRetainHours hours
     fcRetainHours = cfg["forecast"]["forecastRetain"]
 
-    t_lastTs = getLatestForecast(tblHourly, dbCon, dbCur, servRun)
-    if t_lastTs:
-        t_lastTs = t_lastTs + datetime.timedelta(minutes=1)
-        t_curTs  = datetime.datetime.strptime(curTs, "%Y-%m-%d %H:%M:%S")
-        t_limTs  = t_curTs + datetime.timedelta(hours=fcRetainHours)
-        if t_lastTs < t_limTs:
-            t_limTs = t_lastTs
-        limTs    = t_limTs.strftime("%Y-%m-%d %H:%M:%S")
-        if limTs < curTs:
-            limTs = curTs
+    if spooling(dbCon):
+        limTs = timestamps.fromSeconds(spoolHistoryLimitSeconds(timestamps.seconds(curTs), fcRetainHours))
     else:
-        limTs = curTs
+        t_lastTs = getLatestForecast(tblHourly, dbCon, dbCur, servRun)
+        limTs = historyLimit(t_lastTs, curTs, fcRetainHours)
+
+    # Rows are written without the forecast image
+    fcImages.pop(tblHourly, None)
+
     forecastToDbHourlyCleanup(tblHourly, limTs, dbCon, dbCur, servRun)
 
     # Insert Current forecast
@@ -212,13 +319,16 @@ def forecastToDb(fcData, cfg, curTs, curDate, dbCon, dbCur, servRun):
     forecastToDbCurrent(curfc, tblHourly, dbCon, dbCur, servRun)
 
     # Insert hourly forecast
+    curSecs = timestamps.seconds(curTs)
+    limSecs = timestamps.seconds(limTs)
     hourfc = fcData[1]
     if len(hourfc) > 0:
         for i in range(0, len(hourfc)):
             curfc = hourfc[i]
-            if curfc["timestamp"] >= limTs:
+            tsSecs = timestamps.seconds(curfc.timestamp)
+            if tsSecs >= limSecs:
                 forecastToDbHourly(curfc, tblHourly, dbCon, dbCur, servRun)
-            elif (curfc["timestamp"] >= curTs) and (curTs < limTs):
+            elif (tsSecs >= curSecs) and (curSecs < limSecs):
                 forecastToDbCurrent(curfc, tblHourly, dbCon, dbCur, servRun)
     #
     # Store daily forecast
@@ -229,11 +339,12 @@ def forecastToDb(fcData, cfg, curTs, curDate, dbCon, dbCur, servRun):
     forecastToDbDailyCleanup(tblDaily, curDate, dbCon, dbCur, servRun)
 
     # Insert daily forecast
+    curDay = timestamps.seconds(curDate)
     dayfc = fcData[2]
     if len(dayfc) > 0:
         for i in range(0, len(dayfc)):
             curfc = dayfc[i]
-            if curfc["date"] >= curDate:
+            if timestamps.seconds(curfc.date) >= curDay:
                 forecastToDbDaily(curfc, tblDaily, dbCon, dbCur, servRun)
 
 def getLatestForecast(tbl, dbCon, dbCur, servRun):
@@ -241,7 +352,7 @@ def getLatestForecast(tbl, dbCon, dbCur, servRun):
     Return the timestamp for the latest forecast.
     """
     # Prepare statement
-    stmt = "SELECT timestamp FROM " + tbl + " ORDER BY TIMESTAMP DESC LIMIT 0,1"
+    stmt = dbStatements.cachedStatement(("latest", tbl), lambda: "SELECT timestamp FROM " + tbl + " ORDER BY TIMESTAMP DESC LIMIT 0,1")
  
     logger.debug(stmt)
     dbCur.execute(stmt)
@@ -258,11 +369,8 @@ def forecastToDbHourlyCleanup(tbl, ts, dbCon, dbCur, servRun):
 
     This is necessary in order to allow later insertion of forecast entries
     """
-    # Prepare statement
-    stmt = "DELETE FROM " + tbl + " WHERE timestamp >= '" + ts + "'"
-
-    logger.debug(stmt)
-    dbCur.execute(stmt)
+    stmt = storage.backend.cleanup(dbCur, tbl, "timestamp", ">=", [ts])
+    logger.debug("%s %s", stmt, ts)
     dbCon.commit()
 
 def forecastToDbDailyCleanup(tbl, curDate, dbCon, dbCur, servRun):
@@ -271,12 +379,8 @@ def forecastToDbDailyCleanup(tbl, curDate, dbCon, dbCur, servRun):
 
     This is necessary in order to allow later insertion of forecast entries
     """
-    
-    # Prepare statement
-    stmt = "DELETE FROM " + tbl + " WHERE date >= '" + curDate + "'"
-
-    logger.debug(stmt)
-    dbCur.execute(stmt)
+    stmt = storage.backend.cleanup(dbCur, tbl, "date", ">=", [curDate])
+    logger.debug("%s %s", stmt, curDate)
     dbCon.commit()
 
 def forecastToDbCurrent(fc, tbl, dbCon, dbCur, servRun):
@@ -285,231 +389,31 @@ def forecastToDbCurrent(fc, tbl, dbCon, dbCur, servRun):
     """
     global logger
 
-    # Prepare statement
-    ins1 = "INSERT INTO " + tbl + " (timestamp"
-    ins2 = "VALUES ('"  + fc["timestamp"] + "'"
-    ins3 = " ON DUPLICATE KEY UPDATE "
-
-    if fc["temperature"] != None:
-        ins1 = ins1 + ", temperature"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature"])
-        ins3 = ins3 + "temperature="
-        ins3 = ins3 + "{:+.1f}".format(fc["temperature"])
-    if fc["humidity"] != None:
-        ins1 = ins1 + ", humidity"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["humidity"])
-        ins3 = ins3 + ", humidity="
-        ins3 = ins3 + "{:+.1f}".format(fc["humidity"])
-    if fc["pressure"] != None:
-        ins1 = ins1 + ", pressure"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["pressure"])
-        ins3 = ins3 + ", pressure="
-        ins3 = ins3 + "{:+.1f}".format(fc["pressure"])
-    if fc["clouds"] != None:
-        ins1 = ins1 + ", clouds"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["clouds"])
-        ins3 = ins3 + ", clouds="
-        ins3 = ins3 + "{:+.1f}".format(fc["clouds"])
-    if fc["uvi"] != None:
-        ins1 = ins1 + ", uvi"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["uvi"])
-        ins3 = ins3 + ", uvi="
-        ins3 = ins3 + "{:+.2f}".format(fc["uvi"])
-    if fc["visibility"] != None:
-        ins1 = ins1 + ", visibility"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["visibility"])
-        ins3 = ins3 + ", visibility="
-        ins3 = ins3 + "{:+.1f}".format(fc["visibility"])
-    if fc["windspeed"] != None:
-        ins1 = ins1 + ", windspeed"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["windspeed"])
-        ins3 = ins3 + ", windspeed="
-        ins3 = ins3 + "{:+.1f}".format(fc["windspeed"])
-    if fc["winddir"] != None:
-        ins1 = ins1 + ", winddir"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["winddir"])
-        ins3 = ins3 + ", winddir="
-        ins3 = ins3 + "{:+.1f}".format(fc["winddir"])
-    if fc["rain"] != None:
-        ins1 = ins1 + ", rain"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["rain"])
-        ins3 = ins3 + ", rain="
-        ins3 = ins3 + "{:+.2f}".format(fc["rain"])
-    if fc["snow"] != None:
-        ins1 = ins1 + ", snow"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["snow"])
-        ins3 = ins3 + ", snow="
-        ins3 = ins3 + "{:+.2f}".format(fc["snow"])
-    if fc["description"] != None:
-        ins1 = ins1 + ", description"
-        ins2 = ins2 + ", '" + fc["description"] + "'"
-        ins3 = ins3 + ", description="
-        ins3 = ins3 + "'" + fc["description"] + "'"
-    if fc["icon"] != None:
-        ins1 = ins1 + ", icon"
-        ins2 = ins2 + ", '" + fc["icon"] + "'"
-        ins3 = ins3 + ", icon="
-        ins3 = ins3 + "'" + fc["icon"] + "'"
-    if fc["alerts"] != None:
-        ins1 = ins1 + ", alerts"
-        ins2 = ins2 + ", " + "{}".format(fc["alerts"])
-        ins3 = ins3 + ", alerts="
-        ins3 = ins3 + "{}".format(fc["alerts"])
-
-    tnow = datetime.datetime.now()
-    ins1 = ins1 + ", time_cre"
-    ins2 = ins2 + ", '" + tnow.strftime("%Y-%m-%d %H:%M:%S") + "'"
-    ins1 = ins1 + ", time_mod"
-    ins2 = ins2 + ", '" + tnow.strftime("%Y-%m-%d %H:%M:%S") + "'"
-    ins3 = ins3 + ", time_mod="
-    ins3 = ins3 + "'" + tnow.strftime("%Y-%m-%d %H:%M:%S") + "'"
+    tnow = timestamps.now()[0]
 
     # Insert Current forecast
-    ins = ins1 + ") " + ins2 + ")" + ins3
+    ins = upsertHourly(dbCur, tbl, [hourlyParams(fc, tnow)])
     logger.debug(ins)
-    dbCur.execute(ins)
     dbCon.commit()
 
 def forecastToDbHourly(fc, tbl, dbCon, dbCur, servRun):
     """
     Store forecast data in database
     """
-    # Prepare statement
-    ins1 = "INSERT INTO " + tbl + " (timestamp"
-    ins2 = "VALUES ('"  + fc["timestamp"] + "'"
-
-    if fc["temperature"] != None:
-        ins1 = ins1 + ", temperature"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature"])
-        ins1 = ins1 + ", temperature_hist"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature"])
-    if fc["humidity"] != None:
-        ins1 = ins1 + ", humidity"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["humidity"])
-        ins1 = ins1 + ", humidity_hist"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["humidity"])
-    if fc["pressure"] != None:
-        ins1 = ins1 + ", pressure"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["pressure"])
-        ins1 = ins1 + ", pressure_hist"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["pressure"])
-    if fc["clouds"] != None:
-        ins1 = ins1 + ", clouds"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["clouds"])
-    if fc["uvi"] != None:
-        ins1 = ins1 + ", uvi"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["uvi"])
-    if fc["visibility"] != None:
-        ins1 = ins1 + ", visibility"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["visibility"])
-    if fc["windspeed"] != None:
-        ins1 = ins1 + ", windspeed"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["windspeed"])
-    if fc["winddir"] != None:
-        ins1 = ins1 + ", winddir"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["winddir"])
-    if fc["rain"] != None:
-        ins1 = ins1 + ", rain"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["rain"])
-    if fc["snow"] != None:
-        ins1 = ins1 + ", snow"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["snow"])
-    if fc["description"] != None:
-        ins1 = ins1 + ", description"
-        ins2 = ins2 + ", '" + fc["description"] + "'"
-    if fc["icon"] != None:
-        ins1 = ins1 + ", icon"
-        ins2 = ins2 + ", '" + fc["icon"] + "'"
-    if fc["alerts"] != None:
-        ins1 = ins1 + ", alerts"
-        ins2 = ins2 + ", " + "{}".format(fc["alerts"])
-
-
-    tnow = datetime.datetime.now()
-    ins1 = ins1 + ", time_cre"
-    ins2 = ins2 + ", '" + tnow.strftime("%Y-%m-%d %H:%M:%S") + "'"
-    ins1 = ins1 + ", time_mod"
-    ins2 = ins2 + ", '" + tnow.strftime("%Y-%m-%d %H:%M:%S") + "'"
+    tnow = timestamps.now()[0]
 
-    # Insert Current forecast
-    ins = ins1 + ") " + ins2 + ")"
+    # Insert hourly forecast
+    ins = insertHourly(dbCur, tbl, [hourlyHistParams(fc, tnow)])
     logger.debug(ins)
-    dbCur.execute(ins)
     dbCon.commit()
 
 def forecastToDbDaily(fc, tbl, dbCon, dbCur, servRun):
     """
     Store forecast data in database
     """
-    # Prepare statement
-    ins1 = "INSERT INTO " + tbl + " (date"
-    ins2 = "VALUES ('"  + fc["date"] + "'"
-
-    if fc["sunrise"] != None:
-        ins1 = ins1 + ", sunrise"
-        ins2 = ins2 + ", '" + fc["sunrise"] + "'"
-    if fc["sunset"] != None:
-        ins1 = ins1 + ", sunset"
-        ins2 = ins2 + ", '" + fc["sunset"] + "'"
-    if fc["temperature_m"] != None:
-        ins1 = ins1 + ", temperature_m"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature_m"])
-    if fc["temperature_d"] != None:
-        ins1 = ins1 + ", temperature_d"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature_d"])
-    if fc["temperature_e"] != None:
-        ins1 = ins1 + ", temperature_e"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature_e"])
-    if fc["temperature_n"] != None:
-        ins1 = ins1 + ", temperature_n"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature_n"])
-    if fc["temperature_min"] != None:
-        ins1 = ins1 + ", temperature_min"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature_min"])
-    if fc["temperature_max"] != None:
-        ins1 = ins1 + ", temperature_max"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["temperature_max"])
-    if fc["humidity"] != None:
-        ins1 = ins1 + ", humidity"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["humidity"])
-    if fc["pressure"] != None:
-        ins1 = ins1 + ", pressure"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["pressure"])
-    if fc["windspeed"] != None:
-        ins1 = ins1 + ", windspeed"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["windspeed"])
-    if fc["winddir"] != None:
-        ins1 = ins1 + ", winddir"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["winddir"])
-    if fc["clouds"] != None:
-        ins1 = ins1 + ", clouds"
-        ins2 = ins2 + ", " + "{:+.1f}".format(fc["clouds"])
-    if fc["uvi"] != None:
-        ins1 = ins1 + ", uvi"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["uvi"])
-    if fc["pop"] != None:
-        ins1 = ins1 + ", pop"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["pop"])
-    if fc["rain"] != None:
-        ins1 = ins1 + ", rain"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["rain"])
-    if fc["snow"] != None:
-        ins1 = ins1 + ", snow"
-        ins2 = ins2 + ", " + "{:+.2f}".format(fc["snow"])
-    if fc["description"] != None:
-        ins1 = ins1 + ", description"
-        ins2 = ins2 + ", '" + fc["description"] + "'"
-    if fc["icon"] != None:
-        ins1 = ins1 + ", icon"
-        ins2 = ins2 + ", '" + fc["icon"] + "'"
-    if fc["alerts"] != None:
-        ins1 = ins1 + ", alerts"
-        ins2 = ins2 + ", " + "{}".format(fc["alerts"])
-
-    # Insert Current forecast
-    ins = ins1 + ") " + ins2 + ")"
+    # Insert daily forecast
+    ins = insertDaily(dbCur, tbl, [dailyParams(fc)])
     logger.debug(ins)
-    dbCur.execute(ins)
     dbCon.commit()
 
 def alertsToDb(fc, cfg, dbCon, dbCur, servRun):
@@ -521,42 +425,394 @@ def alertsToDb(fc, cfg, dbCon, dbCur, servRun):
 
     if "alerts" in fc:
         if len(fc["alerts"]) > 0:
-            for i in range(0, len(fc["alerts"])):
-                alert = fc["alerts"][i]
-                # Prepare statement
-                ins1 = "INSERT INTO " + tbl + " ("
-                ins2 = "VALUES ("
-                ins3 = " ON DUPLICATE KEY UPDATE "
-                
-                ins1 = ins1 + "start"
-                ins2 = ins2 + "'" + datetime.datetime.fromtimestamp(alert["start"]).strftime("%Y-%m-%d %H:%M:%S") + "'"
+            for alert in fc["alerts"]:
+                # Insert alert
+                ins = storage.backend.upsertAlerts(dbCur, tbl, [alertParams(alert)])
+                logger.debug(ins)
+                dbCon.commit()
+
+
+def forecastToDbBulk(fc, fcData, cfg, curTs, curDate, dbCon, dbCur, servRun):
+    """
+    Store forecast data and alerts in database within a single transaction
 
-                ins1 = ins1 + ", end"
-                ins2 = ins2 + ", '" + datetime.datetime.fromtimestamp(alert["end"]).strftime("%Y-%m-%d %H:%M:%S") + "'"
+    The forecast is compared with the in-memory image of the forecast persisted before.
+    Only changed or new rows are upserted and only vanished rows are deleted.
+    All rows of a kind are written with one parameterized executemany.
+    Values which are not available are bound as NULL.
+    The resulting table content is the same as for forecastToDb and alertsToDb.
 
-                ins1 = ins1 + ", event"
-                ins2 = ins2 + ", '" + alert["event"] + "'"
+    Input:
+    - fc     : Forecast as returned by getForecast
+    - fcData : Forecast as returned by mapForecast or mapForecastColumns
+    For other parameters see forecastToDb
+    """
+    tblHourly = cfg["forecast"]["forecastTables"]["hourlyForecast"]
+    tblDaily  = cfg["forecast"]["forecastTables"]["dailyForecast"]
+    tblAlerts = cfg["forecast"]["forecastTables"]["alertsForecast"]
+    fcRetainHours = cfg["forecast"]["forecastRetain"]
 
-                ins1 = ins1 + ", sender_name"
-                ins2 = ins2 + ", '" + alert["sender_name"] + "'"
+    tnow = timestamps.now()[0]
+
+    # Timestamps are compared as wall-clock seconds
+    curSecs = timestamps.seconds(curTs)
+    curDay = timestamps.seconds(curDate)
+
+    image = fcImages.get(tblHourly)
+    if image is None:
+        if spooling(dbCon):
+            # The image cannot be loaded from the spool. An empty image is used for this forecast only
+            image = ForecastImage()
+            image.latest = spoolHistoryLimitSeconds(curSecs, fcRetainHours)
+        else:
+            image = loadForecastImage(cfg, curTs, curDate, dbCon, dbCur, servRun)
+
+    # Determine limit for historical forecast (see forecastToDb)
+    limSecs = historyLimitSeconds(image.latest, curSecs, fcRetainHours)
+
+    curEntry, hourlyEntries, dailyEntries = forecastEntries(fcData)
+
+    # Current forecast and hourly forecast within the retention period:
+    # Historical forecast is kept and NULL values do not overwrite stored values
+    curRows = list()
+    curImage = {}
+    hourlyEntries = [(timestamps.seconds(ts), ts, values) for ts, values in hourlyEntries]
+    fcList = [(timestamps.seconds(curEntry[0]),) + curEntry]
+    for entry in hourlyEntries:
+        if (entry[0] < limSecs) and (entry[0] >= curSecs) and (curSecs < limSecs):
+            fcList.append(entry)
+    for tsSecs, ts, values in fcList:
+        params = (ts,) + values + (tnow, tnow)
+        old = image.hourly.get(tsSecs)
+        if old:
+            values = tuple(o if n is None else n for n, o in zip(values, old))
+            if rowsEqual(values, old):
+                continue
+        curRows.append(params)
+        curImage[tsSecs] = values
+
+    # Hourly forecast after the retention period:
+    # Rows are replaced including historical forecast
+    newRows = list()
+    newImage = {}
+    for tsSecs, ts, values in hourlyEntries:
+        if tsSecs >= limSecs:
+            newImage[tsSecs] = values
+            old = image.hourly.get(tsSecs)
+            if old and rowsEqual(values, old):
+                continue
+            newRows.append((ts,) + values + (tnow, tnow) + tuple(values[i] for i in HOURLY_HIST_INDEX))
+    hourlyDel = list()
+    for tsSecs in image.hourly:
+        if tsSecs >= limSecs and tsSecs not in newImage:
+            hourlyDel.append(tsSecs)
+
+    # Daily forecast rows
+    dayRows = list()
+    dayImage = {}
+    for date, values in dailyEntries:
+        day = timestamps.seconds(date)
+        if day >= curDay:
+            dayImage[day] = values
+            old = image.daily.get(day)
+            if old and rowsEqual(values, old):
+                continue
+            dayRows.append((date,) + values)
+    dailyDel = list()
+    for day in image.daily:
+        if day >= curDay and day not in dayImage:
+            dailyDel.append(day)
+
+    # Alerts
+    alertRows = list()
+    alertImage = {}
+    for alert in mapAlerts(fc):
+        alertImage[alert.key()] = alert.description
+        if image.alerts.get(alert.key()) != alert.description:
+            alertRows.append(alert.astuple())
+
+    logger.debug("Forecast changes: hourly %s, hourly deleted %s, current %s, daily %s, daily deleted %s, alerts %s",
+                 len(newRows), len(hourlyDel), len(curRows), len(dayRows), len(dailyDel), len(alertRows))
 
-                ins1 = ins1 + ", description"
-                ins2 = ins2 + ", '" + alert["description"] + "'"
-                ins3 = ins3 + "description='" + alert["description"] + "'"
+    try:
+        if len(hourlyDel) > 0:
+            stmt = storage.backend.cleanup(dbCur, tblHourly, "timestamp", "=", [timestamps.fromSeconds(tsSecs) for tsSecs in hourlyDel])
+            logger.debug("%s (%s rows)", stmt, len(hourlyDel))
+
+        if len(curRows) > 0:
+            stmt = upsertHourly(dbCur, tblHourly, curRows)
+            logger.debug("%s (%s rows)", stmt, len(curRows))
+
+        if len(newRows) > 0:
+            stmt = replaceHourly(dbCur, tblHourly, newRows)
+            logger.debug("%s (%s rows)", stmt, len(newRows))
+
+        if len(dailyDel) > 0:
+            stmt = storage.backend.cleanup(dbCur, tblDaily, "date", "=", [timestamps.fromSeconds(day)[:10] for day in dailyDel])
+            logger.debug("%s (%s rows)", stmt, len(dailyDel))
+
+        if len(dayRows) > 0:
+            stmt = replaceDaily(dbCur, tblDaily, dayRows)
+            logger.debug("%s (%s rows)", stmt, len(dayRows))
+
+        if len(alertRows) > 0:
+            stmt = storage.backend.upsertAlerts(dbCur, tblAlerts, alertRows)
+            logger.debug("%s (%s rows)", stmt, len(alertRows))
+
+        dbCon.commit()
+
+    except Exception:
+        # The image is kept, because the database is rolled back to the state it reflects.
+        # After the forecast has been spooled, images are loaded again (see ForecastWorker.connect)
+        dbCon.rollback()
+        raise
+
+    # Update image
+    for tsSecs in hourlyDel:
+        del image.hourly[tsSecs]
+    image.hourly.update(curImage)
+    image.hourly.update(newImage)
+    for day in dailyDel:
+        del image.daily[day]
+    image.daily.update(dayImage)
+    image.alerts = alertImage
+    if len(image.hourly) > 0:
+        latest = max(image.hourly)
+        if (image.latest is None) or (latest > image.latest):
+            image.latest = latest
+    image.prune(curSecs, curDay)
+
+class ForecastImage:
+    """
+    Class representing the in-memory image of the forecast persisted
+    in the forecast tables of a location
+    """
+    def __init__(self):
+        """
+        Constructor for ForecastImage
+        """
+        # Latest timestamp in the hourly forecast table (wall-clock seconds)
+        self.latest = None
+        # Values of HOURLY_COLUMNS for each timestamp (wall-clock seconds)
+        self.hourly = {}
+        # Values of DAILY_COLUMNS for each date (wall-clock seconds)
+        self.daily = {}
+        # Description for each alert key (start, end, event, sender_name) of the last forecast
+        self.alerts = {}
+
+    def prune(self, curSecs, curDay):
+        """
+        Remove entries which will not be compared any more
+        """
+        for tsSecs in [tsSecs for tsSecs in self.hourly if tsSecs < curSecs]:
+            del self.hourly[tsSecs]
+        for day in [day for day in self.daily if day < curDay]:
+            del self.daily[day]
+
+# Forecast images for each hourly forecast table
+fcImages = {}
+
+def loadForecastImage(cfg, curTs, curDate, dbCon, dbCur, servRun):
+    """
+    Load the image of the future forecast from the database
 
-                # Insert Current forecast
-                ins = ins1 + ") " + ins2 + ")" + ins3
-                logger.debug(ins)
-                dbCur.execute(ins)
-                dbCon.commit()
+    This is done once for each location when the first forecast is stored.
+    """
+    tblHourly = cfg["forecast"]["forecastTables"]["hourlyForecast"]
+    tblDaily  = cfg["forecast"]["forecastTables"]["dailyForecast"]
+    tblAlerts = cfg["forecast"]["forecastTables"]["alertsForecast"]
+
+    image = ForecastImage()
+    latest = getLatestForecast(tblHourly, dbCon, dbCur, servRun)
+    if latest:
+        image.latest = timestamps.seconds(dbValue(latest))
+
+    stmt = dbStatements.cachedStatement(("imageHourly", tblHourly), lambda: "SELECT timestamp, " + ", ".join(HOURLY_COLUMNS) + " FROM " + tblHourly + " WHERE timestamp >= ?")
+    logger.debug(stmt)
+    dbCur.execute(stmt, (curTs,))
+    for row in dbCur.fetchall():
+        image.hourly[timestamps.seconds(dbValue(row[0]))] = tuple(dbValue(v) for v in row[1:])
+
+    stmt = dbStatements.cachedStatement(("imageDaily", tblDaily), lambda: "SELECT date, " + ", ".join(DAILY_COLUMNS) + " FROM " + tblDaily + " WHERE date >= ?")
+    logger.debug(stmt)
+    dbCur.execute(stmt, (curDate,))
+    for row in dbCur.fetchall():
+        image.daily[timestamps.seconds(dbValue(row[0]))] = tuple(dbValue(v) for v in row[1:])
+
+    stmt = dbStatements.cachedStatement(("imageAlerts", tblAlerts), lambda: "SELECT start, end, event, sender_name, description FROM " + tblAlerts + " WHERE end >= ?")
+    logger.debug(stmt)
+    dbCur.execute(stmt, (curTs,))
+    for row in dbCur.fetchall():
+        row = tuple(dbValue(v) for v in row)
+        image.alerts[row[:4]] = row[4]
+
+    logger.debug("Forecast image loaded for %s: %s hourly, %s daily, %s alerts",
+                 tblHourly, len(image.hourly), len(image.daily), len(image.alerts))
+
+    fcImages[tblHourly] = image
+    return image
 
+def dbValue(value):
+    """
+    Convert a value read from the database to the representation used for storage
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(" ", "seconds")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        sec = int(value.total_seconds())
+        return "{:02d}:{:02d}:{:02d}".format(sec // 3600, (sec % 3600) // 60, sec % 60)
+    return value
+
+def rowsEqual(row1, row2):
+    """
+    Compare two rows of values.
+
+    Floating point values are compared with a tolerance
+    because the database stores them with single precision.
+    """
+    if len(row1) != len(row2):
+        return False
+    for v1, v2 in zip(row1, row2):
+        if v1 == v2:
+            continue
+        if isinstance(v1, (int, float)) and isinstance(v2, (int, float)) \
+        and not isinstance(v1, bool) and not isinstance(v2, bool):
+            if math.isclose(v1, v2, rel_tol=1e-6, abs_tol=1e-6):
+                continue
+        return False
+    return True
+
+def historyLimit(latestTs, curTs, fcRetainHours):
+    """
+    Return the timestamp from which on forecast rows are replaced including historical forecast
+
+    Forecast is retained as historical forecast for the next fcRetainHours hours,
+    but not beyond the latest forecast already stored (latestTs).
+    """
+    if latestTs:
+        latestTs = timestamps.seconds(dbValue(latestTs))
+    return timestamps.fromSeconds(historyLimitSeconds(latestTs, timestamps.seconds(curTs), fcRetainHours))
+
+def spooling(dbCon):
+    """
+    Return True if the forecast is stored in the spool instead of the database
+    """
+    return isinstance(dbCon, spool.SpoolConnection)
+
+def spoolHistoryLimitSeconds(curSecs, fcRetainHours):
+    """
+    Return the limit for historical forecast (see historyLimit) for a forecast stored in the spool
+
+    The latest forecast stored in the database is not known while spooling.
+    It is assumed to extend beyond the retention period, so that historical forecast
+    within the retention period is kept when the spool is replayed.
+    """
+    return curSecs + fcRetainHours * 3600
+
+def historyLimitSeconds(latestSecs, curSecs, fcRetainHours):
+    """
+    Return the limit for historical forecast (see historyLimit) as wall-clock seconds
+
+    Input:
+    - latestSecs   : Latest forecast already stored (wall-clock seconds, None if none)
+    - curSecs      : Current time (wall-clock seconds)
+    - fcRetainHours: Number of hours to retain historical forecast
+    """
+    limSecs = curSecs
+    if latestSecs is not None:
+        limSecs = min(latestSecs + 60, curSecs + fcRetainHours * 3600)
+        if limSecs < curSecs:
+            limSecs = curSecs
+    return limSecs
+
+def hourlyParams(fc, tnow):
+    """
+    Return the statement parameters for a current / hourly forecast row
+    """
+    return fc.astuple() + (tnow, tnow)
+
+def hourlyValues(fc):
+    """
+    Return the values of a current / hourly forecast row
+    """
+    return fc.values()
+
+def hourlyHistParams(fc, tnow):
+    """
+    Return the statement parameters for an hourly forecast row including historical forecast
+    """
+    values = fc.values()
+    return hourlyParams(fc, tnow) + tuple(values[i] for i in HOURLY_HIST_INDEX)
+
+def dailyParams(fc):
+    """
+    Return the statement parameters for a daily forecast row
+    """
+    return fc.astuple()
+
+def alertParams(alert):
+    """
+    Return the statement parameters for an alert
+    """
+    return Alert.fromOwm(alert).astuple()
+
+def upsertHourly(dbCur, tbl, rows):
+    """
+    Insert or update current forecast rows
+
+    Values which are NULL do not overwrite values already stored.
+    Historical forecast values and creation time are kept for existing rows.
+    Returns the statement used.
+    """
+    return storage.backend.upsertForecast(dbCur, tbl, HOURLY_ROW_COLUMNS, rows,
+                                          updateCols=["time_mod"], keepCols=HOURLY_COLUMNS)
 
-def forecastToFile(fc, cfg, curTs, fil, servRun):
+def insertHourly(dbCur, tbl, rows):
+    """
+    Insert hourly forecast rows
+
+    Temperature, humidity and pressure are also stored as historical forecast.
+    Returns the statement used.
+    """
+    return storage.backend.upsertForecast(dbCur, tbl, HOURLY_HIST_ROW_COLUMNS, rows)
+
+def insertDaily(dbCur, tbl, rows):
+    """
+    Insert daily forecast rows
+
+    Returns the statement used.
+    """
+    return storage.backend.upsertForecast(dbCur, tbl, DAILY_ROW_COLUMNS, rows)
+
+def replaceHourly(dbCur, tbl, rows):
+    """
+    Insert or replace hourly forecast rows including historical forecast
+
+    The creation time is kept for existing rows.
+    Returns the statement used.
+    """
+    histCols = [col + "_hist" for col in HOURLY_HIST_COLUMNS]
+    return storage.backend.upsertForecast(dbCur, tbl, HOURLY_HIST_ROW_COLUMNS, rows,
+                                          updateCols=HOURLY_COLUMNS + ["time_mod"] + histCols)
+
+def replaceDaily(dbCur, tbl, rows):
+    """
+    Insert or replace daily forecast rows
+
+    Returns the statement used.
+    """
+    return storage.backend.upsertForecast(dbCur, tbl, DAILY_ROW_COLUMNS, rows, updateCols=DAILY_COLUMNS)
+
+def forecastToFile(fc, cfg, curTs, fil, servRun, location=None):
     """
     Store forecast data in database
     """
     fil.write('{')
     fil.write('"time": "' + curTs + '",')
+    if location:
+        fil.write('"location": ' + json.dumps(location) + ',')
     fil.write('"data":')
     fil.write(json.dumps(fc))
     fil.write('}')
@@ -580,18 +836,59 @@ def handleForecast(cfg, curTs, curDate, curTime, dbCon, dbCur, fil, servRun):
     payload = cfg["forecast"]["source"]["payload"]
     fc = getForecast(url, payload)
 
+    processForecast(fc, cfg, curTs, curDate, dbCon, dbCur, fil, servRun)
+
+def processForecast(fc, cfg, curTs, curDate, dbCon, dbCur, fil, servRun):
+    """
+    Write, map and store a forecast received from the forecast service
+
+    Input:
+    - fc     : Forecast as returned by getForecast
+    - cfg    : Configuration dictionary for weatherstation
+    - curTS  : Measurement timestamp
+    - curDate: Measurement Date
+    - dbCon  : Database connection
+    - dbCur  : Database cursor
+    - fil    : file handler for outpot file (None to skip file output)
+    - servRun: True for service run
+    """
+    if fc:
+        # Map forecast
+        fcData = mapForecastData(fc, curTs, cfg)
+
+        storeForecast(fc, fcData, cfg, curTs, curDate, dbCon, dbCur, fil, servRun)
+
+def storeForecast(fc, fcData, cfg, curTs, curDate, dbCon, dbCur, fil, servRun):
+    """
+    Write a forecast to file and store the mapped forecast in the database
+
+    Input:
+    - fc     : Forecast as returned by getForecast
+    - fcData : Forecast as returned by mapForecast or mapForecastColumns
+    For other parameters see processForecast
+    """
     if fc:
         # Output to file
-        if cfg["forecast"]["forecastFileOut"]:
+        if cfg["forecast"]["forecastFileOut"] and fil:
             forecastToFile(fc, cfg, curTs, fil, servRun)
 
-        # Map forecast
-        fcData = mapForecast(fc, curTs)
+        # Store forecast and alerts in database
+        # (no connection if the database is unavailable and no spool is configured)
+        if cfg["forecast"]["forecastDbOut"] and dbCon:
+            forecastToDbBulk(fc, fcData, cfg, curTs, curDate, dbCon, dbCur, servRun)
 
-        # Store in database
-        if cfg["forecast"]["forecastDbOut"]:
-            forecastToDb(fcData, cfg, curTs, curDate, dbCon, dbCur, servRun)
+def locationConfig(cfg, location):
+    """
+    Return a configuration for the given forecast location
 
-        # Store alerts
-        if cfg["forecast"]["forecastDbOut"]:
-            alertsToDb(fc, cfg, dbCon, dbCur, servRun)
\ No newline at end of file
+    Source payload and forecast tables of the location replace those of the
+    weatherstation configuration, so that the functions of this module can be
+    used unchanged for each location.
+    """
+    locCfg = cfg.copy()
+    locCfg["forecast"] = cfg["forecast"].copy()
+    locCfg["forecast"]["source"] = cfg["forecast"]["source"].copy()
+    locCfg["forecast"]["source"]["payload"] = location["payload"]
+    if location["forecastTables"]:
+        locCfg["forecast"]["forecastTables"] = location["forecastTables"]
+    return locCfg
\ No newline at end of file
@@ -5,15 +5,30 @@ Module weatherStation
 This module includes functions for a weather station
 """
 
-from snraspi.sensors import EnvironmentSensor
+try:
+    from snraspi.sensors import EnvironmentSensor
+except ImportError:
+    # Only required for sensors of the Raspberry Pi (not for simulated and replay sensors)
+    EnvironmentSensor = None
 import time
-import datetime
-import mariadb
 import sys
-import math
 import os.path
 import json
 import weatherForecastOWM
+import forecastScheduler
+import forecastWorker
+import dbWriter
+import oversampling
+import stationSensors
+import virtualSensors
+from records import SENSOR_COLUMN
+import dbPool
+import spool
+import storage
+import rollup
+import maintenance
+import cycleScheduler
+import timestamps
 
 # Set up logging
 import logging
@@ -23,19 +38,41 @@ logger = logging_plus.getLogger("main")
 
 testRun = False
 servRun = False
+rebuildRun = False
 
 # Configuration defaults
 cfgFile = ""
 cfg = {
     "sensorType"         : "BME280_I2C",
     "raspiPin"           : None,
-    "raspiPinObj"        : None,
+    "sensors"            : [],
+    "simulation"         : None,
+    "replay"             : None,
     "measurementInterval": 2,
+    "scheduler":
+    {
+        "lateTolerance"  : 0.5,
+        "resyncThreshold": 1.0
+    },
+    "oversampling":
+    {
+        "samples"     : 1,
+        "bufferSize"  : 30,
+        "madThreshold": 3.5,
+        "statistics"  : False
+    },
+    "utc"                : False,
     "height"             : None,
     "dbOut"              : False,
     "fileOut"            : False,
     "includeMeasurement" : True,
     "includeForecast"    : False,
+    "storage":
+    {
+        "backend"    : "mariadb",
+        "file"       : None,
+        "busyTimeout": 30
+    },
     "dbConnection":
     {
         "host"    : None, 
@@ -45,6 +82,41 @@ cfg = {
         "user"    : None, 
         "password": None
     },
+    "dbWriter":
+    {
+        "batchSize"    : 50,
+        "flushInterval": 1000,
+        "queueSize"    : 10000
+    },
+    "dbPool":
+    {
+        "size"               : 2,
+        "timeout"            : 30,
+        "healthCheckInterval": 60,
+        "reconnectInterval"  : 5,
+        "reconnectMax"       : 300
+    },
+    "spool":
+    {
+        "file"           : None,
+        "maxRows"        : 1000000,
+        "maxSize"        : 100,
+        "replayBatchSize": 5000
+    },
+    "rollup":
+    {
+        "hourlyTable": None,
+        "dailyTable" : None
+    },
+    "maintenance":
+    {
+        "interval"           : 0,
+        "retainDays"         : None,
+        "downsampleAfterDays": None,
+        "downsampleInterval" : 300,
+        "forecastRetainDays" : None,
+        "partitionAhead"     : 2
+    },
     "fileName": None,
     "forecast":
     {
@@ -63,18 +135,39 @@ cfg = {
         "forecastDbOut"  : False,
         "forecastFileOut": False,
         "forecastRetain" : 4,
+        "refreshInterval": 600,
+        "mapping"        : "rows",
+        "http":
+        {
+            "connectTimeout": 5,
+            "readTimeout"   : 30,
+            "retries"       : 3,
+            "backoffFactor" : 1.0,
+            "backoffMax"    : 60,
+            "poolSize"      : 4
+        },
         "forecastTables" :
         {
             "hourlyForecast": None,
             "dailyForecast" : None,
             "alertsForecast": None
         },
-        "forecastFile": None
+        "forecastFile": None,
+        "maxConcurrency": 4,
+        "locations": []
     }
 }
 
 # Constants
 CFGFILENAME = "weatherstation.json"
+# Name of the logger of snraspi sensors
+SENSOR_LOGGER = "snraspi.sensors.EnvironmentSensor"
+# Sensor types which require raspiPin
+PIN_SENSOR_TYPES = ["BME280_SPI", "DHT11", "DHT22"]
+# Raspberry Pi GPIO pins in BOARD notation which can be used for sensors
+RASPI_PINS = ["PIN03", "PIN05", "PIN07", "PIN08", "PIN10", "PIN11", "PIN12", "PIN13", "PIN15", "PIN16",
+              "PIN18", "PIN19", "PIN21", "PIN22", "PIN23", "PIN24", "PIN26", "PIN27", "PIN28", "PIN29",
+              "PIN31", "PIN32", "PIN33", "PIN35", "PIN36", "PIN37", "PIN38", "PIN40"]
 
 def getCl():
     """
@@ -87,6 +180,7 @@ def getCl():
     global logger
     global testRun
     global servRun
+    global rebuildRun
     global cfgFile
 
     parser = argparse.ArgumentParser(
@@ -111,6 +205,7 @@ def getCl():
     parser.add_argument("-f", "--file", help="Logging configuration from specified JSON dictionary file")
     parser.add_argument("-v", "--verbose", action = "store_true", help="Verbose - log INFO level")
     parser.add_argument("-c", "--config", help="Path to config file to be used")
+    parser.add_argument("-r", "--rebuild", action = "store_true", help="Rebuild rollup tables from measurements and exit")
 
     args = parser.parse_args()
 
@@ -119,7 +214,7 @@ def getCl():
     logger.addHandler(logging.NullHandler())
     rLogger = logging_plus.getLogger()
     rLogger.addHandler(logging.NullHandler())
-    eLogger = logging_plus.getLogger(EnvironmentSensor.__name__)
+    eLogger = logging_plus.getLogger(SENSOR_LOGGER)
     eLogger.addHandler(logging.NullHandler())
     fLogger = logging_plus.getLogger(weatherForecastOWM.__name__)
     fLogger.addHandler(logging.NullHandler())
@@ -171,7 +266,8 @@ def getCl():
         # Set config file for logging
         dictConfig(logDict)
         logger = logging.getLogger()
-        EnvironmentSensor.logger = logging.getLogger(EnvironmentSensor.__name__)
+        if EnvironmentSensor:
+            EnvironmentSensor.logger = logging.getLogger(SENSOR_LOGGER)
         # Activate logging of function entry and exit
         #logging_plus.registerAutoLogEntryExit()
 
@@ -198,6 +294,9 @@ def getCl():
     if args.service:
         servRun = True
 
+    if args.rebuild:
+        rebuildRun = True
+
     if testRun:    
         logger.debug("Test run mode activated")
     else:
@@ -261,21 +360,44 @@ def getConfig():
         with open(cfgFile, 'r') as f:
             conf = json.load(f)
             if "sensorType" in conf:
-                if conf["sensorType"] not in EnvironmentSensor.sensorTypes:
-                    raise ValueError("Invalid sensorType specified in Configuration file. Allowed types are:", EnvironmentSensor.sensorTypes)
+                if conf["sensorType"] not in sensorTypes():
+                    raise ValueError("Invalid sensorType specified in Configuration file. Allowed types are:", sensorTypes())
                 cfg["sensorType"] = conf["sensorType"]
             if "raspiPin" in conf:
                 cfg["raspiPin"] = conf["raspiPin"]
-            else:
-                if cfg["sensorType"] == EnvironmentSensor.type_BME280_SPI \
-                or cfg["sensorType"] == EnvironmentSensor.type_DHT11 \
-                or cfg["sensorType"] == EnvironmentSensor.type_DHT22:
+            elif "sensors" not in conf:
+                if cfg["sensorType"] in PIN_SENSOR_TYPES:
                     raise ValueError("Configuration file requires raspiPin for sensor type ", cfg["sensorType"])
+            if "simulation" in conf:
+                cfg["simulation"] = conf["simulation"]
+            if "replay" in conf:
+                cfg["replay"] = conf["replay"]
+            if "sensors" in conf:
+                for sens in conf["sensors"]:
+                    sensorCfg = stationSensors.sensorDefaults.copy()
+                    if "sensorType" not in sens:
+                        raise ValueError("Configuration file requires sensors.sensorType")
+                    for key in sensorCfg:
+                        if key in sens:
+                            sensorCfg[key] = sens[key]
+                    cfg["sensors"].append(sensorCfg)
             if "measurementInterval" in conf:
                 cfg["measurementInterval"] = conf["measurementInterval"]
+                if cfg["measurementInterval"] <= 0:
+                    raise ValueError("Configuration file requires positive measurementInterval")
+            if "scheduler" in conf:
+                for key in cfg["scheduler"]:
+                    if key in conf["scheduler"]:
+                        cfg["scheduler"][key] = conf["scheduler"][key]
+            if "oversampling" in conf:
+                for key in cfg["oversampling"]:
+                    if key in conf["oversampling"]:
+                        cfg["oversampling"][key] = conf["oversampling"][key]
+            if "utc" in conf:
+                cfg["utc"] = conf["utc"]
             if "height" in conf:
                 cfg["height"] = conf["height"]
-            else:
+            elif "sensors" not in conf or any("height" not in sens for sens in conf["sensors"]):
                 raise ValueError("Configuration file requires height")
             if "dbOut" in conf:
                 cfg["dbOut"] = conf["dbOut"]
@@ -285,19 +407,29 @@ def getConfig():
                 cfg["includeMeasurement"] = conf["includeMeasurement"]
             if "includeForecast" in conf:
                 cfg["includeForecast"] = conf["includeForecast"]
+            if "storage" in conf:
+                for key in cfg["storage"]:
+                    if key in conf["storage"]:
+                        cfg["storage"][key] = conf["storage"][key]
+                if cfg["storage"]["backend"] not in storage.BACKENDS:
+                    raise ValueError("Invalid storage.backend specified in Configuration file. Allowed values are: " + ", ".join(storage.BACKENDS))
+            # The server connection is only required for MariaDB
+            serverDb = cfg["storage"]["backend"] == "mariadb"
             if cfg["dbOut"]:
+                if not serverDb and not cfg["storage"]["file"]:
+                    raise ValueError("Configuration file requires storage.file")
                 if "dbConnection" in conf:
                     if "host" in conf["dbConnection"]:
                         cfg["dbConnection"]["host"] = conf["dbConnection"]["host"]
-                    else:
+                    elif serverDb:
                         raise ValueError("Configuration file requires dbConnection.host")
                     if "port" in conf["dbConnection"]:
                         cfg["dbConnection"]["port"] = conf["dbConnection"]["port"]
-                    else:
+                    elif serverDb:
                         raise ValueError("Configuration file requires dbConnection.port")
                     if "database" in conf["dbConnection"]:
                         cfg["dbConnection"]["database"] = conf["dbConnection"]["database"]
-                    else:
+                    elif serverDb:
                         raise ValueError("Configuration file requires dbConnection.database")
                     if "table" in conf["dbConnection"]:
                         cfg["dbConnection"]["table"] = conf["dbConnection"]["table"]
@@ -305,14 +437,34 @@ def getConfig():
                         raise ValueError("Configuration file requires dbConnection.table")
                     if "user" in conf["dbConnection"]:
                         cfg["dbConnection"]["user"] = conf["dbConnection"]["user"]
-                    else:
+                    elif serverDb:
                         raise ValueError("Configuration file requires dbConnection.user")
                     if "password" in conf["dbConnection"]:
                         cfg["dbConnection"]["password"] = conf["dbConnection"]["password"]
-                    else:
+                    elif serverDb:
                         raise ValueError("Configuration file requires dbConnection.password")
                 else:
                     raise ValueError("Configuration file requires dbConnection")
+            if "dbWriter" in conf:
+                for key in cfg["dbWriter"]:
+                    if key in conf["dbWriter"]:
+                        cfg["dbWriter"][key] = conf["dbWriter"][key]
+            if "dbPool" in conf:
+                for key in cfg["dbPool"]:
+                    if key in conf["dbPool"]:
+                        cfg["dbPool"][key] = conf["dbPool"][key]
+            if "spool" in conf:
+                for key in cfg["spool"]:
+                    if key in conf["spool"]:
+                        cfg["spool"][key] = conf["spool"][key]
+            if "rollup" in conf:
+                for key in cfg["rollup"]:
+                    if key in conf["rollup"]:
+                        cfg["rollup"][key] = conf["rollup"][key]
+            if "maintenance" in conf:
+                for key in cfg["maintenance"]:
+                    if key in conf["maintenance"]:
+                        cfg["maintenance"][key] = conf["maintenance"][key]
             if cfg["fileOut"]:
                 if "fileName" in conf:
                     cfg["fileName"] = conf["fileName"]
@@ -326,11 +478,11 @@ def getConfig():
                         if "payload" in conf["forecast"]["source"]:
                             if "lat" in conf["forecast"]["source"]["payload"]:
                                 cfg["forecast"]["source"]["payload"]["lat"] = conf["forecast"]["source"]["payload"]["lat"]
-                            else:
+                            elif "locations" not in conf["forecast"]:
                                 raise ValueError("Configuration file requires forecast.source.payload.lat")
                             if "lon" in conf["forecast"]["source"]["payload"]:
                                 cfg["forecast"]["source"]["payload"]["lon"] = conf["forecast"]["source"]["payload"]["lon"]
-                            else:
+                            elif "locations" not in conf["forecast"]:
                                 raise ValueError("Configuration file requires forecast.source.payload.lon")
                             if "units" in conf["forecast"]["source"]["payload"]:
                                 cfg["forecast"]["source"]["payload"]["units"] = conf["forecast"]["source"]["payload"]["units"]
@@ -353,7 +505,17 @@ def getConfig():
                         cfg["forecast"]["forecastFileOut"] = conf["forecast"]["forecastFileOut"]
                     if "forecastRetain" in conf["forecast"]:
                         cfg["forecast"]["forecastRetain"] = conf["forecast"]["forecastRetain"]
-                    if cfg["forecast"]["forecastDbOut"]:
+                    if "refreshInterval" in conf["forecast"]:
+                        cfg["forecast"]["refreshInterval"] = conf["forecast"]["refreshInterval"]
+                    if "mapping" in conf["forecast"]:
+                        if conf["forecast"]["mapping"] not in ["rows", "columns"]:
+                            raise ValueError("Invalid forecast.mapping specified in Configuration file. Allowed values are: rows, columns")
+                        cfg["forecast"]["mapping"] = conf["forecast"]["mapping"]
+                    if "http" in conf["forecast"]:
+                        for key in cfg["forecast"]["http"]:
+                            if key in conf["forecast"]["http"]:
+                                cfg["forecast"]["http"][key] = conf["forecast"]["http"][key]
+                    if cfg["forecast"]["forecastDbOut"] and "locations" not in conf["forecast"]:
                         if "forecastTables" in conf["forecast"]:
                             if "hourlyForecast" in conf["forecast"]["forecastTables"]:
                                 cfg["forecast"]["forecastTables"]["hourlyForecast"] = conf["forecast"]["forecastTables"]["hourlyForecast"]
@@ -374,87 +536,117 @@ def getConfig():
                             cfg["forecast"]["forecastFile"] = conf["forecast"]["forecastFile"]
                         else:
                             raise ValueError("Configuration file requires forecast.forecastFile")
+                    if "maxConcurrency" in conf["forecast"]:
+                        cfg["forecast"]["maxConcurrency"] = conf["forecast"]["maxConcurrency"]
+                    if "locations" in conf["forecast"]:
+                        tables = set()
+                        for loc in conf["forecast"]["locations"]:
+                            location = {
+                                "name"          : None,
+                                "payload"       : cfg["forecast"]["source"]["payload"].copy(),
+                                "forecastTables": None
+                            }
+                            if "lat" in loc:
+                                location["payload"]["lat"] = loc["lat"]
+                            else:
+                                raise ValueError("Configuration file requires forecast.locations.lat")
+                            if "lon" in loc:
+                                location["payload"]["lon"] = loc["lon"]
+                            else:
+                                raise ValueError("Configuration file requires forecast.locations.lon")
+                            if "name" in loc:
+                                location["name"] = loc["name"]
+                            else:
+                                location["name"] = "{},{}".format(loc["lat"], loc["lon"])
+                            if cfg["forecast"]["forecastDbOut"]:
+                                if "forecastTables" in loc:
+                                    location["forecastTables"] = {}
+                                    for tbl in ["hourlyForecast", "dailyForecast", "alertsForecast"]:
+                                        if tbl in loc["forecastTables"]:
+                                            location["forecastTables"][tbl] = loc["forecastTables"][tbl]
+                                        else:
+                                            raise ValueError("Configuration file requires forecast.locations.forecastTables." + tbl)
+                                else:
+                                    raise ValueError("Configuration file requires forecast.locations.forecastTables")
+                                if location["forecastTables"]["hourlyForecast"] in tables \
+                                or location["forecastTables"]["dailyForecast"] in tables:
+                                    raise ValueError("Forecast locations require separate forecast tables: ", location["name"])
+                                tables.add(location["forecastTables"]["hourlyForecast"])
+                                tables.add(location["forecastTables"]["dailyForecast"])
+                            cfg["forecast"]["locations"].append(location)
                 else:
                     raise ValueError("Configuration file requires forecast")
 
-    # Check raspiPin
-    pin = cfg["raspiPin"]
-    if pin == "":
-        if cfg["sensorType"] == EnvironmentSensor.type_BME280_SPI \
-        or cfg["sensorType"] == EnvironmentSensor.type_DHT11 \
-        or cfg["sensorType"] == EnvironmentSensor.type_DHT22:
-            raise ValueError("Configuration file requires raspiPin for sensor type ", cfg["sensorType"])
-    elif pin == "PIN03":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN03
-    elif pin == "PIN05":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN05
-    elif pin == "PIN07":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN07
-    elif pin == "PIN08":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN08
-    elif pin == "PIN10":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN10
-    elif pin == "PIN11":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN11
-    elif pin == "PIN12":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN12
-    elif pin == "PIN13":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN13
-    elif pin == "PIN15":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN15
-    elif pin == "PIN16":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN16
-    elif pin == "PIN18":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN18
-    elif pin == "PIN19":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN19
-    elif pin == "PIN21":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN21
-    elif pin == "PIN22":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN22
-    elif pin == "PIN23":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN23
-    elif pin == "PIN24":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN24
-    elif pin == "PIN26":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN26
-    elif pin == "PIN27":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN27
-    elif pin == "PIN28":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN28
-    elif pin == "PIN29":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN29
-    elif pin == "PIN31":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN31
-    elif pin == "PIN32":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN32
-    elif pin == "PIN33":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN33
-    elif pin == "PIN35":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN35
-    elif pin == "PIN36":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN36
-    elif pin == "PIN37":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN37
-    elif pin == "PIN38":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN38
-    elif pin == "PIN40":
-        cfg["raspiPinObj"] = EnvironmentSensor.PIN40
-    else:
-        raise ValueError("Invalid raspiPin in configuration file: ", pin)
+    # Single forecast location from forecast source
+    if cfg["includeForecast"] and len(cfg["forecast"]["locations"]) == 0:
+        cfg["forecast"]["locations"].append({
+            "name"          : "{},{}".format(cfg["forecast"]["source"]["payload"]["lat"], cfg["forecast"]["source"]["payload"]["lon"]),
+            "payload"       : cfg["forecast"]["source"]["payload"],
+            "forecastTables": cfg["forecast"]["forecastTables"]
+        })
+
+    # Single sensor from sensorType and raspiPin
+    if len(cfg["sensors"]) == 0:
+        sensorCfg = stationSensors.sensorDefaults.copy()
+        sensorCfg["sensorType"] = cfg["sensorType"]
+        sensorCfg["raspiPin"] = cfg["raspiPin"]
+        sensorCfg["simulation"] = cfg["simulation"]
+        sensorCfg["replay"] = cfg["replay"]
+        cfg["sensors"].append(sensorCfg)
+
+    # Check sensors
+    names = set()
+    tables = {}
+    for sensorCfg in cfg["sensors"]:
+        if sensorCfg["sensorType"] not in sensorTypes():
+            raise ValueError("Invalid sensors.sensorType specified in Configuration file. Allowed types are:", sensorTypes())
+        if sensorCfg["sensorType"] == virtualSensors.type_REPLAY and not (sensorCfg["replay"] and sensorCfg["replay"].get("file")):
+            raise ValueError("Configuration file requires replay.file for sensor type ", sensorCfg["sensorType"])
+        sensorCfg["raspiPinObj"] = getPinObj(sensorCfg["sensorType"], sensorCfg["raspiPin"])
+        if sensorCfg["name"] is None:
+            sensorCfg["name"] = sensorCfg["sensorType"]
+            if sensorCfg["raspiPin"]:
+                sensorCfg["name"] = sensorCfg["name"] + "@" + sensorCfg["raspiPin"]
+        if sensorCfg["name"] in names:
+            raise ValueError("Sensors require distinct names: ", sensorCfg["name"])
+        names.add(sensorCfg["name"])
+        if sensorCfg["height"] is None:
+            sensorCfg["height"] = cfg["height"]
+        if sensorCfg["table"] is None:
+            sensorCfg["table"] = cfg["dbConnection"]["table"]
+        tables.setdefault(sensorCfg["table"], []).append(sensorCfg["sensorId"])
+    for table, sensorIds in tables.items():
+        if len(sensorIds) > 1 or sensorIds[0] is not None:
+            if None in sensorIds or len(set(sensorIds)) < len(sensorIds):
+                raise ValueError("Sensors sharing a table require distinct sensorIds: ", table)
 
     logger.info("Configuration:")
-    logger.info("    sensorType:         %s", cfg["sensorType"])
-    logger.info("    raspiPin:           %s", cfg["raspiPin"])
+    for sensorCfg in cfg["sensors"]:
+        logger.info("    sensor:             %s (sensorType=%s, raspiPin=%s, height=%s, table=%s, sensorId=%s, deadline=%s)",
+                    sensorCfg["name"], sensorCfg["sensorType"], sensorCfg["raspiPin"], sensorCfg["height"],
+                    sensorCfg["table"], sensorCfg["sensorId"], sensorCfg["deadline"])
+        if sensorCfg["sensorType"] == virtualSensors.type_SIMULATED:
+            logger.info("       simulation:      %s", sensorCfg["simulation"])
+        if sensorCfg["sensorType"] == virtualSensors.type_REPLAY:
+            logger.info("       replay:          %s", sensorCfg["replay"])
     logger.info("    measurementInterval:%s", cfg["measurementInterval"])
+    logger.info("    scheduler:          %s", cfg["scheduler"])
+    logger.info("    oversampling:       %s", cfg["oversampling"])
+    logger.info("    utc:                %s", cfg["utc"])
     logger.info("    height:             %s", cfg["height"])
     logger.info("    dbOut:              %s", cfg["dbOut"])
+    logger.info("    storage:            %s", cfg["storage"])
     logger.info("       host:            %s", cfg["dbConnection"]["host"])
     logger.info("       port:            %s", cfg["dbConnection"]["port"])
     logger.info("       database:        %s", cfg["dbConnection"]["database"])
     logger.info("       table:           %s", cfg["dbConnection"]["table"])
     logger.info("       user:            %s", cfg["dbConnection"]["user"])
     logger.info("       password:        %s", cfg["dbConnection"]["password"])
+    logger.info("    dbWriter:           %s", cfg["dbWriter"])
+    logger.info("    dbPool:             %s", cfg["dbPool"])
+    logger.info("    spool:              %s", cfg["spool"])
+    logger.info("    rollup:             %s", cfg["rollup"])
+    logger.info("    maintenance:        %s", cfg["maintenance"])
     logger.info("    fileOut:            %s", cfg["fileOut"])
     logger.info("       fileName:        %s", cfg["fileName"])
     logger.info("    includeMeasurement: %s", cfg["includeMeasurement"])
@@ -468,90 +660,63 @@ def getConfig():
     logger.info("       forecastDbOut:   %s", cfg["forecast"]["forecastDbOut"])
     logger.info("       forecastFileOut: %s", cfg["forecast"]["forecastFileOut"])
     logger.info("       forecastRetain : %s", cfg["forecast"]["forecastRetain"])
+    logger.info("       refreshInterval: %s", cfg["forecast"]["refreshInterval"])
+    logger.info("       mapping:         %s", cfg["forecast"]["mapping"])
+    logger.info("       http:            %s", cfg["forecast"]["http"])
     logger.info("       hourlyForecast:  %s", cfg["forecast"]["forecastTables"]["hourlyForecast"])
     logger.info("       dailyForecast:   %s", cfg["forecast"]["forecastTables"]["dailyForecast"])
     logger.info("       forecastFile:    %s", cfg["forecast"]["forecastFile"])
+    logger.info("       maxConcurrency:  %s", cfg["forecast"]["maxConcurrency"])
+    for location in cfg["forecast"]["locations"]:
+        logger.info("       location:        %s (lat=%s, lon=%s, tables=%s)", location["name"], location["payload"]["lat"], location["payload"]["lon"], location["forecastTables"])
 
-def waitForNextCycle():
+def sensorTypes():
     """
-    Wait for next measurement cycle.
+    Return the available sensor types
 
-    This function assures that measurements are done at specific times depending on the specified interval
-    In case that measurementInterval is an integer multiple of 60, the waiting time is calculated in a way,
-    that one measurement is done every full hour.
+    Sensors of the Raspberry Pi are only available if snraspi is installed.
     """
-    global cfg
+    types = list(virtualSensors.SENSOR_TYPES)
+    if EnvironmentSensor:
+        types = list(EnvironmentSensor.sensorTypes) + types
+    return types
 
-    if (cfg["measurementInterval"] % 60 == 0)\
-    or (cfg["measurementInterval"] % 120 == 0)\
-    or (cfg["measurementInterval"] % 240 == 0)\
-    or (cfg["measurementInterval"] % 300 == 0)\
-    or (cfg["measurementInterval"] % 360 == 0)\
-    or (cfg["measurementInterval"] % 600 == 0)\
-    or (cfg["measurementInterval"] % 720 == 0)\
-    or (cfg["measurementInterval"] % 900 == 0)\
-    or (cfg["measurementInterval"] % 1200 == 0)\
-    or (cfg["measurementInterval"] % 1800 == 0):
-        tNow = datetime.datetime.now()
-        seconds = 60 * tNow.minute
-        period = math.floor(seconds/cfg["measurementInterval"])
-        waitTimeSec = (period + 1) * cfg["measurementInterval"] - (60 * tNow.minute + tNow.second + tNow.microsecond / 1000000)
-        logger.debug("At %s waiting for %s sec.", datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"), waitTimeSec)
-        time.sleep(waitTimeSec)
-    elif (cfg["measurementInterval"] % 2 == 0)\
-      or (cfg["measurementInterval"] % 4 == 0)\
-      or (cfg["measurementInterval"] % 5 == 0)\
-      or (cfg["measurementInterval"] % 6 == 0)\
-      or (cfg["measurementInterval"] % 10 == 0)\
-      or (cfg["measurementInterval"] % 12 == 0)\
-      or (cfg["measurementInterval"] % 15 == 0)\
-      or (cfg["measurementInterval"] % 20 == 0)\
-      or (cfg["measurementInterval"] % 30 == 0):
-            tNow = datetime.datetime.now()
-            seconds = 60 * tNow.minute + tNow.second
-            period = math.floor(seconds/cfg["measurementInterval"])
-            waitTimeSec = (period + 1) * cfg["measurementInterval"] - seconds
-            logger.debug("At %s waiting for %s sec.", datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"), waitTimeSec)
-            time.sleep(waitTimeSec)
-    else:
-        waitTimeSec =cfg["measurementInterval"]
-        logger.debug("At %s waiting for %s sec.", datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"), waitTimeSec)
-        time.sleep(waitTimeSec)
-
-def pressureReduced(p, h, t):
+def getPinObj(sensorType, pin):
     """
-    Calculate reducet atmospheric pressure according to Barometric formula.
+    Return the pin object for a Raspberry Pi GPIO pin in BOARD notation
 
-    Source: https://de.wikipedia.org/wiki/Barometrische_H%C3%B6henformel
     Input:
-    p: pressure at height h (in hPa)
-    h: height of measurement station in m
-    t: Temperature in °C
+    - sensorType: Type of the sensor
+    - pin       : Pin in BOARD notation (e.g. "PIN13"). None or "" if no pin is required
     """
-    import math
-
-    # Constants
-    g0 = 9.80665    # Gravitational acceleration (m/s**2)
-    R  = 287.05     # Universal gas constant (m**2/s**2 K)
-    t0 = 273.15     # Absolute temperature 0°C (K)
-    a  = 0.0065     # Vertical temperature gradient
-    C  = 0.12       # Parameter for consideration of vapor pressure
-    tl = 9.1        # Temperature threshold for approximation of vapor pressure (°C)
-
-    p0 = p
-    if (h != None) and (t != None):
-        if t < tl:
-            E = 5.6402 * (-0.0916 + math.exp(0.06 * t))
-        else:
-            E = 18.2194 * (1.0463 - math.exp(-0.0666 * t))
-
-        x = g0 * h / (R * (t + t0 + C * E + a * h / 2))
-
-        p0 = p * math.exp(x)
-
-    logger.debug("p0(p=%s, h=%s, t=%s) = %s", p, h, t, p0)
+    if not pin:
+        if sensorType in PIN_SENSOR_TYPES:
+            raise ValueError("Configuration file requires raspiPin for sensor type ", sensorType)
+        return None
+    if sensorType in virtualSensors.SENSOR_TYPES:
+        return None
+    if pin not in RASPI_PINS:
+        raise ValueError("Invalid raspiPin in configuration file: ", pin)
+    return getattr(EnvironmentSensor, pin)
 
-    return p0
+def createSensor(sensorCfg):
+    """
+    Instantiate the sensor object for a sensor of the configuration
+    """
+    sensor = None
+    if sensorCfg["sensorType"] == virtualSensors.type_SIMULATED:
+        sensor = virtualSensors.SimulatedSensor.fromConfig(sensorCfg["simulation"])
+    elif sensorCfg["sensorType"] == virtualSensors.type_REPLAY:
+        sensor = virtualSensors.ReplaySensor.fromConfig(sensorCfg["replay"])
+    elif sensorCfg["sensorType"] == EnvironmentSensor.type_BME280_I2C:
+        sensor = EnvironmentSensor.BME280_I2C()
+    elif sensorCfg["sensorType"] == EnvironmentSensor.type_BME280_SPI:
+        sensor = EnvironmentSensor.BME280_SPI(sensorCfg["raspiPinObj"])
+    elif sensorCfg["sensorType"] == EnvironmentSensor.type_DHT11:
+        sensor = EnvironmentSensor.DHT11(sensorCfg["raspiPinObj"])
+    elif sensorCfg["sensorType"] == EnvironmentSensor.type_DHT22:
+        sensor = EnvironmentSensor.DHT22(sensorCfg["raspiPinObj"])
+    return sensor
 
 #============================================================================================
 # Start __main__
@@ -566,46 +731,86 @@ logger.info("=============================================================")
 
 # Get configuration
 getConfig()
-
-# Database connection, if required
+timestamps.setUtc(cfg["utc"])
+
+# Database connections, if required
+# Measurements and forecasts use separate connection pools, so that one cannot stall the other.
+# Measurements are written by a background writer which connects on its own,
+# so that the station keeps measuring while the database is unreachable.
+# In the meantime, measurements and forecasts are kept in the spool.
+# For a test run, the forecast is stored within the cycle.
 con = None
+cur = None
+measWriters = {}
+measPool = None
+fcPool = None
+dbSpool = None
+if rebuildRun and not cfg["dbOut"]:
+    logger.error("Rebuild of rollup tables requires dbOut")
+    sys.exit(1)
 if cfg["dbOut"]:
+    dbBackend = storage.fromConfig(cfg)
+    storage.setBackend(dbBackend)
+    # Each measurement table has its own writer
+    # Rollup tables are only maintained for dbConnection.table, if it is not shared by several sensors
+    measTables = stationSensors.measurementTables(cfg)
+    measRollup = None
+    rollupTable = cfg["dbConnection"]["table"]
+    if rollupTable in measTables:
+        if SENSOR_COLUMN in measTables[rollupTable]:
+            if cfg["rollup"]["hourlyTable"] or cfg["rollup"]["dailyTable"]:
+                logger.warning("Rollup tables are not maintained for table %s shared by several sensors", rollupTable)
+        else:
+            measRollup = rollup.Rollup.fromConfig(rollupTable, cfg["rollup"], measTables[rollupTable])
+    if rebuildRun:
+        # One-shot rebuild of rollup tables
+        if not measRollup:
+            logger.error("No rollup tables configured")
+            sys.exit(1)
+        con = dbBackend.connect()
+        measRollup.rebuild(con, con.cursor())
+        con.close()
+        sys.exit(0)
+    dbSpool = spool.Spool.fromConfig(cfg["spool"])
+    if cfg["includeMeasurement"]:
+        measPool = dbPool.ConnectionPool.fromConfig(dbBackend, "measurement", cfg["dbPool"])
+        for table, columns in measTables.items():
+            measWriters[table] = dbWriter.MeasurementWriter.fromConfig(measPool, table, columns, cfg["dbWriter"], dbSpool,
+                                                                       measRollup if table == rollupTable else None)
+    if cfg["includeForecast"]:
+        fcPool = dbPool.ConnectionPool.fromConfig(dbBackend, "forecast", cfg["dbPool"])
     try:
-        con = mariadb.connect(
-            user=cfg["dbConnection"]["user"],
-            password=cfg["dbConnection"]["password"],
-            host=cfg["dbConnection"]["host"],
-            port=cfg["dbConnection"]["port"],
-            database=cfg["dbConnection"]["database"]
-        )
-        logger.debug("Database connection successful")
-
-    except mariadb.Error as e:
-        print("Error connecting to MariaDB: {e}")
+        if testRun and cfg["includeForecast"]:
+            con = fcPool.acquire()
+            cur = dbBackend.cursor(con)
+
+    except storage.DB_ERRORS as e:
+        print("Error connecting to database: {e}")
         sys.exit(1)
 
-    # Get DB cursor
-    cur = con.cursor()
+    for measWriter in measWriters.values():
+        measWriter.start()
 
-# Instantiate sensor
+# Instantiate sensors
+# All sensors are polled concurrently, so that a slow sensor does not delay the others
+poller = None
 if cfg["includeMeasurement"]:
-    try:
-        if cfg["sensorType"] == EnvironmentSensor.type_BME280_I2C:
-            sensor = EnvironmentSensor.BME280_I2C()
-        if cfg["sensorType"] == EnvironmentSensor.type_BME280_SPI:
-            sensor = EnvironmentSensor.BME280_SPI(cfg["raspiPinObj"])
-        if cfg["sensorType"] == EnvironmentSensor.type_DHT11:
-            sensor = EnvironmentSensor.DHT11(cfg["raspiPinObj"])
-        if cfg["sensorType"] == EnvironmentSensor.type_DHT22:
-            sensor = EnvironmentSensor.DHT22(cfg["raspiPinObj"])
-
-        logger.debug("Sensor instantiated: %s", cfg["sensorType"])
-
-    except Exception as e:
-        logger.error("Sensor instantiation error: %s", e)
-        sensor = None
-else:
-    sensor = None
+    sensors = list()
+    for sensorCfg in cfg["sensors"]:
+        try:
+            sensor = createSensor(sensorCfg)
+            logger.debug("Sensor instantiated: %s (%s)", sensorCfg["name"], sensorCfg["sensorType"])
+
+        except Exception as e:
+            logger.error("Sensor instantiation error: %s: %s", sensorCfg["name"], e)
+            sensor = None
+        oversampler = None
+        if sensor:
+            oversampler = oversampling.Oversampler.fromConfig(cfg["oversampling"], sensorCfg["sensorType"], cfg["measurementInterval"])
+        sensors.append(stationSensors.StationSensor(sensorCfg["name"], sensorCfg["sensorType"], sensor, sensorCfg["height"],
+                                                    sensorCfg["table"], sensorCfg["sensorId"], sensorCfg["deadline"],
+                                                    oversampler, cfg["oversampling"]["statistics"]))
+    poller = stationSensors.SensorPoller(sensors)
 
 # Open output file
 f = None
@@ -623,6 +828,27 @@ if cfg["forecast"]["forecastFileOut"]:
 
     fcf.write('{"forecast": [')
 
+# Forecast handling
+# For a test run, the forecast is handled within the cycle.
+# Otherwise, a background worker handles the forecast with its own database connection
+fcScheduler = None
+fcWorker = None
+if cfg["includeForecast"]:
+    if testRun:
+        fcScheduler = forecastScheduler.ForecastScheduler(cfg)
+    else:
+        fcWorker = forecastWorker.ForecastWorker(cfg, fcPool, servRun, fcSpool=dbSpool)
+        fcWorker.start()
+
+# Periodic maintenance of tables in a background thread
+maintWorker = None
+if cfg["dbOut"] and cfg["maintenance"]["interval"] and not testRun:
+    maintWorker = maintenance.MaintenanceWorker(maintenance.Maintenance.fromConfig(dbBackend, cfg), cfg["maintenance"]["interval"])
+    maintWorker.start()
+
+# Measurement cycles aligned to the wall clock
+scheduler = cycleScheduler.CycleScheduler.fromConfig(cfg["measurementInterval"], cfg["scheduler"], cfg["utc"])
+
 noWait = False
 stop = False
 
@@ -630,112 +856,85 @@ while not stop:
     try:
         # Wait unless noWait is set in case of sensor error.
         # Akip waiting for test run
+        # Measurements are stamped with the slot of the cycle
+        slot = None
         if not noWait and not testRun:
-            waitForNextCycle()
+            slot = scheduler.wait()
         noWait = False
 
         # Prepare database statement
-        curDateTime  = datetime.datetime.now()
-        curTimestamp = curDateTime.strftime("%Y-%m-%d %H:%M:%S")
-        curDate      = curDateTime.strftime("%Y-%m-%d")
-        curTime      = curDateTime.strftime("%H:%M:%S")
-        txt = curTimestamp
-        if cfg["dbOut"]:
-            ins1 = "INSERT INTO " + cfg["dbConnection"]["table"] + " (timestamp, date, time"
-            ins2 = "VALUES ('"  + curTimestamp + "', '" + curDate + "', '" + curTime + "'"
+        if slot is None:
+            curTimestamp, curDate, curTime = timestamps.now()
         else:
-            ins1 = ""
-            ins2 = ""
-
-        if cfg["includeMeasurement"]:
-            # Get temperature from sensor
-            if sensor:
-                temperature = sensor.temperature
-            else:
-                temperature = None
-            if temperature is None:
-                txt = txt + ","
-            else:
-                txt = txt + "{:+.1f},".format(temperature)
-                ins1 = ins1 + ", temperature"
-                ins2 = ins2 + ", " + "{:+.1f}".format(temperature)
-
-            # Get humidity from sensor
-            if sensor:
-                humidity = sensor.humidity
-            else:
-                humidity = None
-            if humidity is None:
-                txt = txt + ","
-            else:
-                txt = txt + "{:.1f},".format(humidity)
-                ins1 = ins1 + ", humidity"
-                ins2 = ins2 + ", " + "{:+.1f}".format(humidity)
-
-            # Get pressure from sensor
-            if sensor:
-                pressure = sensor.pressure
-            else:
-                pressure = None
-            if pressure is None:
-                txt = txt + ","
-            else:
-                txt = txt + "{:.1f},".format(pressure)
-                ins1 = ins1 + ", pressure_m"
-                ins2 = ins2 + ", " + "{:+.1f}".format(pressure)
-                pressure_r = pressureReduced(pressure, cfg["height"], temperature)
-                txt = txt + "{:.1f},".format(pressure_r)
-                ins1 = ins1 + ", pressure"
-                ins2 = ins2 + ", " + "{:+.1f}".format(pressure_r)
-
-            # Get altitude from sensor
-            if sensor:
-                altitude = sensor.altitude
-            else:
-                altitude = None
-            if pressure is None:
-                txt = txt + ","
-            else:
-                txt = txt + "{:.1f}".format(altitude)
-                ins1 = ins1 + ", altitude"
-                ins2 = ins2 + ", " + "{:+.1f}".format(altitude)
-
-            txt = txt + "\n"
-            
-            # Write to file, if required
-            if cfg["fileOut"]:
-                f.write(txt)
-
-            # Log measurement
-            if servRun:
-                logger.debug("Measurement: %s", txt)
-            else:
-                logger.info("Measurement: %s", txt)
+            # Rounded, so that float errors of the slot do not truncate to the previous second
+            curTimestamp, curDate, curTime = timestamps.split(round(slot, 3))
+
+        if poller:
+            results = poller.poll(curTimestamp, curDate, curTime, 0 if testRun else cfg["measurementInterval"])
+            for stationSensor, sample, error in results:
+                if error:
+                    if len(results) == 1:
+                        # With a single sensor, the measurement is repeated without waiting
+                        raise error
+                    # Other sensors keep their measurements
+                    if not servRun or not isinstance(error, RuntimeError):
+                        logger.error("Sensor %s: %s", stationSensor.name, error)
+                    continue
+
+                txt = sample.toText()
+
+                # Write to file, if required (first sensor only)
+                if cfg["fileOut"] and stationSensor is poller.sensors[0]:
+                    f.write(txt)
+
+                # Log measurement
+                if servRun:
+                    logger.debug("Measurement %s: %s", stationSensor.name, txt)
+                else:
+                    logger.info("Measurement %s: %s", stationSensor.name, txt)
 
-            # Insert into database, if required
-            if cfg["dbOut"]:
-                ins = ins1 + ") " + ins2 + ")"
-                logger.debug(ins)
-                cur.execute(ins)
-                con.commit()
+                # Queue for database, if required
+                measWriter = measWriters.get(stationSensor.table)
+                if measWriter:
+                    if measWriter.error:
+                        raise measWriter.error
+                    measWriter.put(sample)
 
         # Get forecast
-        if cfg["includeForecast"]:
-            weatherForecastOWM.handleForecast(cfg, curTimestamp, curDate, curTime, con, cur, fcf, servRun)
+        if fcScheduler:
+            fcScheduler.handleForecast(curTimestamp, curDate, curTime, con, cur, fcf, servRun)
+
+        # Collect results from forecast worker
+        if fcWorker:
+            for fcResult in fcWorker.getResults():
+                if fcResult.error:
+                    raise fcResult.error
+                if cfg["forecast"]["forecastFileOut"]:
+                    weatherForecastOWM.forecastToFile(fcResult.forecast, cfg, fcResult.curTs, fcf, servRun, fcResult.location)
 
         if testRun:
             # Stop in case of test run
             stop = True
 
-    except mariadb.Error as e:
-        logger.error("MariaDB Error: %s", e.msg)
+    except storage.DB_ERRORS as e:
+        logger.error("Database Error: %s", e)
+        if poller:
+            poller.close()
         if f:
             f.close()
         if fcf:
             fcf.write(']}')
-            fcf.close
+            fcf.close()
+        if fcWorker:
+            fcWorker.stop()
+        if maintWorker:
+            maintWorker.stop()
+        for measWriter in measWriters.values():
+            measWriter.stop()
+        if measPool:
+            measPool.closeAll()
         if con:
-            con.close()
+            fcPool.release(con, broken=True)
         raise e
 
     except RuntimeError as error:
@@ -752,37 +951,62 @@ while not stop:
             continue
 
     except Exception as error:
-        if sensor:
-            del sensor
+        if poller:
+            poller.close()
         if f:
             f.close()
         if fcf:
             fcf.write(']}')
-            fcf.close
+            fcf.close()
+        if fcWorker:
+            fcWorker.stop()
+        if maintWorker:
+            maintWorker.stop()
+        for measWriter in measWriters.values():
+            measWriter.stop()
+        if measPool:
+            measPool.closeAll()
         if con:
-            con.close()
+            fcPool.release(con)
         raise error
 
     except KeyboardInterrupt:
-        if sensor:
-            del sensor
-        if f:
-            f.close()
-        if fcf:
-            fcf.write(']}')
-            fcf.close
-        if con:
-            con.close()
+        # Cleanup after the loop
+        stop = True
 
 if con:
-    con.close()
-if sensor:
-    del sensor
+    fcPool.release(con)
+if poller:
+    poller.close()
 if f:
     f.close()
 if fcf:
     fcf.write(']}')
-    fcf.close
+    fcf.close()
+if fcScheduler:
+    fcScheduler.close()
+if fcWorker:
+    fcWorker.stop()
+if maintWorker:
+    maintWorker.stop()
+    logger.info("Maintenance statistics: %s", maintWorker.maintenance.getStats())
+for table, measWriter in measWriters.items():
+    measWriter.stop()
+    logger.info("Measurement writer statistics %s: %s", table, measWriter.getStats())
+# The pool is shared by all writers and closed after all of them have stopped
+if measPool:
+    measPool.closeAll()
+logger.info("Scheduler statistics: %s", scheduler.getStats())
+if poller:
+    for name, sensorStats in poller.getStats().items():
+        logger.info("Sensor statistics %s: %s", name, sensorStats)
+if measPool:
+    logger.info("Measurement connection pool statistics: %s", measPool.getStats())
+if fcPool:
+    logger.info("Forecast connection pool statistics: %s", fcPool.getStats())
+if dbSpool:
+    logger.info("Spool statistics: %s", dbSpool.getStats())
+    dbSpool.close()
 
 logger.info("=============================================================")
 logger.info("Weatherstation terminated")
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+"""
+Tests for the forecast HTTP client against a local stub server
+
+Run with
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snweatherstation"))
+import requests
+import forecastClient
+
+class StubServer:
+    """
+    Class representing a local HTTP server answering with scripted responses
+
+    Each response is a tuple (status, headers, body). The last response is repeated
+    when all responses have been used. Request headers are recorded.
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = list()
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests.append(dict(self.headers))
+                    if len(stub.responses) > 1:
+                        status, headers, body = stub.responses.pop(0)
+                    else:
+                        status, headers, body = stub.responses[0]
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/onecall".format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class ForecastClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = None
+        self.client = forecastClient.ForecastClient(connectTimeout=1, readTimeout=2, retries=2, backoffFactor=0.01, backoffMax=0.05)
+
+    def tearDown(self):
+        self.client.close()
+        if self.stub:
+            self.stub.close()
+
+    def serve(self, *responses):
+        self.stub = StubServer(responses)
+        return self.stub.url
+
+    def test_etagNotModified(self):
+        url = self.serve((200, {"ETag": '"v1"'}, {"current": 1}), (304, {}, None))
+        self.assertEqual(self.client.getJson(url, {"lat": 1}), {"current": 1})
+        self.assertEqual(self.client.getJson(url, {"lat": 1}), {"current": 1})
+        self.assertEqual(self.stub.requests[1].get("If-None-Match"), '"v1"')
+        stats = self.client.getStats()
+        self.assertEqual(stats["downloads"], 1)
+        self.assertEqual(stats["notModified"], 1)
+
+    def test_lastModified(self):
+        url = self.serve((200, {"Last-Modified": "Sat, 17 Oct 2026 10:00:00 GMT"}, {"current": 1}), (304, {}, None))
+        self.client.getJson(url, {"lat": 1})
+        self.client.getJson(url, {"lat": 1})
+        self.assertEqual(self.stub.requests[1].get("If-Modified-Since"), "Sat, 17 Oct 2026 10:00:00 GMT")
+        self.assertEqual(self.client.getStats()["notModified"], 1)
+
+    def test_validatorsKeptAfterNotModified(self):
+        url = self.serve((200, {"ETag": '"v1"'}, {"current": 1}), (304, {}, None), (304, {}, None))
+        for i in range(3):
+            self.client.getJson(url, {"lat": 1})
+        self.assertEqual(self.stub.requests[2].get("If-None-Match"), '"v1"')
+
+    def test_notModifiedWithoutCache(self):
+        url = self.serve((304, {}, None))
+        with self.assertRaises(requests.HTTPError):
+            self.client.getJson(url, {"lat": 1})
+        stats = self.client.getStats()
+        self.assertEqual(stats["downloads"], 0)
+        self.assertEqual(stats["notModified"], 0)
+
+    def test_payloadSeparatesCache(self):
+        url = self.serve((200, {"ETag": '"v1"'}, {"current": 1}))
+        self.client.getJson(url, {"lat": 1})
+        self.client.getJson(url, {"lat": 2})
+        self.assertIsNone(self.stub.requests[1].get("If-None-Match"))
+
+    def test_cacheControlMaxAge(self):
+        url = self.serve((200, {"Cache-Control": "max-age=60"}, {"current": 1}))
+        self.client.getJson(url, {"lat": 1})
+        self.assertEqual(self.client.getJson(url, {"lat": 1}), {"current": 1})
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.client.getStats()["cacheHits"], 1)
+
+    def test_cacheControlAge(self):
+        url = self.serve((200, {"Cache-Control": "max-age=60", "Age": "60"}, {"current": 1}))
+        self.client.getJson(url, {"lat": 1})
+        self.client.getJson(url, {"lat": 1})
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_cacheControlNoStore(self):
+        url = self.serve((200, {"ETag": '"v1"', "Cache-Control": "no-store"}, {"current": 1}))
+        self.client.getJson(url, {"lat": 1})
+        self.client.getJson(url, {"lat": 1})
+        self.assertIsNone(self.stub.requests[1].get("If-None-Match"))
+
+    def test_retryOnStatus(self):
+        url = self.serve((503, {"Retry-After": "0"}, None), (500, {}, None), (200, {}, {"current": 1}))
+        self.assertEqual(self.client.getJson(url, {"lat": 1}), {"current": 1})
+        stats = self.client.getStats()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["retries"], 2)
+
+    def test_retriesExhausted(self):
+        url = self.serve((503, {}, None))
+        with self.assertRaises(requests.HTTPError):
+            self.client.getJson(url, {"lat": 1})
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_noRetryOnClientError(self):
+        url = self.serve((404, {}, None))
+        with self.assertRaises(requests.HTTPError):
+            self.client.getJson(url, {"lat": 1})
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_retryOnConnectionError(self):
+        url = self.serve((200, {}, {"current": 1}))
+        self.stub.close()
+        self.stub = None
+        t0 = time.monotonic()
+        with self.assertRaises(requests.ConnectionError):
+            self.client.getJson(url, {"lat": 1})
+        self.assertEqual(self.client.getStats()["retries"], 2)
+        self.assertLess(time.monotonic() - t0, 5)
+
+    def test_stopInterruptsBackoff(self):
+        url = self.serve((503, {"Retry-After": "30"}, None))
+        stopEvent = threading.Event()
+        client = forecastClient.ForecastClient(connectTimeout=1, readTimeout=2, retries=2, backoffFactor=30, backoffMax=30, stopEvent=stopEvent)
+        threading.Timer(0.2, stopEvent.set).start()
+        t0 = time.monotonic()
+        with self.assertRaises(forecastClient.RequestCancelled):
+            client.getJson(url, {"lat": 1})
+        client.close()
+        self.assertLess(time.monotonic() - t0, 5)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_concurrentStats(self):
+        url = self.serve((200, {"Cache-Control": "max-age=60"}, {"current": 1}))
+        self.client.getJson(url, {"lat": 1})
+        threads = [threading.Thread(target=lambda: [self.client.getJson(url, {"lat": 1}) for i in range(200)]) for k in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.client.getStats()["cacheHits"], 1600)
+
+if __name__ == "__main__":
+    unittest.main()